@@ -0,0 +1,33 @@
+"""add device battery_count
+
+Revision ID: 3b1f2c9d8a47
+Revises: 7e0330be4457
+Create Date: 2026-10-18 10:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1f2c9d8a47'
+down_revision: Union[str, None] = '7e0330be4457'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'devices',
+        sa.Column('battery_count', sa.Integer(), server_default='0', nullable=False)
+    )
+    op.execute(
+        "UPDATE devices SET battery_count = ("
+        "SELECT count(*) FROM batteries WHERE batteries.device_id = devices.id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('devices', 'battery_count')
@@ -0,0 +1,34 @@
+"""add battery device indexes
+
+Revision ID: 5d2e8b1f4c73
+Revises: a1c4e7f92b60
+Create Date: 2026-10-18 16:41:09.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e8b1f4c73'
+down_revision: Union[str, None] = 'a1c4e7f92b60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f('ix_batteries_device_id'), 'batteries', ['device_id'], unique=False
+    )
+    op.create_index(
+        'ix_batteries_unattached', 'batteries', ['id'], unique=False,
+        postgresql_where=sa.text('device_id IS NULL'),
+        sqlite_where=sa.text('device_id IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_batteries_unattached', table_name='batteries')
+    op.drop_index(op.f('ix_batteries_device_id'), table_name='batteries')
@@ -0,0 +1,31 @@
+"""add version columns
+
+Revision ID: 9f3a6d20b8e1
+Revises: e4b9c2d17a05
+Create Date: 2026-10-18 23:41:07.512930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f3a6d20b8e1'
+down_revision: Union[str, None] = 'e4b9c2d17a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Столбец с постоянным значением по умолчанию добавляется без перезаписи таблицы.
+    for table in ('devices', 'batteries'):
+        op.add_column(
+            table, sa.Column('version', sa.Integer(), server_default='1', nullable=False)
+        )
+
+
+def downgrade() -> None:
+    for table in ('batteries', 'devices'):
+        op.drop_column(table, 'version')
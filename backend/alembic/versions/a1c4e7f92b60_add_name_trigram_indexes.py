@@ -0,0 +1,35 @@
+"""add name trigram indexes
+
+Revision ID: a1c4e7f92b60
+Revises: 3b1f2c9d8a47
+Create Date: 2026-10-18 14:02:17.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c4e7f92b60'
+down_revision: Union[str, None] = '3b1f2c9d8a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_devices_name_trgm', 'devices', ['name'],
+        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_batteries_name_trgm', 'batteries', ['name'],
+        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    # Расширение pg_trgm не удаляется: его могут использовать другие объекты.
+    op.drop_index('ix_batteries_name_trgm', table_name='batteries')
+    op.drop_index('ix_devices_name_trgm', table_name='devices')
@@ -0,0 +1,60 @@
+"""add battery readings
+
+Revision ID: c7d2a94e1f38
+Revises: 5d2e8b1f4c73
+Create Date: 2026-10-18 19:12:44.861305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d2a94e1f38'
+down_revision: Union[str, None] = '5d2e8b1f4c73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _rollup_table(name: str) -> None:
+    op.create_table(
+        name,
+        sa.Column('battery_id', sa.Integer(), nullable=False),
+        sa.Column('bucket', sa.BigInteger(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('voltage_sum', sa.Float(), nullable=False),
+        sa.Column('voltage_min', sa.REAL(), nullable=False),
+        sa.Column('voltage_max', sa.REAL(), nullable=False),
+        sa.Column('soc_sum', sa.Float(), nullable=False),
+        sa.Column('soc_min', sa.REAL(), nullable=False),
+        sa.Column('soc_max', sa.REAL(), nullable=False),
+        sa.Column('temperature_sum', sa.Float(), nullable=False),
+        sa.Column('temperature_min', sa.REAL(), nullable=False),
+        sa.Column('temperature_max', sa.REAL(), nullable=False),
+        sa.PrimaryKeyConstraint('battery_id', 'bucket'),
+    )
+
+
+def upgrade() -> None:
+    # Секции по суткам создаются приложением при записи первых показаний за день.
+    op.create_table(
+        'battery_readings',
+        sa.Column('battery_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.BigInteger(), nullable=False),
+        sa.Column('voltage', sa.REAL(), nullable=False),
+        sa.Column('soc', sa.REAL(), nullable=False),
+        sa.Column('temperature', sa.REAL(), nullable=False),
+        sa.PrimaryKeyConstraint('battery_id', 'ts'),
+        postgresql_partition_by='RANGE (ts)',
+    )
+    _rollup_table('battery_readings_1m')
+    _rollup_table('battery_readings_1h')
+
+
+def downgrade() -> None:
+    op.drop_table('battery_readings_1h')
+    op.drop_table('battery_readings_1m')
+    # Секции удаляются вместе с секционированной таблицей.
+    op.drop_table('battery_readings')
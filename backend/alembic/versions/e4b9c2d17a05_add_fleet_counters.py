@@ -0,0 +1,47 @@
+"""add fleet counters
+
+Revision ID: e4b9c2d17a05
+Revises: c7d2a94e1f38
+Create Date: 2026-10-18 21:07:15.482913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b9c2d17a05'
+down_revision: Union[str, None] = 'c7d2a94e1f38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'fleet_counters',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('value', sa.BigInteger(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('name', 'shard'),
+    )
+    # Начальные значения записываются в шард 0, остальные шарды
+    # создаются при первом изменении.
+    op.execute(
+        "INSERT INTO fleet_counters (name, shard, value) "
+        "SELECT 'devices', 0, count(*) FROM devices "
+        "UNION ALL SELECT 'batteries', 0, count(*) FROM batteries "
+        "UNION ALL SELECT 'unattached_batteries', 0, count(*) FROM batteries "
+        "WHERE device_id IS NULL"
+    )
+    op.execute(
+        "INSERT INTO fleet_counters (name, shard, value) "
+        "SELECT 'devices_with_' || n || '_batteries', 0, "
+        "(SELECT count(*) FROM devices WHERE battery_count = n) "
+        "FROM generate_series(0, 5) AS n"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('fleet_counters')
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from app.metrics import (
+    ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, ADMISSION_WAIT
+)
+from config import (
+    ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_READ_LIMIT,
+    ADMISSION_RETRY_AFTER, ADMISSION_WRITE_LIMIT
+)
+
+READ = 'read'
+WRITE = 'write'
+
+READ_METHODS = ('GET', 'HEAD')
+
+API_PREFIX = '/api/'
+
+# Маршруты /api, не удерживающие соединение с базой данных все время ответа:
+# поток SSE может длиться часами и не должен занимать место в лимите.
+EXEMPT_PATHS = ('/api/changes',)
+
+OVERLOADED = json.dumps({'detail': 'Service overloaded, retry later'}).encode()
+
+
+def route_class(scope):
+    """
+    Определяет класс маршрута для контроля допуска.
+
+    :param scope: ASGI scope HTTP-запроса.
+    :return: READ, WRITE или None, если запрос не ограничивается.
+    """
+    path = scope['path']
+    method = scope['method']
+    if not path.startswith(API_PREFIX) or path.rstrip('/') in EXEMPT_PATHS:
+        return None
+    if method == 'OPTIONS':
+        return None
+    return READ if method in READ_METHODS else WRITE
+
+
+class AdmissionLimiter:
+    """
+    Ограничитель одновременных запросов одного класса с очередью ожидания.
+
+    Освободившееся место передается первому ожидающему запросу, поэтому
+    очередь обслуживается в порядке поступления. Работает в цикле событий
+    сервера и не требует блокировок.
+
+    :param name: Класс маршрутов (значение метки route_class в метриках).
+    :param limit: Максимальное количество одновременно выполняемых запросов.
+    :param queue_size: Максимальное количество ожидающих запросов.
+    :param timeout: Максимальное время ожидания в очереди (сек); 0 - без очереди.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        ADMISSION_ACTIVE.labels(name).set_function(lambda: self.active)
+        ADMISSION_QUEUE_DEPTH.labels(name).set_function(lambda: len(self._waiters))
+
+    async def acquire(self):
+        """
+        Занимает место для запроса, при необходимости ожидая в очереди.
+
+        :return: True, если запрос допущен; False, если его нужно отклонить.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if self.timeout <= 0 or len(self._waiters) >= self.queue_size:
+            ADMISSION_SHED.labels(self.name, 'queue_full').inc()
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            # asyncio.wait не отменяет ожидаемый объект по таймауту, поэтому
+            # место, переданное в момент истечения срока, не теряется.
+            await asyncio.wait((waiter,), timeout=self.timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        ADMISSION_WAIT.labels(self.name).observe(time.perf_counter() - started)
+        if waiter.done():
+            return True
+        self._waiters.remove(waiter)
+        ADMISSION_SHED.labels(self.name, 'timeout').inc()
+        return False
+
+    def release(self):
+        """
+        Освобождает место: передает его первому ожидающему запросу.
+        """
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+
+class AdmissionMiddleware:
+    """
+    ASGI-middleware, ограничивающее количество одновременных запросов к /api.
+
+    Чтение и запись ограничиваются раздельно, а сумма лимитов по умолчанию
+    равна емкости пула соединений, поэтому допущенные запросы не ждут
+    соединение в пуле. Запрос сверх лимита ждет в очереди; если очередь
+    заполнена или срок ожидания истек, клиент сразу получает 503 с заголовком
+    Retry-After, не занимая поток и соединение.
+
+    :param app: Оборачиваемое ASGI-приложение.
+    :param read_limit: Лимит одновременных запросов чтения.
+    :param write_limit: Лимит одновременных изменяющих запросов.
+    :param queue_size: Максимальная очередь каждого класса.
+    :param timeout: Максимальное время ожидания в очереди (сек).
+    :param retry_after: Значение заголовка Retry-After (сек).
+    """
+
+    def __init__(self, app, read_limit: int = ADMISSION_READ_LIMIT,
+                 write_limit: int = ADMISSION_WRITE_LIMIT,
+                 queue_size: int = ADMISSION_QUEUE_SIZE,
+                 timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 retry_after: int = ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.retry_after = retry_after
+        self.limiters = {
+            READ: AdmissionLimiter(READ, read_limit, queue_size, timeout),
+            WRITE: AdmissionLimiter(WRITE, write_limit, queue_size, timeout),
+        }
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope['type'] == 'http':
+            limiter = self.limiters.get(route_class(scope))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            await self._reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _reject(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(OVERLOADED)).encode()),
+                (b'retry-after', str(self.retry_after).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': OVERLOADED})
@@ -0,0 +1,329 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from sqlalchemy import (
+    Column, Integer, MetaData, String, Table, exists, func, insert, select, text,
+    update
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.cache import get_cache
+from app.changes import get_feed
+from app.crud import (
+    FLEET_BATTERIES, FLEET_DEVICES, MAX_BATTERIES_PER_DEVICE, bucket_counter,
+    fleet_counters_statement, merge_deltas
+)
+from app.exceptions import ConflictError, DeviceFull
+from app.models import Battery, Device
+from app.search import name_index
+from config import IMPORT_CHUNK_ROWS, IMPORT_MAX_ERRORS
+
+# Промежуточная таблица импорта: строка файла, имена устройства и батареи
+# и ошибка, если строка отклонена. Таблица временная: она видна только
+# соединению, выполняющему импорт, а в PostgreSQL еще и не пишется в WAL.
+IMPORT_ROWS = Table(
+    'import_rows', MetaData(),
+    Column('line', Integer, primary_key=True),
+    Column('device', String, index=True),
+    Column('battery', String, index=True),
+    Column('error', String),
+    prefixes=['TEMPORARY'],
+)
+
+# Строка без ошибки и строка, привязывающая батарею.
+_VALID = IMPORT_ROWS.c.error.is_(None)
+_WITH_BATTERY = IMPORT_ROWS.c.battery.isnot(None)
+
+COPY_ROWS = (
+    "COPY import_rows (line, device, battery, error) FROM STDIN "
+    "WITH (FORMAT csv, FORCE_NULL (device, battery, error))"
+)
+
+
+def parse_csv(lines):
+    """
+    Разбирает CSV с колонками device и battery (необязательной).
+
+    Каждая строка привязывает батарею к устройству; строка без батареи
+    только создает устройство. Строки одного устройства могут идти
+    в файле не подряд.
+
+    :param lines: Текстовый файл.
+    :yield: Кортежи (строка файла, устройство, батарея, ошибка).
+    :raises ValueError: Если в заголовке нет колонки device.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip() for column in header]
+    if 'device' not in columns:
+        raise ValueError("CSV header must contain a device column")
+    device_at = columns.index('device')
+    battery_at = columns.index('battery') if 'battery' in columns else None
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, None, f"Invalid CSV: {e}"
+            continue
+        if not any(record):
+            continue
+        device = record[device_at] if device_at < len(record) else ''
+        battery = (
+            record[battery_at] if battery_at is not None and battery_at < len(record)
+            else ''
+        )
+        yield _row(reader.line_num, device, battery)
+
+
+def parse_ndjson(lines):
+    """
+    Разбирает NDJSON: объект {"device": ..., "battery": ...} в каждой строке.
+
+    :param lines: Текстовый файл.
+    :yield: Кортежи (строка файла, устройство, батарея, ошибка).
+    """
+    for line, value in enumerate(lines, 1):
+        if not value.strip():
+            continue
+        try:
+            item = json.loads(value)
+        except ValueError:
+            yield line, None, None, "Invalid JSON"
+            continue
+        if not isinstance(item, dict):
+            yield line, None, None, "Row must be a JSON object"
+            continue
+        yield _row(line, item.get('device'), item.get('battery'))
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ndjson': parse_ndjson,
+}
+
+
+def _row(line: int, device, battery):
+    if not isinstance(device, str) or not device:
+        return line, None, None, "Device name is required"
+    if battery is not None and not isinstance(battery, str):
+        return line, device, None, "Battery name must be a string"
+    return line, device, battery or None, None
+
+
+def import_file(db: Session, file, fmt: str = 'ndjson'):
+    """
+    Импортирует устройства и привязанные к ним батареи из файла.
+
+    Файл читается потоком и загружается пачками по IMPORT_CHUNK_ROWS строк
+    в промежуточную таблицу (COPY в PostgreSQL, executemany в SQLite).
+    Затем строки проверяются запросами над всей таблицей сразу, а не по одной:
+    занятые и повторяющиеся имена батарей и превышение лимита батарей
+    на устройство (с учетом уже привязанных) отмечаются ошибками, а остальные
+    строки переносятся в devices и batteries. Устройства, которые уже есть
+    в базе, получают новые батареи; батареи должны быть новыми. Все
+    выполняется в одной транзакции, поэтому память не зависит от размера файла,
+    кроме списка ошибок, ограниченного IMPORT_MAX_ERRORS.
+
+    :param db: Сессия базы данных.
+    :param file: Двоичный файл в UTF-8.
+    :param fmt: Формат файла: 'ndjson' или 'csv'.
+    :return: Словарь с количеством строк, созданных устройств и батарей,
+        общим количеством ошибок и ошибками по строкам файла.
+    :raises ValueError: Если файл не удается прочитать.
+    :raises ConflictError: Если импорт конфликтует с параллельным изменением.
+    """
+    lines = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        _create_staging(db)
+        rows = _load(db, PARSERS[fmt](lines))
+        _validate(db)
+        devices, batteries = _merge(db)
+        report = _report(db)
+        IMPORT_ROWS.drop(db.connection())
+        db.commit()
+    except UnicodeDecodeError:
+        db.rollback()
+        raise ValueError("File must be UTF-8 encoded")
+    except IntegrityError:
+        db.rollback()
+        raise ConflictError("Import conflicted with a concurrent change, retry it")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        lines.detach()
+
+    if devices or batteries:
+        # Набор новых объектов может быть сколь угодно большим: вместо
+        # событий по каждому клиенты ленты изменений получают reset.
+        get_cache().clear()
+        name_index(Device.__tablename__).reset()
+        name_index(Battery.__tablename__).reset()
+        get_feed().reset()
+    return {
+        'rows': rows, 'devices_created': devices, 'batteries_created': batteries,
+        **report
+    }
+
+
+def _create_staging(db: Session):
+    conn = db.connection()
+    # В SQLite DDL выполняется вне транзакции, и таблица, оставшаяся после
+    # прерванного импорта, живет до закрытия соединения.
+    IMPORT_ROWS.drop(conn, checkfirst=True)
+    IMPORT_ROWS.create(conn)
+
+
+def _load(db: Session, rows):
+    """
+    Загружает разобранные строки в промежуточную таблицу пачками.
+
+    :param db: Сессия базы данных.
+    :param rows: Итератор кортежей (строка файла, устройство, батарея, ошибка).
+    :return: Количество загруженных строк.
+    """
+    postgres = db.get_bind().dialect.name == 'postgresql'
+    total = 0
+    while True:
+        chunk = list(islice(rows, IMPORT_CHUNK_ROWS))
+        if not chunk:
+            break
+        if postgres:
+            buffer = io.StringIO()
+            csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(chunk)
+            buffer.seek(0)
+            with db.connection().connection.cursor() as cursor:
+                cursor.copy_expert(COPY_ROWS, buffer)
+        else:
+            db.execute(insert(IMPORT_ROWS), [
+                {'line': line, 'device': device, 'battery': battery, 'error': error}
+                for line, device, battery, error in chunk
+            ])
+        total += len(chunk)
+    if postgres:
+        # Автоочистка не собирает статистику временных таблиц.
+        db.execute(text("ANALYZE import_rows"))
+    return total
+
+
+def _reject(db: Session, error: str, *conditions):
+    db.execute(
+        update(IMPORT_ROWS).where(_VALID, *conditions).values(error=error),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def _validate(db: Session):
+    """
+    Отмечает ошибками строки, которые нельзя перенести в основные таблицы.
+
+    Проверки выполняются по порядку: батарея уже есть в базе, батарея
+    повторяется в файле (первое вхождение принимается), устройство получает
+    больше MAX_BATTERIES_PER_DEVICE батарей (принимаются первые по порядку
+    строк). Перед проверкой лимита существующие устройства блокируются,
+    чтобы параллельные привязки не изменили их счетчики до переноса.
+
+    :param db: Сессия базы данных.
+    """
+    rows = IMPORT_ROWS
+    _reject(
+        db, "Battery with this name already exists",
+        exists().where(Battery.name == rows.c.battery)
+    )
+    first = (
+        select(func.min(rows.c.line))
+        .where(_VALID, _WITH_BATTERY).group_by(rows.c.battery)
+    )
+    _reject(db, "Duplicate battery name in file", _WITH_BATTERY, rows.c.line.not_in(first))
+
+    devices = select(rows.c.device).where(_VALID)
+    db.execute(select(func.count()).select_from(
+        select(Device.id).where(Device.name.in_(devices))
+        .order_by(Device.id).with_for_update().subquery()
+    ))
+    attached = func.coalesce(
+        select(Device.battery_count).where(Device.name == rows.c.device).scalar_subquery(), 0
+    )
+    position = func.row_number().over(partition_by=rows.c.device, order_by=rows.c.line)
+    ranked = (
+        select(rows.c.line, (attached + position).label('battery_count'))
+        .where(_VALID, _WITH_BATTERY).subquery()
+    )
+    _reject(
+        db, str(DeviceFull(MAX_BATTERIES_PER_DEVICE)),
+        rows.c.line.in_(
+            select(ranked.c.line).where(ranked.c.battery_count > MAX_BATTERIES_PER_DEVICE)
+        )
+    )
+
+
+def _merge(db: Session):
+    """
+    Переносит принятые строки в основные таблицы.
+
+    Новые устройства и батареи вставляются запросами INSERT ... SELECT
+    в порядке строк файла, счетчики battery_count увеличиваются
+    на количество привязанных батарей, счетчики статистики парка - на
+    итоговые изменения.
+
+    :param db: Сессия базы данных.
+    :return: Количество созданных устройств и батарей.
+    """
+    rows = IMPORT_ROWS
+    new_devices = (
+        select(rows.c.device)
+        .where(_VALID, ~exists().where(Device.name == rows.c.device))
+        .group_by(rows.c.device).order_by(func.min(rows.c.line))
+    )
+    devices = db.execute(insert(Device).from_select(['name'], new_devices)).rowcount
+
+    batteries = db.execute(insert(Battery).from_select(
+        ['name', 'device_id'],
+        select(rows.c.battery, Device.id)
+        .join(Device, Device.name == rows.c.device)
+        .where(_VALID, _WITH_BATTERY).order_by(rows.c.line)
+    )).rowcount
+
+    added = (
+        select(rows.c.device, func.count().label('added'))
+        .where(_VALID, _WITH_BATTERY).group_by(rows.c.device).subquery()
+    )
+    deltas = [{FLEET_DEVICES: devices, bucket_counter(0): devices, FLEET_BATTERIES: batteries}]
+    for battery_count, count, moved in db.execute(
+        select(Device.battery_count, added.c.added, func.count())
+        .join(added, Device.name == added.c.device)
+        .group_by(Device.battery_count, added.c.added)
+    ):
+        deltas.append({
+            bucket_counter(battery_count): -moved,
+            bucket_counter(battery_count + count): moved,
+        })
+    db.execute(
+        update(Device).where(Device.name == added.c.device)
+        .values(battery_count=Device.battery_count + added.c.added),
+        execution_options={'synchronize_session': False}
+    )
+    stmt = fleet_counters_statement(db.get_bind().dialect.name, merge_deltas(*deltas))
+    if stmt is not None:
+        db.execute(stmt)
+    return devices, batteries
+
+
+def _report(db: Session):
+    rows = IMPORT_ROWS
+    failed = rows.c.error.isnot(None)
+    errors = db.execute(
+        select(rows.c.line, rows.c.error).where(failed)
+        .order_by(rows.c.line).limit(IMPORT_MAX_ERRORS)
+    ).all()
+    return {
+        'error_count': db.scalar(select(func.count()).where(failed)),
+        'errors': [{'line': line, 'detail': error} for line, error in errors],
+    }
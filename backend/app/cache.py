@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import CACHE_MAX_SIZE, CACHE_TTL
+
+
+class CacheBackend:
+    """
+    Интерфейс бэкенда кеша.
+
+    Реализация в памяти процесса может быть заменена общим кешем
+    (например, Redis) через функцию set_backend.
+    """
+
+    def get(self, key: str):
+        """
+        Получает значение по ключу.
+
+        :param key: Ключ.
+        :return: Значение или None, если ключ отсутствует или устарел.
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, value):
+        """
+        Сохраняет значение по ключу.
+
+        :param key: Ключ.
+        :param value: Значение.
+        """
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        """
+        Удаляет значения по ключам.
+
+        :param keys: Ключи.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Удаляет все значения.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Возвращает счетчики работы кеша.
+
+        :return: Словарь со счетчиками попаданий, промахов и вытеснений.
+        """
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    Ограниченный по размеру LRU-кеш с временем жизни записей.
+
+    :param max_size: Максимальное количество записей.
+    :param ttl: Время жизни записи в секундах.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._evictions += 1
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: str, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': type(self).__name__,
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+_backend: CacheBackend = MemoryCache(max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL)
+
+
+def get_cache():
+    """
+    Возвращает текущий бэкенд кеша.
+
+    :return: Экземпляр CacheBackend.
+    """
+    return _backend
+
+
+def set_backend(backend: CacheBackend):
+    """
+    Заменяет бэкенд кеша.
+
+    :param backend: Новый бэкенд кеша.
+    """
+    global _backend
+    _backend = backend
+
+
+def device_key(device_id: int):
+    """
+    Формирует ключ кеша для устройства с батареями.
+
+    :param device_id: Идентификатор устройства.
+    :return: Ключ кеша.
+    """
+    return f"device:{device_id}"
+
+
+def battery_key(battery_id: int):
+    """
+    Формирует ключ кеша для батареи.
+
+    :param battery_id: Идентификатор батареи.
+    :return: Ключ кеша.
+    """
+    return f"battery:{battery_id}"
+
+
+def evict_battery(battery_id: int, device_id: int = None):
+    """
+    Сбрасывает кеш батареи и устройства, в списке которого она отображается.
+
+    :param battery_id: Идентификатор измененной или удаленной батареи.
+    :param device_id: Идентификатор устройства, к которому привязана батарея.
+    """
+    keys = [battery_key(battery_id)]
+    if device_id:
+        keys.append(device_key(device_id))
+    get_cache().delete(*keys)
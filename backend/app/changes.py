@@ -0,0 +1,361 @@
+import asyncio
+import json
+import queue
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import count
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from config import (
+    CHANGES_BACKEND, CHANGES_BUFFER_SIZE, CHANGES_KEEPALIVE, CHANGES_QUEUE_SIZE,
+    DATABASE_URL
+)
+
+# Интервал (мс), через который клиенту предлагается переподключиться после обрыва.
+RETRY_MS = 3000
+
+RESET = 'reset'
+
+
+def change_filter(entity: str = None, device_id: int = None):
+    """
+    Строит условие подписки на события.
+
+    :param entity: 'device' или 'battery' - только события этой сущности.
+    :param device_id: Только события устройства и батарей, привязанных к нему.
+    :return: Функция, принимающая событие и возвращающая True, если оно нужно клиенту.
+    """
+    def matches(event):
+        if entity is not None and event['entity'] != entity:
+            return False
+        if device_id is not None:
+            item = event['item']
+            owner = item['id'] if event['entity'] == 'device' else item.get('device_id')
+            return owner == device_id
+        return True
+    return matches
+
+
+class Subscription:
+    """
+    Подписка одного клиента на ленту изменений.
+
+    События доставляются в очередь подписки в цикле событий клиента.
+    При переполнении очереди накопленные события заменяются событием
+    reset: клиент должен заново загрузить данные.
+
+    :param matches: Условие подписки.
+    :param loop: Цикл событий, в котором читается подписка.
+    :param max_size: Максимальный размер очереди.
+    """
+
+    def __init__(self, matches, loop, max_size: int):
+        self.matches = matches
+        self.backlog = []
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max_size)
+
+    def deliver(self, event):
+        """
+        Передает событие подписке из любого потока.
+
+        :param event: Событие.
+        :return: False, если цикл событий клиента уже закрыт.
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            return False
+        return True
+
+    async def get(self):
+        """
+        Ожидает следующее событие.
+
+        :return: Событие.
+        """
+        return await self._queue.get()
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait({'id': event['id'], 'action': RESET})
+
+
+class ChangeFeed:
+    """
+    Лента изменений устройств и батарей с рассылкой в памяти процесса.
+
+    Последние события хранятся в кольцевом буфере, поэтому клиент,
+    переподключившийся с идентификатором последнего полученного события,
+    получает только пропущенные события. Если идентификатора уже нет
+    в буфере, клиент получает событие reset. Рассылка может быть заменена
+    реализацией для нескольких процессов через функцию set_feed.
+
+    :param buffer_size: Количество событий в буфере для возобновления.
+    :param queue_size: Максимальная очередь событий одного клиента.
+    """
+
+    def __init__(self, buffer_size: int = CHANGES_BUFFER_SIZE,
+                 queue_size: int = CHANGES_QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscriptions = set()
+        self._queue_size = queue_size
+        # Префикс процесса: после перезапуска старые идентификаторы не совпадут
+        # с новыми, и клиент получит reset вместо пропуска событий.
+        self._epoch = uuid.uuid4().hex[:8]
+        self._ids = count(1)
+
+    def publish(self, events):
+        """
+        Публикует события, зафиксированные в базе данных.
+
+        :param events: Список событий без идентификаторов.
+        """
+        with self._lock:
+            for event in events:
+                event['id'] = f"{self._epoch}-{next(self._ids)}"
+            self._fanout(events)
+
+    def subscribe(self, matches, after: str = None):
+        """
+        Подписывает клиента на события.
+
+        Пропущенные события из буфера и регистрация подписки выполняются
+        под одной блокировкой, поэтому события не теряются и не дублируются.
+
+        :param matches: Условие подписки.
+        :param after: Идентификатор последнего полученного клиентом события.
+        :return: Подписка; пропущенные события - в ее атрибуте backlog.
+        """
+        subscription = Subscription(matches, asyncio.get_running_loop(), self._queue_size)
+        with self._lock:
+            if after is not None:
+                subscription.backlog = self._replay(after, matches)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Отменяет подписку.
+
+        :param subscription: Подписка.
+        """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def reset(self):
+        """
+        Очищает буфер и отправляет всем клиентам событие reset.
+
+        Используется, когда часть событий могла быть потеряна.
+        """
+        with self._lock:
+            self._buffer.clear()
+            for subscription in list(self._subscriptions):
+                if not subscription.deliver({'id': '', 'action': RESET}):
+                    self._subscriptions.discard(subscription)
+
+    def _replay(self, after: str, matches):
+        backlog = []
+        for event in reversed(self._buffer):
+            if event['id'] == after:
+                return backlog[::-1]
+            if matches(event):
+                backlog.append(event)
+        last = self._buffer[-1]['id'] if self._buffer else ''
+        return [{'id': last, 'action': RESET}]
+
+    def _fanout(self, events):
+        self._buffer.extend(events)
+        for subscription in list(self._subscriptions):
+            for event in events:
+                if subscription.matches(event) and not subscription.deliver(event):
+                    self._subscriptions.discard(subscription)
+                    break
+
+
+class PostgresChangeFeed(ChangeFeed):
+    """
+    Лента изменений с рассылкой между процессами через LISTEN/NOTIFY PostgreSQL.
+
+    Публикация не блокирует вызывающий код: события передаются фоновому
+    потоку, который отправляет их одним NOTIFY-запросом. Идентификатор
+    события составляется из номера транзакции NOTIFY и порядкового номера,
+    поэтому он одинаков во всех процессах. Каждый процесс получает события
+    (в том числе свои) в фоновом потоке LISTEN в едином для всех процессов
+    порядке. После переподключения клиенты получают reset: уведомления,
+    отправленные во время обрыва, не сохраняются.
+
+    :param url: Строка подключения к PostgreSQL (драйвер psycopg2).
+    :param channel: Имя канала уведомлений.
+    """
+
+    NOTIFY = text(
+        "SELECT pg_notify(:channel, txid_current() || '.' || t.n || ' ' || t.payload) "
+        "FROM unnest(CAST(:payloads AS text[])) WITH ORDINALITY AS t(payload, n)"
+    )
+
+    # Интервал (сек) проверки соединения LISTEN при отсутствии уведомлений.
+    POLL_INTERVAL = 5
+
+    def __init__(self, url: str, channel: str = 'changes', **kwargs):
+        super().__init__(**kwargs)
+        self.channel = channel
+        self._engine = create_engine(url, poolclass=NullPool)
+        self._outbox = queue.Queue()
+        for target in (self._publisher, self._listener):
+            threading.Thread(target=target, daemon=True).start()
+
+    def publish(self, events):
+        self._outbox.put(events)
+
+    def _publisher(self):
+        while True:
+            events = self._outbox.get()
+            while not self._outbox.empty():
+                events = events + self._outbox.get_nowait()
+            payloads = [json.dumps(event, separators=(',', ':')) for event in events]
+            try:
+                with self._engine.begin() as conn:
+                    conn.execute(self.NOTIFY, {'channel': self.channel, 'payloads': payloads})
+            except Exception:
+                # События не дошли ни до одного процесса; клиенты этого
+                # процесса загрузят данные заново.
+                self.reset()
+
+    def _listener(self):
+        connected = False
+        while True:
+            try:
+                connection = self._engine.raw_connection()
+            except Exception:
+                time.sleep(1)
+                continue
+            try:
+                dbapi = connection.driver_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                if connected:
+                    self.reset()
+                connected = True
+                while True:
+                    if not select.select([dbapi], [], [], self.POLL_INTERVAL)[0]:
+                        with dbapi.cursor() as cursor:
+                            cursor.execute('SELECT 1')
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        self._receive(dbapi.notifies.pop(0).payload)
+            except Exception:
+                time.sleep(1)
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def _receive(self, payload: str):
+        event_id, _, body = payload.partition(' ')
+        event = json.loads(body)
+        event['id'] = event_id
+        with self._lock:
+            self._fanout([event])
+
+
+_feed: ChangeFeed = None
+_feed_lock = threading.Lock()
+
+
+def get_feed():
+    """
+    Возвращает текущую ленту изменений, создавая ее при первом обращении.
+
+    :return: Экземпляр ChangeFeed.
+    """
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = (
+                    PostgresChangeFeed(DATABASE_URL) if CHANGES_BACKEND == 'postgres'
+                    else ChangeFeed()
+                )
+    return _feed
+
+
+def set_feed(feed: ChangeFeed):
+    """
+    Заменяет ленту изменений.
+
+    :param feed: Новая лента изменений.
+    """
+    global _feed
+    _feed = feed
+
+
+def publish_changes(entity: str, action: str, items):
+    """
+    Публикует изменения устройств или батарей.
+
+    Вызывается функциями crud после фиксации транзакции.
+
+    :param entity: 'device' или 'battery'.
+    :param action: 'created', 'updated', 'deleted' или 'attached'.
+    :param items: Словари измененных объектов (id, name и, для батарей, device_id).
+    """
+    events = [{'entity': entity, 'action': action, 'item': item} for item in items]
+    if events:
+        get_feed().publish(events)
+
+
+def format_event(event):
+    """
+    Кодирует событие в формате Server-Sent Events.
+
+    :param event: Событие ленты или reset.
+    :return: Сообщение SSE в байтах.
+    """
+    if event['action'] == RESET:
+        return f"id: {event['id']}\nevent: reset\ndata: {{}}\n\n".encode()
+    data = json.dumps(event, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: change\ndata: {data}\n\n".encode()
+
+
+async def stream_changes(entity: str = None, device_id: int = None, after: str = None):
+    """
+    Формирует поток событий для одного клиента.
+
+    Сначала отправляются пропущенные события (или reset, если возобновить
+    поток нельзя), затем новые события. Во время простоя отправляются
+    комментарии keep-alive, чтобы прокси не закрывали соединение.
+
+    :param entity: Фильтр по сущности.
+    :param device_id: Фильтр по устройству.
+    :param after: Идентификатор последнего полученного клиентом события.
+    :yield: Сообщения SSE в байтах.
+    """
+    feed = get_feed()
+    subscription = feed.subscribe(change_filter(entity, device_id), after=after)
+    try:
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        for event in subscription.backlog:
+            yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), CHANGES_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        feed.unsubscribe(subscription)
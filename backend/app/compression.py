@@ -0,0 +1,203 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import COMPRESSION_BROTLI_QUALITY, COMPRESSION_GZIP_LEVEL, COMPRESSION_MIN_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Типы содержимого, которые имеет смысл сжимать.
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/x-ndjson', 'text/',
+)
+
+
+class GzipEncoder:
+    """
+    Потоковое сжатие gzip.
+
+    :param level: Уровень сжатия от 1 до 9.
+    """
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def flush(self, data: bytes):
+        """
+        Сжимает фрагмент и выталкивает все накопленные данные.
+
+        :param data: Фрагмент тела ответа.
+        :return: Сжатые данные, которые клиент может распаковать сразу.
+        """
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes):
+        """
+        Сжимает последний фрагмент и завершает поток.
+
+        :param data: Последний фрагмент тела ответа.
+        :return: Сжатые данные до конца потока.
+        """
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    """
+    Потоковое сжатие brotli.
+
+    :param quality: Качество сжатия от 0 до 11.
+    """
+
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def flush(self, data: bytes):
+        """
+        Сжимает фрагмент и выталкивает все накопленные данные.
+
+        :param data: Фрагмент тела ответа.
+        :return: Сжатые данные, которые клиент может распаковать сразу.
+        """
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes):
+        """
+        Сжимает последний фрагмент и завершает поток.
+
+        :param data: Последний фрагмент тела ответа.
+        :return: Сжатые данные до конца потока.
+        """
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+# Поддерживаемые кодировки в порядке предпочтения при равном весе в Accept-Encoding.
+ENCODERS = {'gzip': GzipEncoder}
+if brotli is not None:
+    ENCODERS = {'br': BrotliEncoder, **ENCODERS}
+
+
+def negotiate(accept_encoding: str, encodings=tuple(ENCODERS)):
+    """
+    Выбирает кодировку ответа по заголовку Accept-Encoding.
+
+    :param accept_encoding: Значение заголовка, например "gzip, br;q=0.8".
+    :param encodings: Поддерживаемые кодировки в порядке предпочтения.
+    :return: Имя кодировки или None, если клиент не принимает ни одну из них.
+    """
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    default = weights.get('*', 0.0)
+    accepted = [name for name in encodings if weights.get(name, default) > 0]
+    return max(accepted, key=lambda name: weights.get(name, default), default=None)
+
+
+def compressible(headers: Headers):
+    """
+    Проверяет, можно ли сжимать ответ с такими заголовками.
+
+    :param headers: Заголовки ответа.
+    :return: True, если тип содержимого текстовый и ответ еще не сжат.
+    """
+    content_type = headers.get('content-type', '')
+    return (
+        'content-encoding' not in headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware, сжимающее ответы gzip или brotli.
+
+    Кодировка выбирается по Accept-Encoding запроса. Ответ целиком сжимается,
+    только если его тело не меньше minimum_size: небольшие ответы с одним
+    объектом передаются как есть. Потоковые ответы (выгрузки, лента
+    изменений) сжимаются по мере передачи: каждый фрагмент сразу
+    выталкивается из компрессора и отправляется клиенту, поэтому события
+    ленты не задерживаются в буфере. ETag сжатого ответа становится слабым:
+    он по-прежнему совпадает в If-None-Match, но не выдает сжатое тело
+    за побайтно то же представление.
+
+    :param app: Оборачиваемое ASGI-приложение.
+    :param minimum_size: Минимальный размер тела для сжатия (байт).
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''))
+        start = None
+        encoder = None
+
+        async def send_wrapper(message):
+            nonlocal start, encoder
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message.get('headers', []))
+                if message['status'] in (204, 304) or not compressible(headers):
+                    await send(message)
+                    return
+                message = {**message, 'headers': list(headers.raw)}
+                MutableHeaders(raw=message['headers']).add_vary_header('Accept-Encoding')
+                length = headers.get('content-length')
+                if encoding is None or length is not None and int(length) < self.minimum_size:
+                    await send(message)
+                else:
+                    # Заголовки отправляются вместе с первым фрагментом тела,
+                    # когда становится известно, нужно ли сжатие.
+                    start = message
+                return
+            if message['type'] != 'http.response.body' or start is None and encoder is None:
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if start is not None:
+                headers = MutableHeaders(raw=start['headers'])
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                encoder = ENCODERS[encoding]()
+                headers['content-encoding'] = encoding
+                etag = headers.get('etag')
+                if etag is not None and not etag.startswith('W/'):
+                    headers['etag'] = f'W/{etag}'
+                if more_body:
+                    del headers['content-length']
+                else:
+                    body = encoder.finish(body)
+                    headers['content-length'] = str(len(body))
+                    encoder = None
+                    await send(start)
+                    start = None
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+                await send(start)
+                start = None
+            body = encoder.flush(body) if more_body else encoder.finish(body)
+            if not more_body:
+                encoder = None
+            await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+        await self.app(scope, receive, send_wrapper)
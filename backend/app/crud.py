@@ -1,6 +1,79 @@
-from sqlalchemy.orm import Session
+import random
+from typing import List, NamedTuple, Optional
 
-from app.models import Device, Battery
+from sqlalchemy import (
+    Integer, String, Text, any_, bindparam, case, cast, column, delete, event,
+    exists, func, literal, literal_column, select, update, values
+)
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app.cache import battery_key, device_key, evict_battery, get_cache
+from app.changes import publish_changes
+from app.exceptions import (
+    BatteryAlreadyAttached, BatteryNotFound, ConflictError, DeviceFull,
+    DeviceNotFound, VersionMismatch
+)
+from app.models import Device, Battery, FleetCounter
+from app.pagination import build_page, keyset
+from app.replicas import read_from_primary, requires_fresh_reads
+from app.search import name_index
+from config import FLEET_STATS_SHARDS
+
+# Количество строк в одном многострочном запросе пакетных операций.
+BULK_CHUNK_SIZE = 500
+
+# Максимальное количество батарей, привязанных к одному устройству.
+MAX_BATTERIES_PER_DEVICE = 5
+
+# Максимальное количество идентификаторов в одном запросе ?ids=.
+MAX_BATCH_IDS = 1000
+
+# Счетчики статистики парка: устройства, батареи, свободные батареи
+# и устройства по количеству привязанных батарей (от 0 до MAX_BATTERIES_PER_DEVICE).
+FLEET_DEVICES = 'devices'
+FLEET_BATTERIES = 'batteries'
+FLEET_UNATTACHED = 'unattached_batteries'
+
+
+def bucket_counter(battery_count: int):
+    """
+    Возвращает имя счетчика устройств с заданным количеством батарей.
+
+    :param battery_count: Количество привязанных батарей.
+    :return: Имя счетчика, например devices_with_2_batteries.
+    """
+    return f'devices_with_{battery_count}_batteries'
+
+
+FLEET_COUNTERS = (FLEET_DEVICES, FLEET_BATTERIES, FLEET_UNATTACHED) + tuple(
+    bucket_counter(count) for count in range(MAX_BATTERIES_PER_DEVICE + 1)
+)
+
+# Поля устройства, доступные в ?fields=, и связи, доступные в ?include=.
+DEVICE_FIELDS = ('id', 'name')
+DEVICE_INCLUDES = ('batteries',)
+
+
+class DeviceFieldset(NamedTuple):
+    """
+    Набор полей представления устройства.
+
+    :param fields: Поля устройства; id входит всегда.
+    :param batteries: Загружать ли привязанные батареи.
+    """
+    fields: tuple
+    batteries: bool
+
+
+# Полное представление устройства (схема DeviceRead).
+FULL_DEVICE = DeviceFieldset(DEVICE_FIELDS, True)
+
+# Колонки батареи, возвращаемые условным изменением вместе с версией.
+BATTERY_VERSION_COLUMNS = (Battery.id, Battery.name, Battery.device_id, Battery.version)
 
 
 def create_device(db: Session, name: str):
@@ -13,71 +86,728 @@ def create_device(db: Session, name: str):
     """
     db_device = Device(name=name)
     db.add(db_device)
+    _adjust_fleet(db, {FLEET_DEVICES: 1, bucket_counter(0): 1})
     db.commit()
     db.refresh(db_device)
+    name_index(Device.__tablename__).add([(db_device.id, db_device.name)])
+    publish_changes('device', 'created', [device_item(db_device)])
     return db_device
 
 
-def get_device_with_batteries(db: Session, device_id: int):
+def get_device_with_batteries(
+    db: Session, device_id: int, fieldset: Optional[DeviceFieldset] = None
+):
     """
     Получает устройство по его идентификатору вместе с привязанными к нему батареями.
 
+    Результат кешируется и сбрасывается функциями, изменяющими устройство
+    или его батареи. Попадание в кеш обходит выбор реплики, поэтому кеш
+    заполняется только результатом чтения с основного сервера: прочитанное
+    с реплики возвращается без кеширования, чтобы ее отставание не осталось
+    в кеше на весь CACHE_TTL. Запросы, которые должны видеть собственные
+    изменения клиента, читают из базы данных в обход кеша. Выборочное
+    представление берется из кеша, если устройство там есть, иначе
+    выбираются только нужные колонки.
+
     :param db: Сессия базы данных.
     :param device_id: Идентификатор устройства.
-    :return: Словарь с данными об устройстве и привязанных к нему батареях.
+    :param fieldset: Набор полей или None для полного представления.
+    :return: Словарь с данными об устройстве и привязанных к нему батареях
+        (полное представление содержит и версию устройства).
     """
-    device = db.query(Device).filter(Device.id == device_id).first()
+    cached = None if requires_fresh_reads() else get_cache().get(device_key(device_id))
+    if cached is not None:
+        return cached if fieldset is None else select_fields(cached, fieldset)
+    if fieldset is not None:
+        rows = db.execute(
+            select(*device_columns(fieldset)).where(Device.id == device_id)
+        )
+        devices = _device_dicts_with_batteries(db, rows, fieldset)
+        return devices[0] if devices else None
+    device = (
+        db.query(Device).options(joinedload(Device.batteries))
+        .filter(Device.id == device_id).first()
+    )
     if device:
-        return {
+        result = {
             'id': device.id,
             'name': device.name,
+            'version': device.version,
             'batteries': [{'id': b.id, 'name': b.name} for b in device.batteries]
         }
+        if read_from_primary(db):
+            get_cache().set(device_key(device_id), result)
+        return result
     return None
 
 
-def get_devices(db: Session, skip: int = 0, limit: int = 10):
+def device_filters(has_free_slots: Optional[bool] = None):
+    """
+    Формирует условия фильтрации списка устройств.
+
+    :param has_free_slots: True - только устройства, к которым можно привязать
+        батарею; False - только заполненные устройства; None - без фильтра.
+    :return: Список условий для WHERE.
+    """
+    if has_free_slots is None:
+        return []
+    if has_free_slots:
+        return [Device.battery_count < MAX_BATTERIES_PER_DEVICE]
+    return [Device.battery_count >= MAX_BATTERIES_PER_DEVICE]
+
+
+def battery_filters(attached: Optional[bool] = None, device_id: Optional[int] = None):
+    """
+    Формирует условия фильтрации списка батарей.
+
+    Условия опираются на индекс по device_id и частичный индекс
+    непривязанных батарей.
+
+    :param attached: True - только привязанные батареи, False - только
+        свободные; None - без фильтра.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :return: Список условий для WHERE.
+    """
+    conditions = []
+    if attached is not None:
+        conditions.append(
+            Battery.device_id.isnot(None) if attached else Battery.device_id.is_(None)
+        )
+    if device_id is not None:
+        conditions.append(Battery.device_id == device_id)
+    return conditions
+
+
+def parse_fieldset(fields: Optional[str] = None, include: Optional[str] = None):
+    """
+    Разбирает параметры fields и include запроса устройств.
+
+    Без обоих параметров возвращается полное представление. С параметром fields
+    батареи загружаются только при include=batteries; без fields при указанном
+    include возвращаются все поля. Идентификатор возвращается всегда.
+
+    :param fields: Поля устройства через запятую.
+    :param include: Связи через запятую.
+    :return: Набор полей или None для полного представления.
+    :raises ValueError: Если поле или связь неизвестны.
+    """
+    if fields is None and include is None:
+        return None
+    names = _split_names(fields) if fields is not None else DEVICE_FIELDS
+    relations = _split_names(include or '')
+    unknown = [name for name in names if name not in DEVICE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    unknown = [name for name in relations if name not in DEVICE_INCLUDES]
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(unknown)}")
+    return DeviceFieldset(
+        tuple(name for name in DEVICE_FIELDS if name == 'id' or name in names),
+        'batteries' in relations
+    )
+
+
+def device_columns(fieldset: DeviceFieldset, sort: str = None):
+    """
+    Возвращает колонки устройства, которые нужно выбрать для набора полей.
+
+    :param fieldset: Набор полей.
+    :param sort: Поле сортировки, нужное для курсора страницы.
+    :return: Список колонок.
+    """
+    return [
+        getattr(Device, name) for name in DEVICE_FIELDS
+        if name in fieldset.fields or name == sort
+    ]
+
+
+def select_fields(device: dict, fieldset: DeviceFieldset):
+    """
+    Оставляет в полном представлении устройства только поля набора.
+
+    :param device: Словарь устройства с батареями.
+    :param fieldset: Набор полей.
+    :return: Новый словарь с запрошенными полями.
+    """
+    result = {name: device[name] for name in fieldset.fields}
+    if fieldset.batteries:
+        result['batteries'] = device['batteries']
+    return result
+
+
+def device_dicts(rows, fieldset: DeviceFieldset = FULL_DEVICE):
+    """
+    Преобразует строки устройств в словари с полями набора.
+
+    При загрузке батарей словари получают пустые списки batteries.
+
+    :param rows: Строки результата запроса.
+    :param fieldset: Набор полей.
+    :return: Список словарей устройств.
+    """
+    devices = []
+    for row in rows:
+        device = {name: getattr(row, name) for name in fieldset.fields}
+        if fieldset.batteries:
+            device['batteries'] = []
+        devices.append(device)
+    return devices
+
+
+def device_batteries_statements(devices, dialect: str = None):
+    """
+    Строит запросы батарей устройств.
+
+    На PostgreSQL все идентификаторы передаются одним массивом, на остальных
+    базах - порциями по BULK_CHUNK_SIZE.
+
+    :param devices: Словари устройств, полученные функцией device_dicts.
+    :param dialect: Имя диалекта базы данных.
+    :yield: Запросы, возвращающие (device_id, id, name) в порядке id.
+    """
+    ids = [device['id'] for device in devices]
+    size = len(ids) if dialect == 'postgresql' else BULK_CHUNK_SIZE
+    for start in range(0, len(ids), max(size, 1)):
+        yield (
+            select(Battery.device_id, Battery.id, Battery.name)
+            .where(ids_filter(Battery.device_id, ids[start:start + size], dialect))
+            .order_by(Battery.id)
+        )
+
+
+def add_device_batteries(devices, rows):
+    """
+    Раскладывает строки батарей по спискам batteries словарей устройств.
+
+    :param devices: Словари устройств.
+    :param rows: Строки (device_id, id, name).
+    """
+    batteries = {device['id']: device['batteries'] for device in devices}
+    for row in rows:
+        batteries[row.device_id].append({'id': row.id, 'name': row.name})
+
+
+def _device_dicts_with_batteries(
+    db: Session, rows, fieldset: DeviceFieldset = FULL_DEVICE
+):
+    devices = device_dicts(rows, fieldset)
+    if fieldset.batteries:
+        dialect = db.get_bind().dialect.name
+        for statement in device_batteries_statements(devices, dialect):
+            add_device_batteries(devices, db.execute(statement))
+    return devices
+
+
+def ids_filter(column, ids: List[int], dialect: str = None):
+    """
+    Строит условие на вхождение значения колонки в список идентификаторов.
+
+    На PostgreSQL используется column = ANY(:ids) с одним параметром-массивом,
+    поэтому текст запроса не зависит от количества идентификаторов.
+
+    :param column: Колонка.
+    :param ids: Идентификаторы.
+    :param dialect: Имя диалекта базы данных.
+    :return: Условие для where.
+    """
+    if dialect == 'postgresql':
+        return column == any_(literal(list(ids), ARRAY(Integer)))
+    return column.in_(list(ids))
+
+
+def parse_ids(ids: str):
+    """
+    Разбирает параметр ids вида "1,2,3".
+
+    :param ids: Идентификаторы через запятую.
+    :return: Список уникальных идентификаторов в исходном порядке.
+    :raises ValueError: Если идентификатор не число или их больше MAX_BATCH_IDS.
+    """
+    try:
+        result = list(dict.fromkeys(int(item) for item in ids.split(',') if item.strip()))
+    except ValueError:
+        raise ValueError("ids must be a comma-separated list of integers")
+    if len(result) > MAX_BATCH_IDS:
+        raise ValueError(f"Too many ids, at most {MAX_BATCH_IDS} allowed")
+    return result
+
+
+class Loader:
+    """
+    Загрузчик объектов по идентификаторам в пределах одного запроса.
+
+    Идентификаторы, переданные в enqueue, накапливаются и загружаются
+    одним запросом при первом обращении через load или load_many. Результаты,
+    в том числе отсутствующие объекты, запоминаются до конца транзакции,
+    поэтому вложенные обработчики могут запрашивать объекты независимо
+    друг от друга без N+1 запросов. Загрузчики одной сессии возвращает
+    функция loader.
+
+    :param db: Сессия базы данных.
+    :param fetch: Функция (db, ids), возвращающая словарь {id: объект}.
+    """
+
+    def __init__(self, db, fetch):
+        self.db = db
+        self._fetch = fetch
+        self._loaded = {}
+        self._pending = {}
+
+    def enqueue(self, ids):
+        """
+        Откладывает загрузку объектов до следующего обращения к загрузчику.
+
+        :param ids: Идентификаторы объектов.
+        """
+        for item_id in ids:
+            if item_id not in self._loaded:
+                self._pending[item_id] = None
+
+    def load(self, item_id: int):
+        """
+        Загружает один объект.
+
+        :param item_id: Идентификатор объекта.
+        :return: Объект или None, если он не найден.
+        """
+        return self.load_many([item_id])[0]
+
+    def load_many(self, ids):
+        """
+        Загружает объекты вместе со всеми отложенными идентификаторами.
+
+        :param ids: Идентификаторы объектов.
+        :return: Список объектов в порядке ids; None для отсутствующих.
+        """
+        ids = list(ids)
+        self.enqueue(ids)
+        if self._pending:
+            pending, self._pending = list(self._pending), {}
+            found = self._fetch(self.db, pending)
+            for item_id in pending:
+                self._loaded[item_id] = found.get(item_id)
+        return [self._loaded[item_id] for item_id in ids]
+
+
+def loader(db, name: str, fetch, factory=Loader):
+    """
+    Возвращает загрузчик сессии, создавая его при первом обращении.
+
+    Сессия живет один HTTP-запрос, поэтому загрузчик не видит данных
+    других запросов. После фиксации транзакции загрузчики сбрасываются.
+
+    :param db: Сессия базы данных (синхронная или асинхронная).
+    :param name: Имя загрузчика.
+    :param fetch: Функция загрузки для нового загрузчика.
+    :param factory: Класс загрузчика.
+    :return: Экземпляр загрузчика.
+    """
+    loaders = db.info.setdefault('loaders', {})
+    if name not in loaders:
+        loaders[name] = factory(db, fetch)
+    return loaders[name]
+
+
+@event.listens_for(Session, 'after_commit')
+def _reset_loaders(session):
+    session.info.pop('loaders', None)
+
+
+def fetch_devices(db: Session, ids: List[int]):
+    """
+    Загружает устройства с батареями двумя запросами.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы устройств.
+    :return: Словарь {id: словарь устройства с батареями}.
+    """
+    rows = db.execute(
+        select(Device.id, Device.name)
+        .where(ids_filter(Device.id, ids, db.get_bind().dialect.name))
+    )
+    return {device['id']: device for device in _device_dicts_with_batteries(db, rows)}
+
+
+def fetch_batteries(db: Session, ids: List[int]):
+    """
+    Загружает батареи одним запросом.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы батарей.
+    :return: Словарь {id: словарь батареи}.
+    """
+    rows = db.execute(
+        select(Battery.id, Battery.name)
+        .where(ids_filter(Battery.id, ids, db.get_bind().dialect.name))
+    )
+    return {row.id: row._asdict() for row in rows}
+
+
+def get_devices_by_ids(db: Session, ids: List[int]):
+    """
+    Получает устройства с батареями по списку идентификаторов.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы устройств.
+    :return: Кортеж из найденных устройств (словари в порядке ids)
+             и списка отсутствующих идентификаторов.
+    """
+    return split_missing(ids, loader(db, 'devices', fetch_devices).load_many(ids))
+
+
+def get_batteries_by_ids(db: Session, ids: List[int]):
+    """
+    Получает батареи по списку идентификаторов.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы батарей.
+    :return: Кортеж из найденных батарей (словари в порядке ids)
+             и списка отсутствующих идентификаторов.
+    """
+    return split_missing(ids, loader(db, 'batteries', fetch_batteries).load_many(ids))
+
+
+def split_missing(ids: List[int], found: list):
+    """
+    Разделяет результат загрузчика на найденные объекты и отсутствующие идентификаторы.
+
+    :param ids: Запрошенные идентификаторы.
+    :param found: Объекты в порядке ids; None для отсутствующих.
+    :return: Кортеж из списка объектов и списка отсутствующих идентификаторов.
+    """
+    return (
+        [item for item in found if item is not None],
+        [item_id for item_id, item in zip(ids, found) if item is None]
+    )
+
+
+def get_devices(
+    db: Session, skip: int = 0, limit: int = 10,
+    has_free_slots: Optional[bool] = None, as_dicts: bool = False,
+    fieldset: Optional[DeviceFieldset] = None
+):
     """
     Получает список устройств с возможностью пропуска и ограничения количества результатов.
 
     :param db: Сессия базы данных.
     :param skip: Количество пропущенных записей (для пагинации).
     :param limit: Максимальное количество возвращаемых записей.
+    :param has_free_slots: Фильтр по наличию свободных мест для батарей.
+    :param as_dicts: Выбирать только нужные колонки и вернуть словари
+        вместо ORM-объектов (для быстрой сериализации).
+    :param fieldset: Набор полей; если задан, возвращаются словари только
+        с этими полями, батареи загружаются только по запросу.
     :return: Список устройств.
     """
-    return db.query(Device).offset(skip).limit(limit).all()
+    if as_dicts or fieldset is not None:
+        fieldset = fieldset or FULL_DEVICE
+        rows = db.execute(
+            select(*device_columns(fieldset)).where(*device_filters(has_free_slots))
+            .order_by(Device.id).offset(skip).limit(limit)
+        )
+        return _device_dicts_with_batteries(db, rows, fieldset)
+    return (
+        db.query(Device).options(selectinload(Device.batteries))
+        .filter(*device_filters(has_free_slots))
+        .order_by(Device.id).offset(skip).limit(limit).all()
+    )
+
+
+def get_devices_tree(db: Session):
+    """
+    Получает все устройства с привязанными батареями в виде готового JSON.
+
+    Вложенная структура собирается на стороне базы данных одним запросом,
+    без загрузки ORM-объектов и повторной сериализации.
+
+    :param db: Сессия базы данных.
+    :return: JSON-массив устройств с вложенными списками батарей.
+    """
+    return db.execute(devices_tree_statement(db.get_bind().dialect.name)).scalar()
+
+
+def devices_tree_statement(dialect: str):
+    """
+    Строит запрос, агрегирующий устройства и батареи в один JSON-массив.
+
+    :param dialect: Имя диалекта базы данных ('postgresql' или 'sqlite').
+    :return: Запрос, возвращающий JSON-массив в виде строки.
+    """
+    if dialect == 'sqlite':
+        batteries = (
+            select(func.json_group_array(
+                func.json_object('id', Battery.id, 'name', Battery.name)
+            ))
+            .where(Battery.device_id == Device.id)
+            .scalar_subquery()
+        )
+        return select(func.json_group_array(func.json_object(
+            'id', Device.id, 'name', Device.name,
+            'batteries', func.json(batteries)
+        )))
+
+    batteries = (
+        select(func.coalesce(
+            func.json_agg(aggregate_order_by(
+                func.json_build_object('id', Battery.id, 'name', Battery.name),
+                Battery.id
+            )),
+            literal_column("'[]'::json")
+        ))
+        .where(Battery.device_id == Device.id)
+        .scalar_subquery()
+    )
+    devices = func.json_agg(aggregate_order_by(
+        func.json_build_object(
+            'id', Device.id, 'name', Device.name, 'batteries', batteries
+        ),
+        Device.id
+    ))
+    return select(cast(
+        func.coalesce(devices, literal_column("'[]'::json")), Text
+    ))
+
+
+def get_devices_page(
+    db: Session, after: str = None, limit: int = 10, sort: str = 'id',
+    has_free_slots: Optional[bool] = None, as_dicts: bool = False,
+    fieldset: Optional[DeviceFieldset] = None
+):
+    """
+    Получает страницу устройств с keyset-пагинацией по курсору.
+
+    :param db: Сессия базы данных.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param sort: Поле сортировки: 'id' или 'name'.
+    :param has_free_slots: Фильтр по наличию свободных мест для батарей.
+    :param as_dicts: Вернуть устройства в виде словарей вместо ORM-объектов.
+    :param fieldset: Набор полей; если задан, возвращаются словари только
+        с этими полями, батареи загружаются только по запросу.
+    :return: Словарь со списком устройств и курсором следующей страницы.
+    :raises ValueError: Если курсор или поле сортировки некорректны.
+    """
+    if as_dicts or fieldset is not None:
+        fieldset = fieldset or FULL_DEVICE
+        query = keyset(
+            select(*device_columns(fieldset, sort)).where(*device_filters(has_free_slots)),
+            Device, after=after, limit=limit, sort=sort
+        )
+        page = build_page(db.execute(query).all(), limit=limit, sort=sort)
+        page['items'] = _device_dicts_with_batteries(db, page['items'], fieldset)
+        return page
+    query = keyset(
+        db.query(Device).options(selectinload(Device.batteries))
+        .filter(*device_filters(has_free_slots)), Device,
+        after=after, limit=limit, sort=sort
+    )
+    return build_page(query.all(), limit=limit, sort=sort)
+
+
+def search_devices(db: Session, query: str, skip: int = 0, limit: int = 10):
+    """
+    Ищет устройства по фрагменту имени (префиксу или подстроке) без учета регистра.
+
+    Результаты ранжируются: точные совпадения, затем совпадения по префиксу,
+    затем по подстроке; внутри группы - более короткие имена.
+
+    :param db: Сессия базы данных.
+    :param query: Строка поиска.
+    :param skip: Количество пропущенных результатов.
+    :param limit: Максимальное количество возвращаемых результатов.
+    :return: Список найденных устройств.
+    """
+    return _search(
+        db, Device, query, skip, limit, options=[selectinload(Device.batteries)]
+    )
 
 
-def update_device(db: Session, device_id: int, name: str):
+def update_device(
+    db: Session, device_id: int, name: str, versions: Optional[List[int]] = None
+):
     """
     Обновляет имя устройства по его идентификатору.
 
+    Изменение выполняется условным UPDATE ... RETURNING, который проверяет
+    версию и увеличивает ее (см. update_device_statements). Устройство
+    читается повторно, только если версия не совпала.
+
     :param db: Сессия базы данных.
     :param device_id: Идентификатор устройства.
     :param name: Новое имя устройства.
-    :return: Обновленное устройство или None, если устройство не найдено.
+    :param versions: Допустимые текущие версии (из If-Match) или None без проверки.
+    :return: Словарь обновленного устройства с батареями и версией
+             или None, если устройство не найдено.
+    :raises VersionMismatch: Если версия устройства не входит в versions.
     """
-    db_device = db.query(Device).filter(Device.id == device_id).first()
-    if db_device:
-        db_device.name = name
-        db.commit()
-        db.refresh(db_device)
-        return db_device
-    return None
+    rows = []
+    for stmt in update_device_statements(
+        db.get_bind().dialect.name, device_id, name, versions
+    ):
+        rows = db.execute(stmt, execution_options={'synchronize_session': False}).all()
+        if not rows:
+            db.rollback()
+            current = device_from_rows(db.execute(device_rows_statement(device_id)).all())
+            if current is None:
+                return None
+            raise VersionMismatch(current)
+    db.commit()
+    result = device_from_rows(rows)
+    get_cache().delete(device_key(device_id))
+    name_index(Device.__tablename__).add([(device_id, name)])
+    publish_changes('device', 'updated', [{'id': device_id, 'name': name}])
+    return result
+
+
+def update_device_statements(
+    dialect: str, device_id: int, name: str, versions: Optional[List[int]] = None
+):
+    """
+    Строит запросы изменения имени устройства.
+
+    UPDATE срабатывает, только если версия устройства входит в versions,
+    и увеличивает ее. На PostgreSQL UPDATE выполняется в CTE, и тот же
+    запрос возвращает батареи устройства; в SQLite батареи читаются
+    вторым запросом в той же транзакции.
+
+    :param dialect: Имя диалекта базы данных ('postgresql' или 'sqlite').
+    :param device_id: Идентификатор устройства.
+    :param name: Новое имя устройства.
+    :param versions: Допустимые текущие версии или None без проверки.
+    :return: Список запросов; каждый должен вернуть строки, последний -
+             строки для device_from_rows.
+    """
+    stmt = (
+        update(Device)
+        .where(Device.id == device_id, *version_filter(Device, versions))
+        .values(name=name, version=Device.version + 1)
+        .returning(Device.id, Device.name, Device.version)
+    )
+    if dialect == 'sqlite':
+        return [stmt, device_rows_statement(device_id)]
+    return [_device_rows(stmt.cte('updated'))]
+
+
+def device_rows_statement(device_id: int):
+    """
+    Строит запрос устройства с версией и батареями.
+
+    :param device_id: Идентификатор устройства.
+    :return: Запрос, возвращающий строки для device_from_rows.
+    """
+    device = select(Device.id, Device.name, Device.version).where(Device.id == device_id)
+    return _device_rows(device.subquery())
+
+
+def _device_rows(device):
+    return (
+        select(
+            device.c.id, device.c.name, device.c.version,
+            Battery.id.label('battery_id'), Battery.name.label('battery_name')
+        )
+        .select_from(device.outerjoin(Battery, Battery.device_id == device.c.id))
+        .order_by(Battery.id)
+    )
+
+
+def device_from_rows(rows):
+    """
+    Собирает словарь устройства из строк устройства с батареями.
+
+    :param rows: Строки (id, name, version, battery_id, battery_name).
+    :return: Словарь устройства с батареями и версией или None, если строк нет.
+    """
+    if not rows:
+        return None
+    return {
+        'id': rows[0].id,
+        'name': rows[0].name,
+        'version': rows[0].version,
+        'batteries': [
+            {'id': row.battery_id, 'name': row.battery_name}
+            for row in rows if row.battery_id is not None
+        ]
+    }
+
+
+def update_battery_statement(
+    battery_id: int, name: str, versions: Optional[List[int]] = None
+):
+    """
+    Строит условный запрос изменения имени батареи.
+
+    UPDATE срабатывает, только если версия батареи входит в versions,
+    и увеличивает ее.
+
+    :param battery_id: Идентификатор батареи.
+    :param name: Новое имя батареи.
+    :param versions: Допустимые текущие версии или None без проверки.
+    :return: Запрос, возвращающий строку (id, name, device_id, version).
+    """
+    return (
+        update(Battery)
+        .where(Battery.id == battery_id, *version_filter(Battery, versions))
+        .values(name=name, version=Battery.version + 1)
+        .returning(*BATTERY_VERSION_COLUMNS)
+    )
+
+
+def battery_row_statement(battery_id: int):
+    """
+    Строит запрос батареи с версией.
+
+    :param battery_id: Идентификатор батареи.
+    :return: Запрос, возвращающий строку (id, name, device_id, version).
+    """
+    return select(*BATTERY_VERSION_COLUMNS).where(Battery.id == battery_id)
+
+
+def version_filter(model, versions: Optional[List[int]] = None):
+    """
+    Строит условие на версию объекта для условного UPDATE.
+
+    :param model: Модель (Device или Battery).
+    :param versions: Допустимые версии или None без проверки.
+    :return: Список условий (пустой без проверки).
+    """
+    if versions is None:
+        return []
+    return [model.version.in_(versions)]
 
 
 def delete_device(db: Session, device_id: int):
     """
     Удаляет устройство по его идентификатору.
 
+    Строка устройства блокируется до удаления, чтобы параллельная привязка
+    не изменила количество удаляемых вместе с ним батарей.
+
     :param db: Сессия базы данных.
     :param device_id: Идентификатор устройства.
     :return: Удаленное устройство или None, если устройство не найдено.
     """
-    db_device = db.query(Device).filter(Device.id == device_id).first()
+    db_device = (
+        db.query(Device).options(selectinload(Device.batteries))
+        .filter(Device.id == device_id).with_for_update().first()
+    )
     if db_device:
         db.delete(db_device)
+        _adjust_fleet(db, {
+            FLEET_DEVICES: -1,
+            FLEET_BATTERIES: -len(db_device.batteries),
+            bucket_counter(db_device.battery_count): -1,
+        })
         db.commit()
+        get_cache().delete(
+            device_key(device_id),
+            *(battery_key(battery.id) for battery in db_device.batteries)
+        )
+        name_index(Device.__tablename__).remove([device_id])
+        name_index(Battery.__tablename__).remove(
+            battery.id for battery in db_device.batteries
+        )
+        publish_changes('device', 'deleted', [device_item(db_device)])
+        publish_changes('battery', 'deleted', map(battery_item, db_device.batteries))
         return db_device
     return None
 
@@ -86,30 +816,106 @@ def attach_battery_to_device(db: Session, battery_id: int, device_id: int):
     """
     Присоединяет аккумулятор к устройству.
 
+    Проверка лимита и привязка выполняются одним условным UPDATE ... RETURNING
+    по счетчику battery_count, поэтому параллельные привязки не могут
+    превысить лимит. Причина отказа определяется только при неудаче.
+
     :param db: Сессия базы данных.
     :param battery_id: Идентификатор батареи.
     :param device_id: Идентификатор устройства.
-    :return: Обновленная батарея.
-    :raises ValueError: Если батарея или устройство не найдены,
-                        батарея уже привязана к другому устройству,
-                        или устройство имеет уже 5 привязанных батарей.
+    :return: Словарь с данными о привязанной батарее.
+    :raises NotFoundError: Если батарея или устройство не найдены.
+    :raises ConflictError: Если батарея уже привязана к другому устройству
+                           или устройство имеет уже 5 привязанных батарей.
     """
-    battery = db.query(Battery).filter(Battery.id == battery_id).first()
-    device = db.query(Device).filter(Device.id == device_id).first()
-
-    if not battery:
-        raise ValueError("Battery not found")
-    if not device:
-        raise ValueError("Device not found")
-    if battery.device_id:
-        raise ValueError("Battery is already assigned to another device")
-    if len(device.batteries) >= 5:
-        raise ValueError("Cannot add more than 5 batteries to a device")
-
-    battery.device_id = device_id
+    rows = []
+    for stmt in attach_statements(db.get_bind().dialect.name, battery_id, device_id):
+        row = db.execute(stmt, execution_options={'synchronize_session': False}).first()
+        if row is None:
+            db.rollback()
+            raise attach_error(
+                db.get(Battery, battery_id), db.get(Device, device_id)
+            )
+        rows.append(row)
+    _adjust_fleet(db, attach_deltas(rows[0].battery_count))
     db.commit()
-    db.refresh(battery)
-    return battery
+    row = rows[-1]
+    get_cache().delete(battery_key(battery_id), device_key(device_id))
+    attached = {'id': row.id, 'name': row.name, 'device_id': row.device_id}
+    publish_changes('battery', 'attached', [attached])
+    return attached
+
+
+def attach_statements(dialect: str, battery_id: int, device_id: int):
+    """
+    Строит запросы привязки батареи к устройству.
+
+    На PostgreSQL резервирование места на устройстве выполняется в CTE,
+    и вся привязка занимает один запрос. SQLite не поддерживает изменяющие
+    CTE, поэтому там выполняются два запроса в одной транзакции.
+
+    :param dialect: Имя диалекта базы данных ('postgresql' или 'sqlite').
+    :param battery_id: Идентификатор батареи.
+    :param device_id: Идентификатор устройства.
+    :return: Список запросов; каждый должен вернуть строку, первый
+             возвращает новое значение battery_count устройства, последний -
+             привязанную батарею.
+    """
+    claim = (
+        update(Device)
+        .where(
+            Device.id == device_id,
+            Device.battery_count < MAX_BATTERIES_PER_DEVICE,
+            exists().where(Battery.id == battery_id, Battery.device_id.is_(None))
+        )
+        .values(battery_count=Device.battery_count + 1)
+        .returning(Device.id, Device.battery_count)
+    )
+    assign = (
+        update(Battery)
+        .where(Battery.id == battery_id, Battery.device_id.is_(None))
+        .values(device_id=device_id)
+        .returning(Battery.id, Battery.name, Battery.device_id)
+    )
+    if dialect == 'sqlite':
+        return [claim, assign]
+    claim = claim.cte('claim')
+    battery_count = select(claim.c.battery_count).scalar_subquery().label('battery_count')
+    return [
+        assign.where(exists(select(claim.c.id))).add_cte(claim)
+        .returning(battery_count)
+    ]
+
+
+def attach_deltas(battery_count: int):
+    """
+    Возвращает изменения счетчиков статистики парка при привязке батареи.
+
+    :param battery_count: Количество батарей устройства после привязки.
+    :return: Словарь изменений счетчиков.
+    """
+    return merge_deltas(
+        {FLEET_UNATTACHED: -1}, bucket_moved(battery_count - 1, battery_count)
+    )
+
+
+def attach_error(battery, device):
+    """
+    Определяет причину неудачной привязки батареи.
+
+    :param battery: Батарея или None, если она не найдена.
+    :param device: Устройство или None, если оно не найдено.
+    :return: Исключение, описывающее причину отказа.
+    """
+    if battery is None:
+        return BatteryNotFound()
+    if device is None:
+        return DeviceNotFound()
+    if battery.device_id is not None:
+        return BatteryAlreadyAttached()
+    if device.battery_count >= MAX_BATTERIES_PER_DEVICE:
+        return DeviceFull(MAX_BATTERIES_PER_DEVICE)
+    return ConflictError("Attach conflicted with a concurrent change, retry it")
 
 
 def create_battery(db: Session, name: str):
@@ -122,8 +928,12 @@ def create_battery(db: Session, name: str):
     """
     db_battery = Battery(name=name)
     db.add(db_battery)
+    _adjust_fleet(db, {FLEET_BATTERIES: 1, FLEET_UNATTACHED: 1})
     db.commit()
     db.refresh(db_battery)
+    get_cache().delete(battery_key(db_battery.id))
+    name_index(Battery.__tablename__).add([(db_battery.id, db_battery.name)])
+    publish_changes('battery', 'created', [battery_item(db_battery)])
     return db_battery
 
 
@@ -131,41 +941,142 @@ def get_battery(db: Session, battery_id: int):
     """
     Получает батарею по ее идентификатору.
 
+    Результат кешируется и сбрасывается функциями, изменяющими батарею.
+    Кеш заполняется только результатом чтения с основного сервера (см.
+    get_device_with_batteries). Запросы, которые должны видеть собственные
+    изменения клиента, читают из базы данных в обход кеша.
+
     :param db: Сессия базы данных.
     :param battery_id: Идентификатор батареи.
-    :return: Батарея или None, если батарея не найдена.
+    :return: Словарь с данными о батарее и ее версией или None, если батарея не найдена.
     """
-    return db.query(Battery).filter(Battery.id == battery_id).first()
+    cached = None if requires_fresh_reads() else get_cache().get(battery_key(battery_id))
+    if cached is not None:
+        return cached
+    battery = db.query(Battery).filter(Battery.id == battery_id).first()
+    if battery:
+        result = {
+            'id': battery.id,
+            'name': battery.name,
+            'device_id': battery.device_id,
+            'version': battery.version
+        }
+        if read_from_primary(db):
+            get_cache().set(battery_key(battery_id), result)
+        return result
+    return None
 
 
-def get_batteries(db: Session, skip: int = 0, limit: int = 10):
+def get_batteries(
+    db: Session, skip: int = 0, limit: int = 10,
+    attached: Optional[bool] = None, device_id: Optional[int] = None,
+    as_dicts: bool = False
+):
     """
     Получает список батарей с возможностью пропуска и ограничения количества результатов.
 
     :param db: Сессия базы данных.
     :param skip: Количество пропущенных записей (для пагинации).
     :param limit: Максимальное количество возвращаемых записей.
+    :param attached: Фильтр по привязке батареи к устройству.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param as_dicts: Выбирать только нужные колонки и вернуть словари
+        вместо ORM-объектов (для быстрой сериализации).
     :return: Список батарей.
     """
-    return db.query(Battery).offset(skip).limit(limit).all()
+    if as_dicts:
+        rows = db.execute(
+            select(Battery.id, Battery.name).where(*battery_filters(attached, device_id))
+            .order_by(Battery.id).offset(skip).limit(limit)
+        )
+        return [row._asdict() for row in rows]
+    return (
+        db.query(Battery).filter(*battery_filters(attached, device_id))
+        .order_by(Battery.id).offset(skip).limit(limit).all()
+    )
+
+
+def get_batteries_page(
+    db: Session, after: str = None, limit: int = 10, sort: str = 'id',
+    attached: Optional[bool] = None, device_id: Optional[int] = None,
+    as_dicts: bool = False
+):
+    """
+    Получает страницу батарей с keyset-пагинацией по курсору.
+
+    :param db: Сессия базы данных.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param sort: Поле сортировки: 'id' или 'name'.
+    :param attached: Фильтр по привязке батареи к устройству.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param as_dicts: Вернуть батареи в виде словарей вместо ORM-объектов.
+    :return: Словарь со списком батарей и курсором следующей страницы.
+    :raises ValueError: Если курсор или поле сортировки некорректны.
+    """
+    if as_dicts:
+        query = keyset(
+            select(Battery.id, Battery.name).where(*battery_filters(attached, device_id)),
+            Battery, after=after, limit=limit, sort=sort
+        )
+        page = build_page(db.execute(query).all(), limit=limit, sort=sort)
+        page['items'] = [row._asdict() for row in page['items']]
+        return page
+    query = keyset(
+        db.query(Battery).filter(*battery_filters(attached, device_id)), Battery,
+        after=after, limit=limit, sort=sort
+    )
+    return build_page(query.all(), limit=limit, sort=sort)
 
 
-def update_battery(db: Session, battery_id: int, name: str):
+def search_batteries(db: Session, query: str, skip: int = 0, limit: int = 10):
+    """
+    Ищет батареи по фрагменту имени (префиксу или подстроке) без учета регистра.
+
+    Результаты ранжируются так же, как в search_devices.
+
+    :param db: Сессия базы данных.
+    :param query: Строка поиска.
+    :param skip: Количество пропущенных результатов.
+    :param limit: Максимальное количество возвращаемых результатов.
+    :return: Список найденных батарей.
+    """
+    return _search(db, Battery, query, skip, limit)
+
+
+def update_battery(
+    db: Session, battery_id: int, name: str, versions: Optional[List[int]] = None
+):
     """
     Обновляет имя батареи по ее идентификатору.
 
+    Изменение выполняется одним условным UPDATE ... RETURNING, который
+    проверяет версию и увеличивает ее. Батарея читается повторно, только
+    если версия не совпала.
+
     :param db: Сессия базы данных.
     :param battery_id: Идентификатор батареи.
     :param name: Новое имя батареи.
-    :return: Обновленная батарея или None, если батарея не найдена.
+    :param versions: Допустимые текущие версии (из If-Match) или None без проверки.
+    :return: Словарь обновленной батареи с версией или None, если батарея не найдена.
+    :raises VersionMismatch: Если версия батареи не входит в versions.
     """
-    db_battery = db.query(Battery).filter(Battery.id == battery_id).first()
-    if db_battery:
-        db_battery.name = name
-        db.commit()
-        db.refresh(db_battery)
-        return db_battery
-    return None
+    row = db.execute(
+        update_battery_statement(battery_id, name, versions),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if row is None:
+        db.rollback()
+        current = db.execute(battery_row_statement(battery_id)).first()
+        if current is None:
+            return None
+        raise VersionMismatch(current._asdict())
+    db.commit()
+    result = row._asdict()
+    evict_battery(battery_id, row.device_id)
+    name_index(Battery.__tablename__).add([(battery_id, name)])
+    publish_changes('battery', 'updated', [battery_item(row)])
+    return result
 
 
 def delete_battery(db: Session, battery_id: int):
@@ -179,6 +1090,615 @@ def delete_battery(db: Session, battery_id: int):
     db_battery = db.query(Battery).filter(Battery.id == battery_id).first()
     if db_battery:
         db.delete(db_battery)
+        deltas = {FLEET_BATTERIES: -1, FLEET_UNATTACHED: -1}
+        if db_battery.device_id:
+            battery_count = db.execute(
+                detach_statement(db_battery.device_id),
+                execution_options={'synchronize_session': False}
+            ).scalar()
+            deltas = detach_deltas(battery_count)
+        _adjust_fleet(db, deltas)
         db.commit()
+        evict_battery(db_battery.id, db_battery.device_id)
+        name_index(Battery.__tablename__).remove([battery_id])
+        publish_changes('battery', 'deleted', [battery_item(db_battery)])
         return db_battery
     return None
+
+
+def detach_statement(device_id: int):
+    """
+    Строит запрос, уменьшающий счетчик battery_count устройства
+    при удалении привязанной к нему батареи.
+
+    :param device_id: Идентификатор устройства.
+    :return: Запрос UPDATE, возвращающий новое значение battery_count.
+    """
+    return (
+        update(Device).where(Device.id == device_id)
+        .values(battery_count=Device.battery_count - 1)
+        .returning(Device.battery_count)
+    )
+
+
+def detach_deltas(battery_count):
+    """
+    Возвращает изменения счетчиков статистики парка при удалении
+    привязанной батареи.
+
+    :param battery_count: Количество батарей устройства после удаления
+        или None, если устройство уже удалено.
+    :return: Словарь изменений счетчиков.
+    """
+    if battery_count is None:
+        return {FLEET_BATTERIES: -1}
+    return merge_deltas(
+        {FLEET_BATTERIES: -1}, bucket_moved(battery_count + 1, battery_count)
+    )
+
+
+def iter_devices(db: Session, batch_size: int = 1000):
+    """
+    Потоково перебирает все устройства с идентификаторами их батарей.
+
+    Выполняется один запрос (устройства LEFT JOIN батареи), поэтому все строки
+    берутся из одного согласованного снимка базы данных. Строки читаются
+    серверным курсором порциями по batch_size, память не зависит от размера таблиц.
+
+    :param db: Сессия базы данных.
+    :param batch_size: Количество строк, получаемых из базы за одно обращение.
+    :yield: Словари с ключами id, name и battery_ids.
+    """
+    stmt = (
+        select(Device.id, Device.name, Battery.id.label('battery_id'))
+        .outerjoin(Battery, Battery.device_id == Device.id)
+        .order_by(Device.id, Battery.id)
+        .execution_options(yield_per=batch_size)
+    )
+    current = None
+    for row in db.execute(stmt):
+        if current is None or current['id'] != row.id:
+            if current is not None:
+                yield current
+            current = {'id': row.id, 'name': row.name, 'battery_ids': []}
+        if row.battery_id is not None:
+            current['battery_ids'].append(row.battery_id)
+    if current is not None:
+        yield current
+
+
+def iter_batteries(db: Session, batch_size: int = 1000):
+    """
+    Потоково перебирает все батареи одним запросом через серверный курсор.
+
+    :param db: Сессия базы данных.
+    :param batch_size: Количество строк, получаемых из базы за одно обращение.
+    :yield: Словари с ключами id, name и device_id.
+    """
+    stmt = (
+        select(Battery.id, Battery.name, Battery.device_id)
+        .order_by(Battery.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in db.execute(stmt):
+        yield {'id': row.id, 'name': row.name, 'device_id': row.device_id}
+
+
+def bulk_create_devices(db: Session, names: List[str]):
+    """
+    Создает устройства пачкой в одной транзакции.
+
+    :param db: Сессия базы данных.
+    :param names: Имена новых устройств.
+    :return: Словарь с созданными устройствами и ошибками по элементам.
+    """
+    result = _bulk_create(db, Device, names, "Device")
+    name_index(Device.__tablename__).add(_id_names(result['items']))
+    publish_changes('device', 'created', result['items'])
+    return result
+
+
+def bulk_update_devices(db: Session, items: List[dict]):
+    """
+    Переименовывает устройства пачкой в одной транзакции.
+
+    :param db: Сессия базы данных.
+    :param items: Список словарей с ключами id и name.
+    :return: Словарь с обновленными устройствами и ошибками по элементам.
+    """
+    result = _bulk_update(db, Device, items, "Device")
+    get_cache().delete(*(device_key(item['id']) for item in result['items']))
+    name_index(Device.__tablename__).add(_id_names(result['items']))
+    publish_changes('device', 'updated', result['items'])
+    return result
+
+
+def bulk_delete_devices(db: Session, ids: List[int]):
+    """
+    Удаляет устройства пачкой в одной транзакции.
+
+    Привязанные батареи удаляются каскадно на стороне базы данных; перед
+    удалением они выбираются, чтобы сбросить их из кеша и поиска
+    и опубликовать их удаление, как при удалении одного устройства.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы удаляемых устройств.
+    :return: Словарь с удаленными устройствами и ошибками по элементам.
+    """
+    result = _bulk_delete(db, Device, ids, "Device")
+    batteries = result.pop('batteries')
+    if result['items']:
+        get_cache().delete(
+            *(device_key(item['id']) for item in result['items']),
+            *(battery_key(battery['id']) for battery in batteries)
+        )
+        name_index(Device.__tablename__).remove(item['id'] for item in result['items'])
+        name_index(Battery.__tablename__).remove(battery['id'] for battery in batteries)
+        publish_changes('device', 'deleted', result['items'])
+        publish_changes('battery', 'deleted', batteries)
+    return result
+
+
+def bulk_create_batteries(db: Session, names: List[str]):
+    """
+    Создает батареи пачкой в одной транзакции.
+
+    :param db: Сессия базы данных.
+    :param names: Имена новых батарей.
+    :return: Словарь с созданными батареями и ошибками по элементам.
+    """
+    result = _bulk_create(db, Battery, names, "Battery")
+    name_index(Battery.__tablename__).add(_id_names(result['items']))
+    publish_changes('battery', 'created', result['items'])
+    return result
+
+
+def bulk_update_batteries(db: Session, items: List[dict]):
+    """
+    Переименовывает батареи пачкой в одной транзакции.
+
+    :param db: Сессия базы данных.
+    :param items: Список словарей с ключами id и name.
+    :return: Словарь с обновленными батареями и ошибками по элементам.
+    """
+    result = _bulk_update(db, Battery, items, "Battery")
+    if result['items']:
+        # Имена батарей входят в закешированные устройства.
+        get_cache().clear()
+        name_index(Battery.__tablename__).add(_id_names(result['items']))
+        publish_changes('battery', 'updated', result['items'])
+    return result
+
+
+def bulk_delete_batteries(db: Session, ids: List[int]):
+    """
+    Удаляет батареи пачкой в одной транзакции.
+
+    :param db: Сессия базы данных.
+    :param ids: Идентификаторы удаляемых батарей.
+    :return: Словарь с удаленными батареями и ошибками по элементам.
+    """
+    result = _bulk_delete(db, Battery, ids, "Battery")
+    if result['items']:
+        get_cache().clear()
+        name_index(Battery.__tablename__).remove(item['id'] for item in result['items'])
+        publish_changes('battery', 'deleted', result['items'])
+    return result
+
+
+def search_statement(model, query: str):
+    """
+    Строит запрос поиска по имени с ранжированием.
+
+    На PostgreSQL условие ILIKE '%...%' использует триграммный GIN-индекс
+    по имени (расширение pg_trgm).
+
+    :param model: Модель (Device или Battery).
+    :param query: Строка поиска.
+    :return: Запрос, возвращающий найденные записи в порядке ранжирования.
+    """
+    pattern = query.replace('/', '//').replace('%', '/%').replace('_', '/_')
+    rank = case(
+        (func.lower(model.name) == query.lower(), 0),
+        (model.name.ilike(f"{pattern}%", escape='/'), 1),
+        else_=2
+    )
+    return (
+        select(model).where(model.name.ilike(f"%{pattern}%", escape='/'))
+        .order_by(rank, func.length(model.name), model.name, model.id)
+    )
+
+
+def release_batteries(db: Session, detached: dict):
+    """
+    Уменьшает счетчик battery_count устройств на количество удаленных батарей.
+
+    Уменьшение, как и в delete_battery, выполняется относительно текущего
+    значения, поэтому не теряет параллельные привязки к тем же устройствам
+    (пересчет по таблице батарей мог бы прочитать их устаревшее состояние).
+
+    :param db: Сессия базы данных.
+    :param detached: Словарь {идентификатор устройства: количество удаленных батарей}.
+    :return: Словарь {идентификатор устройства: новое значение battery_count}.
+    """
+    by_count = {}
+    for device_id, count in detached.items():
+        by_count.setdefault(count, []).append(device_id)
+    result = {}
+    for count, device_ids in by_count.items():
+        for chunk in _chunks(sorted(device_ids)):
+            result.update(db.execute(
+                update(Device).where(Device.id.in_(chunk))
+                .values(battery_count=Device.battery_count - count)
+                .returning(Device.id, Device.battery_count),
+                execution_options={'synchronize_session': False}
+            ).all())
+    return result
+
+
+def bucket_moved(before: int, after: int):
+    """
+    Возвращает изменения счетчиков при переходе устройства в другую корзину.
+
+    :param before: Количество батарей устройства до изменения.
+    :param after: Количество батарей устройства после изменения.
+    :return: Словарь изменений счетчиков.
+    """
+    if before == after:
+        return {}
+    return {bucket_counter(before): -1, bucket_counter(after): 1}
+
+
+def merge_deltas(*deltas):
+    """
+    Складывает изменения счетчиков.
+
+    :param deltas: Словари изменений {имя счетчика: приращение}.
+    :return: Словарь суммарных изменений без нулевых значений.
+    """
+    result = {}
+    for delta in deltas:
+        for name, value in delta.items():
+            result[name] = result.get(name, 0) + value
+    return {name: value for name, value in result.items() if value}
+
+
+def fleet_counters_statement(dialect: str, deltas: dict):
+    """
+    Строит запрос, прибавляющий изменения к счетчикам статистики парка.
+
+    Запрос выполняется последним в транзакции, изменяющей устройства
+    и батареи. Все изменения попадают в один случайный шард, строки
+    блокируются в порядке имен счетчиков, как и при пересчете.
+
+    :param dialect: Имя диалекта базы данных ('postgresql' или 'sqlite').
+    :param deltas: Словарь изменений {имя счетчика: приращение}.
+    :return: Запрос INSERT ... ON CONFLICT DO UPDATE или None, если изменений нет.
+    """
+    deltas = merge_deltas(deltas)
+    if not deltas:
+        return None
+    insert = sqlite_insert if dialect == 'sqlite' else pg_insert
+    shard = random.randrange(FLEET_STATS_SHARDS)
+    stmt = insert(FleetCounter).values([
+        {'name': name, 'shard': shard, 'value': deltas[name]} for name in sorted(deltas)
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=['name', 'shard'],
+        set_={'value': FleetCounter.value + stmt.excluded.value}
+    )
+
+
+def _adjust_fleet(db: Session, *deltas):
+    """
+    Прибавляет изменения к счетчикам статистики парка в текущей транзакции.
+
+    :param db: Сессия базы данных.
+    :param deltas: Словари изменений {имя счетчика: приращение}.
+    """
+    stmt = fleet_counters_statement(db.get_bind().dialect.name, merge_deltas(*deltas))
+    if stmt is not None:
+        db.execute(stmt)
+
+
+def _search(db: Session, model, query: str, skip: int, limit: int, options=()):
+    """
+    Выполняет поиск по имени через индекс, подходящий для диалекта.
+
+    На PostgreSQL поиск выполняет база данных. На SQLite, где нет
+    триграммного индекса, используется n-граммный индекс в памяти процесса,
+    а записи загружаются одним запросом по найденным идентификаторам.
+
+    :param db: Сессия базы данных.
+    :param model: Модель (Device или Battery).
+    :param query: Строка поиска.
+    :param skip: Количество пропущенных результатов.
+    :param limit: Максимальное количество возвращаемых результатов.
+    :param options: Опции загрузки связей.
+    :return: Список найденных записей.
+    """
+    if db.get_bind().dialect.name != 'sqlite':
+        stmt = search_statement(model, query).options(*options).offset(skip).limit(limit)
+        return db.scalars(stmt).all()
+
+    index = name_index(model.__tablename__)
+    index.ensure_loaded(lambda: db.execute(select(model.id, model.name)).all())
+    ids = index.search(query, skip=skip, limit=limit)
+    if not ids:
+        return []
+    found = {
+        obj.id: obj
+        for obj in db.scalars(select(model).options(*options).where(model.id.in_(ids)))
+    }
+    return [found[object_id] for object_id in ids if object_id in found]
+
+
+def device_item(device):
+    """
+    Возвращает данные устройства для события ленты изменений.
+
+    :param device: Устройство.
+    :return: Словарь с ключами id и name.
+    """
+    return {'id': device.id, 'name': device.name}
+
+
+def battery_item(battery):
+    """
+    Возвращает данные батареи для события ленты изменений.
+
+    :param battery: Батарея.
+    :return: Словарь с ключами id, name и device_id.
+    """
+    return {'id': battery.id, 'name': battery.name, 'device_id': battery.device_id}
+
+
+def _split_names(value: str):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _id_names(items: List[dict]):
+    """
+    Возвращает пары (id, name) для индекса имен.
+
+    :param items: Записи с ключами id и name.
+    :return: Список пар.
+    """
+    return [(item['id'], item['name']) for item in items]
+
+
+def _chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    """
+    Разбивает список на части, чтобы не превышать лимиты параметров запроса.
+
+    :param items: Исходный список.
+    :param size: Размер части.
+    :yield: Части списка.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _insert(db: Session):
+    """
+    Возвращает конструктор INSERT с поддержкой ON CONFLICT для текущего диалекта.
+
+    :param db: Сессия базы данных.
+    :return: Функция insert диалекта PostgreSQL или SQLite.
+    """
+    if db.get_bind().dialect.name == 'sqlite':
+        return sqlite_insert
+    return pg_insert
+
+
+def _bulk_create(db: Session, model, names: List[str], label: str):
+    """
+    Вставляет записи многострочными INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Имена, уже занятые в базе или повторяющиеся в запросе, не прерывают
+    пачку, а попадают в список ошибок.
+
+    :param db: Сессия базы данных.
+    :param model: Модель (Device или Battery).
+    :param names: Имена новых записей.
+    :param label: Название сущности для сообщений об ошибках.
+    :return: Словарь с созданными записями и ошибками по элементам.
+    """
+    errors = []
+    pending = {}
+    for index, name in enumerate(names):
+        if name in pending:
+            errors.append({'index': index, 'detail': "Duplicate name in request"})
+        else:
+            pending[name] = index
+
+    created = {}
+    insert = _insert(db)
+    for chunk in _chunks(list(pending)):
+        stmt = (
+            insert(model).values([{'name': name} for name in chunk])
+            .on_conflict_do_nothing(index_elements=['name'])
+            .returning(model.id, model.name)
+        )
+        for row in db.execute(stmt):
+            created[row.name] = {'id': row.id, 'name': row.name}
+    if model is Device:
+        _adjust_fleet(db, {FLEET_DEVICES: len(created), bucket_counter(0): len(created)})
+    else:
+        _adjust_fleet(db, {FLEET_BATTERIES: len(created), FLEET_UNATTACHED: len(created)})
+    db.commit()
+
+    for name, index in pending.items():
+        if name not in created:
+            errors.append({
+                'index': index, 'detail': f"{label} with this name already exists"
+            })
+    return {
+        'items': list(created.values()),
+        'errors': sorted(errors, key=lambda error: error['index'])
+    }
+
+
+def _bulk_update(db: Session, model, items: List[dict], label: str):
+    """
+    Переименовывает записи через UPDATE ... FROM (VALUES ...) RETURNING.
+
+    Отсутствующие идентификаторы и занятые имена проверяются одним запросом
+    на часть пачки и попадают в список ошибок, остальные записи обновляются.
+
+    :param db: Сессия базы данных.
+    :param model: Модель (Device или Battery).
+    :param items: Список словарей с ключами id и name.
+    :param label: Название сущности для сообщений об ошибках.
+    :return: Словарь с обновленными записями и ошибками по элементам.
+    :raises ValueError: Если пачка конфликтует с параллельным изменением.
+    """
+    errors = []
+    pending = []
+    seen_ids, seen_names = set(), set()
+    for index, item in enumerate(items):
+        if item['id'] in seen_ids:
+            errors.append({'index': index, 'detail': "Duplicate id in request"})
+        elif item['name'] in seen_names:
+            errors.append({'index': index, 'detail': "Duplicate name in request"})
+        else:
+            seen_ids.add(item['id'])
+            seen_names.add(item['name'])
+            pending.append((index, item))
+
+    updated = []
+    try:
+        for chunk in _chunks(pending):
+            ids = [item['id'] for _, item in chunk]
+            names = [item['name'] for _, item in chunk]
+            existing = set(db.scalars(select(model.id).where(model.id.in_(ids))))
+            taken = dict(db.execute(
+                select(model.name, model.id).where(model.name.in_(names))
+            ).all())
+
+            rows = []
+            for index, item in chunk:
+                if item['id'] not in existing:
+                    errors.append({'index': index, 'detail': f"{label} not found"})
+                elif taken.get(item['name'], item['id']) != item['id']:
+                    errors.append({
+                        'index': index,
+                        'detail': f"{label} with this name already exists"
+                    })
+                else:
+                    rows.append({'id': item['id'], 'name': item['name']})
+            if rows:
+                updated.extend(_update_rows(db, model, rows))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise ValueError("Batch conflicts with a concurrent update, retry it")
+    return {
+        'items': updated,
+        'errors': sorted(errors, key=lambda error: error['index'])
+    }
+
+
+def _update_rows(db: Session, model, rows: List[dict]):
+    """
+    Обновляет имена записей одним запросом.
+
+    :param db: Сессия базы данных.
+    :param model: Модель (Device или Battery).
+    :param rows: Список словарей с ключами id и name.
+    :return: Список обновленных записей.
+    """
+    if db.get_bind().dialect.name == 'sqlite':
+        table = model.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam('row_id'))
+            .values(name=bindparam('row_name'), version=table.c.version + 1),
+            [{'row_id': row['id'], 'row_name': row['name']} for row in rows]
+        )
+        return rows
+
+    data = values(
+        column('id', Integer), column('name', String), name='data'
+    ).data([(row['id'], row['name']) for row in rows])
+    stmt = (
+        update(model).where(model.id == data.c.id)
+        .values(name=data.c.name, version=model.version + 1)
+        .returning(model.id, model.name)
+    )
+    return [
+        {'id': row.id, 'name': row.name}
+        for row in db.execute(stmt, execution_options={'synchronize_session': False})
+    ]
+
+
+def _bulk_delete(db: Session, model, ids: List[int], label: str):
+    """
+    Удаляет записи через DELETE ... WHERE id IN (...) RETURNING.
+
+    :param db: Сессия базы данных.
+    :param model: Модель (Device или Battery).
+    :param ids: Идентификаторы удаляемых записей.
+    :param label: Название сущности для сообщений об ошибках.
+    :return: Словарь с удаленными записями и ошибками по элементам; для
+        устройств - еще и с каскадно удаленными батареями (ключ batteries).
+    """
+    deleted = {}
+    cascaded = []
+    # Количество удаленных батарей по устройствам или удаленных устройств
+    # по количеству батарей - для счетчиков статистики парка.
+    detached = {}
+    returning = [model.id, model.name]
+    returning.append(Battery.device_id if model is Battery else Device.battery_count)
+    for chunk in _chunks(list(dict.fromkeys(ids))):
+        if model is Device:
+            # Устройства блокируются до выбора батарей (в том же порядке, что
+            # и в delete_device), чтобы параллельная привязка не добавила
+            # батарею, которая удалится каскадно без события.
+            db.execute(
+                select(Device.id).where(Device.id.in_(chunk))
+                .order_by(Device.id).with_for_update()
+            ).all()
+            cascaded += [
+                row._asdict() for row in db.execute(
+                    select(Battery.id, Battery.name, Battery.device_id)
+                    .where(Battery.device_id.in_(chunk)).order_by(Battery.id)
+                )
+            ]
+        stmt = delete(model).where(model.id.in_(chunk)).returning(*returning)
+        result = db.execute(stmt, execution_options={'synchronize_session': False})
+        for row in result:
+            deleted[row.id] = {'id': row.id, 'name': row.name}
+            if model is Battery:
+                deleted[row.id]['device_id'] = row.device_id
+                detached[row.device_id] = detached.get(row.device_id, 0) + 1
+            else:
+                detached[row.battery_count] = detached.get(row.battery_count, 0) + 1
+
+    if model is Device:
+        deltas = [{
+            FLEET_DEVICES: -len(deleted),
+            FLEET_BATTERIES: -sum(count * n for count, n in detached.items()),
+        }]
+        deltas += [{bucket_counter(count): -n} for count, n in detached.items()]
+    else:
+        deltas = [{
+            FLEET_BATTERIES: -len(deleted),
+            FLEET_UNATTACHED: -detached.pop(None, 0),
+        }]
+        for device_id, count in release_batteries(db, detached).items():
+            deltas.append(bucket_moved(count + detached[device_id], count))
+    _adjust_fleet(db, *deltas)
+    db.commit()
+
+    errors = []
+    reported = set()
+    for index, item_id in enumerate(ids):
+        if item_id in reported:
+            errors.append({'index': index, 'detail': "Duplicate id in request"})
+        elif item_id not in deleted:
+            errors.append({'index': index, 'detail': f"{label} not found"})
+        reported.add(item_id)
+    result = {'items': list(deleted.values()), 'errors': errors}
+    if model is Device:
+        result['batteries'] = cascaded
+    return result
@@ -0,0 +1,577 @@
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.cache import battery_key, device_key, evict_battery, get_cache
+from app.changes import publish_changes
+from app.crud import (
+    FLEET_BATTERIES, FLEET_DEVICES, FLEET_UNATTACHED, FULL_DEVICE,
+    DeviceFieldset, Loader, add_device_batteries, attach_deltas, attach_error,
+    attach_statements, battery_filters, battery_item, battery_row_statement,
+    bucket_counter, detach_deltas, detach_statement,
+    device_batteries_statements, device_columns, device_dicts, device_filters,
+    device_from_rows, device_item, device_rows_statement,
+    devices_tree_statement, fleet_counters_statement, ids_filter, loader,
+    merge_deltas, select_fields, split_missing, update_battery_statement,
+    update_device_statements
+)
+from app.exceptions import VersionMismatch
+from app.models import Device, Battery
+from app.pagination import build_page, keyset
+from app.replicas import read_from_primary, requires_fresh_reads
+from app.search import name_index
+
+
+async def create_device(db: AsyncSession, name: str):
+    """
+    Создает новое устройство и сохраняет его в базе данных.
+
+    :param db: Асинхронная сессия базы данных.
+    :param name: Имя устройства.
+    :return: Созданное устройство.
+    """
+    db_device = Device(name=name, batteries=[])
+    db.add(db_device)
+    await _adjust_fleet(db, {FLEET_DEVICES: 1, bucket_counter(0): 1})
+    await db.commit()
+    name_index(Device.__tablename__).add([(db_device.id, db_device.name)])
+    publish_changes('device', 'created', [device_item(db_device)])
+    return db_device
+
+
+async def get_device_with_batteries(
+    db: AsyncSession, device_id: int, fieldset: Optional[DeviceFieldset] = None
+):
+    """
+    Получает устройство по его идентификатору вместе с привязанными к нему батареями.
+
+    Результат кешируется и сбрасывается функциями, изменяющими устройство
+    или его батареи. Попадание в кеш обходит выбор реплики, поэтому кеш
+    заполняется только результатом чтения с основного сервера: прочитанное
+    с реплики возвращается без кеширования, чтобы ее отставание не осталось
+    в кеше на весь CACHE_TTL. Запросы, которые должны видеть собственные
+    изменения клиента, читают из базы данных в обход кеша. Выборочное
+    представление берется из кеша, если устройство там есть, иначе
+    выбираются только нужные колонки.
+
+    :param db: Асинхронная сессия базы данных.
+    :param device_id: Идентификатор устройства.
+    :param fieldset: Набор полей или None для полного представления.
+    :return: Словарь с данными об устройстве и привязанных к нему батареях
+        (полное представление содержит и версию устройства).
+    """
+    cached = None if requires_fresh_reads() else get_cache().get(device_key(device_id))
+    if cached is not None:
+        return cached if fieldset is None else select_fields(cached, fieldset)
+    if fieldset is not None:
+        rows = await db.execute(
+            select(*device_columns(fieldset)).where(Device.id == device_id)
+        )
+        devices = await _device_dicts_with_batteries(db, rows, fieldset)
+        return devices[0] if devices else None
+    device = await _get_device(db, device_id)
+    if device:
+        result = {
+            'id': device.id,
+            'name': device.name,
+            'version': device.version,
+            'batteries': [{'id': b.id, 'name': b.name} for b in device.batteries]
+        }
+        if read_from_primary(db):
+            get_cache().set(device_key(device_id), result)
+        return result
+    return None
+
+
+async def _device_dicts_with_batteries(
+    db: AsyncSession, rows, fieldset: DeviceFieldset = FULL_DEVICE
+):
+    devices = device_dicts(rows, fieldset)
+    if fieldset.batteries:
+        dialect = db.get_bind().dialect.name
+        for statement in device_batteries_statements(devices, dialect):
+            add_device_batteries(devices, await db.execute(statement))
+    return devices
+
+
+class AsyncLoader(Loader):
+    """
+    Асинхронный вариант Loader: функция загрузки и методы load - корутины.
+    """
+
+    async def load(self, item_id: int):
+        return (await self.load_many([item_id]))[0]
+
+    async def load_many(self, ids):
+        ids = list(ids)
+        self.enqueue(ids)
+        if self._pending:
+            pending, self._pending = list(self._pending), {}
+            found = await self._fetch(self.db, pending)
+            for item_id in pending:
+                self._loaded[item_id] = found.get(item_id)
+        return [self._loaded[item_id] for item_id in ids]
+
+
+async def fetch_devices(db: AsyncSession, ids: List[int]):
+    """
+    Загружает устройства с батареями двумя запросами.
+
+    :param db: Асинхронная сессия базы данных.
+    :param ids: Идентификаторы устройств.
+    :return: Словарь {id: словарь устройства с батареями}.
+    """
+    rows = await db.execute(
+        select(Device.id, Device.name)
+        .where(ids_filter(Device.id, ids, db.get_bind().dialect.name))
+    )
+    devices = await _device_dicts_with_batteries(db, rows.all())
+    return {device['id']: device for device in devices}
+
+
+async def fetch_batteries(db: AsyncSession, ids: List[int]):
+    """
+    Загружает батареи одним запросом.
+
+    :param db: Асинхронная сессия базы данных.
+    :param ids: Идентификаторы батарей.
+    :return: Словарь {id: словарь батареи}.
+    """
+    rows = await db.execute(
+        select(Battery.id, Battery.name)
+        .where(ids_filter(Battery.id, ids, db.get_bind().dialect.name))
+    )
+    return {row.id: row._asdict() for row in rows}
+
+
+async def get_devices_by_ids(db: AsyncSession, ids: List[int]):
+    """
+    Получает устройства с батареями по списку идентификаторов.
+
+    :param db: Асинхронная сессия базы данных.
+    :param ids: Идентификаторы устройств.
+    :return: Кортеж из найденных устройств (словари в порядке ids)
+             и списка отсутствующих идентификаторов.
+    """
+    found = await loader(db, 'devices', fetch_devices, AsyncLoader).load_many(ids)
+    return split_missing(ids, found)
+
+
+async def get_batteries_by_ids(db: AsyncSession, ids: List[int]):
+    """
+    Получает батареи по списку идентификаторов.
+
+    :param db: Асинхронная сессия базы данных.
+    :param ids: Идентификаторы батарей.
+    :return: Кортеж из найденных батарей (словари в порядке ids)
+             и списка отсутствующих идентификаторов.
+    """
+    found = await loader(db, 'batteries', fetch_batteries, AsyncLoader).load_many(ids)
+    return split_missing(ids, found)
+
+
+async def get_devices(
+    db: AsyncSession, skip: int = 0, limit: int = 10,
+    has_free_slots: Optional[bool] = None, as_dicts: bool = False,
+    fieldset: Optional[DeviceFieldset] = None
+):
+    """
+    Получает список устройств с возможностью пропуска и ограничения количества результатов.
+
+    :param db: Асинхронная сессия базы данных.
+    :param skip: Количество пропущенных записей (для пагинации).
+    :param limit: Максимальное количество возвращаемых записей.
+    :param has_free_slots: Фильтр по наличию свободных мест для батарей.
+    :param as_dicts: Выбирать только нужные колонки и вернуть словари
+        вместо ORM-объектов (для быстрой сериализации).
+    :param fieldset: Набор полей; если задан, возвращаются словари только
+        с этими полями, батареи загружаются только по запросу.
+    :return: Список устройств.
+    """
+    if as_dicts or fieldset is not None:
+        fieldset = fieldset or FULL_DEVICE
+        rows = await db.execute(
+            select(*device_columns(fieldset)).where(*device_filters(has_free_slots))
+            .order_by(Device.id).offset(skip).limit(limit)
+        )
+        return await _device_dicts_with_batteries(db, rows, fieldset)
+    result = await db.execute(
+        select(Device).options(selectinload(Device.batteries))
+        .filter(*device_filters(has_free_slots))
+        .order_by(Device.id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_devices_tree(db: AsyncSession):
+    """
+    Получает все устройства с привязанными батареями в виде готового JSON.
+
+    Вложенная структура собирается на стороне базы данных одним запросом,
+    без загрузки ORM-объектов и повторной сериализации.
+
+    :param db: Асинхронная сессия базы данных.
+    :return: JSON-массив устройств с вложенными списками батарей.
+    """
+    result = await db.execute(devices_tree_statement(db.get_bind().dialect.name))
+    return result.scalar()
+
+
+async def get_devices_page(
+    db: AsyncSession, after: str = None, limit: int = 10, sort: str = 'id',
+    has_free_slots: Optional[bool] = None, as_dicts: bool = False,
+    fieldset: Optional[DeviceFieldset] = None
+):
+    """
+    Получает страницу устройств с keyset-пагинацией по курсору.
+
+    :param db: Асинхронная сессия базы данных.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param sort: Поле сортировки: 'id' или 'name'.
+    :param has_free_slots: Фильтр по наличию свободных мест для батарей.
+    :param as_dicts: Вернуть устройства в виде словарей вместо ORM-объектов.
+    :param fieldset: Набор полей; если задан, возвращаются словари только
+        с этими полями, батареи загружаются только по запросу.
+    :return: Словарь со списком устройств и курсором следующей страницы.
+    :raises ValueError: Если курсор или поле сортировки некорректны.
+    """
+    if as_dicts or fieldset is not None:
+        fieldset = fieldset or FULL_DEVICE
+        query = keyset(
+            select(*device_columns(fieldset, sort)).where(*device_filters(has_free_slots)),
+            Device, after=after, limit=limit, sort=sort
+        )
+        result = await db.execute(query)
+        page = build_page(result.all(), limit=limit, sort=sort)
+        page['items'] = await _device_dicts_with_batteries(db, page['items'], fieldset)
+        return page
+    query = keyset(
+        select(Device).options(selectinload(Device.batteries))
+        .filter(*device_filters(has_free_slots)), Device,
+        after=after, limit=limit, sort=sort
+    )
+    result = await db.execute(query)
+    return build_page(result.scalars().all(), limit=limit, sort=sort)
+
+
+async def update_device(
+    db: AsyncSession, device_id: int, name: str, versions: Optional[List[int]] = None
+):
+    """
+    Обновляет имя устройства по его идентификатору.
+
+    Изменение выполняется условным UPDATE ... RETURNING, который проверяет
+    версию и увеличивает ее. Устройство читается повторно, только если
+    версия не совпала.
+
+    :param db: Асинхронная сессия базы данных.
+    :param device_id: Идентификатор устройства.
+    :param name: Новое имя устройства.
+    :param versions: Допустимые текущие версии (из If-Match) или None без проверки.
+    :return: Словарь обновленного устройства с батареями и версией
+             или None, если устройство не найдено.
+    :raises VersionMismatch: Если версия устройства не входит в versions.
+    """
+    rows = []
+    for stmt in update_device_statements(
+        db.get_bind().dialect.name, device_id, name, versions
+    ):
+        rows = (await db.execute(
+            stmt, execution_options={'synchronize_session': False}
+        )).all()
+        if not rows:
+            await db.rollback()
+            current = device_from_rows(
+                (await db.execute(device_rows_statement(device_id))).all()
+            )
+            if current is None:
+                return None
+            raise VersionMismatch(current)
+    await db.commit()
+    result = device_from_rows(rows)
+    get_cache().delete(device_key(device_id))
+    name_index(Device.__tablename__).add([(device_id, name)])
+    publish_changes('device', 'updated', [{'id': device_id, 'name': name}])
+    return result
+
+
+async def delete_device(db: AsyncSession, device_id: int):
+    """
+    Удаляет устройство по его идентификатору.
+
+    Строка устройства блокируется до удаления, чтобы параллельная привязка
+    не изменила количество удаляемых вместе с ним батарей.
+
+    :param db: Асинхронная сессия базы данных.
+    :param device_id: Идентификатор устройства.
+    :return: Удаленное устройство или None, если устройство не найдено.
+    """
+    db_device = await _get_device(db, device_id, for_update=True)
+    if db_device:
+        await db.delete(db_device)
+        await _adjust_fleet(db, {
+            FLEET_DEVICES: -1,
+            FLEET_BATTERIES: -len(db_device.batteries),
+            bucket_counter(db_device.battery_count): -1,
+        })
+        await db.commit()
+        get_cache().delete(
+            device_key(device_id),
+            *(battery_key(battery.id) for battery in db_device.batteries)
+        )
+        name_index(Device.__tablename__).remove([device_id])
+        name_index(Battery.__tablename__).remove(
+            battery.id for battery in db_device.batteries
+        )
+        publish_changes('device', 'deleted', [device_item(db_device)])
+        publish_changes('battery', 'deleted', map(battery_item, db_device.batteries))
+        return db_device
+    return None
+
+
+async def attach_battery_to_device(db: AsyncSession, battery_id: int, device_id: int):
+    """
+    Присоединяет аккумулятор к устройству.
+
+    Проверка лимита и привязка выполняются одним условным UPDATE ... RETURNING
+    по счетчику battery_count, поэтому параллельные привязки не могут
+    превысить лимит. Причина отказа определяется только при неудаче.
+
+    :param db: Асинхронная сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :param device_id: Идентификатор устройства.
+    :return: Словарь с данными о привязанной батарее.
+    :raises NotFoundError: Если батарея или устройство не найдены.
+    :raises ConflictError: Если батарея уже привязана к другому устройству
+                           или устройство имеет уже 5 привязанных батарей.
+    """
+    rows = []
+    for stmt in attach_statements(db.get_bind().dialect.name, battery_id, device_id):
+        result = await db.execute(
+            stmt, execution_options={'synchronize_session': False}
+        )
+        row = result.first()
+        if row is None:
+            await db.rollback()
+            raise attach_error(
+                await db.get(Battery, battery_id), await db.get(Device, device_id)
+            )
+        rows.append(row)
+    await _adjust_fleet(db, attach_deltas(rows[0].battery_count))
+    await db.commit()
+    row = rows[-1]
+    get_cache().delete(battery_key(battery_id), device_key(device_id))
+    attached = {'id': row.id, 'name': row.name, 'device_id': row.device_id}
+    publish_changes('battery', 'attached', [attached])
+    return attached
+
+
+async def create_battery(db: AsyncSession, name: str):
+    """
+    Создает новую батарею и сохраняет ее в базе данных.
+
+    :param db: Асинхронная сессия базы данных.
+    :param name: Имя батареи.
+    :return: Созданная батарея.
+    """
+    db_battery = Battery(name=name)
+    db.add(db_battery)
+    await _adjust_fleet(db, {FLEET_BATTERIES: 1, FLEET_UNATTACHED: 1})
+    await db.commit()
+    get_cache().delete(battery_key(db_battery.id))
+    name_index(Battery.__tablename__).add([(db_battery.id, db_battery.name)])
+    publish_changes('battery', 'created', [battery_item(db_battery)])
+    return db_battery
+
+
+async def get_battery(db: AsyncSession, battery_id: int):
+    """
+    Получает батарею по ее идентификатору.
+
+    Результат кешируется и сбрасывается функциями, изменяющими батарею.
+    Кеш заполняется только результатом чтения с основного сервера (см.
+    get_device_with_batteries). Запросы, которые должны видеть собственные
+    изменения клиента, читают из базы данных в обход кеша.
+
+    :param db: Асинхронная сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :return: Словарь с данными о батарее и ее версией или None, если батарея не найдена.
+    """
+    cached = None if requires_fresh_reads() else get_cache().get(battery_key(battery_id))
+    if cached is not None:
+        return cached
+    battery = await db.get(Battery, battery_id)
+    if battery:
+        result = {
+            'id': battery.id,
+            'name': battery.name,
+            'device_id': battery.device_id,
+            'version': battery.version
+        }
+        if read_from_primary(db):
+            get_cache().set(battery_key(battery_id), result)
+        return result
+    return None
+
+
+async def get_batteries(
+    db: AsyncSession, skip: int = 0, limit: int = 10,
+    attached: Optional[bool] = None, device_id: Optional[int] = None,
+    as_dicts: bool = False
+):
+    """
+    Получает список батарей с возможностью пропуска и ограничения количества результатов.
+
+    :param db: Асинхронная сессия базы данных.
+    :param skip: Количество пропущенных записей (для пагинации).
+    :param limit: Максимальное количество возвращаемых записей.
+    :param attached: Фильтр по привязке батареи к устройству.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param as_dicts: Выбирать только нужные колонки и вернуть словари
+        вместо ORM-объектов (для быстрой сериализации).
+    :return: Список батарей.
+    """
+    if as_dicts:
+        rows = await db.execute(
+            select(Battery.id, Battery.name).where(*battery_filters(attached, device_id))
+            .order_by(Battery.id).offset(skip).limit(limit)
+        )
+        return [row._asdict() for row in rows]
+    result = await db.execute(
+        select(Battery).filter(*battery_filters(attached, device_id))
+        .order_by(Battery.id).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_batteries_page(
+    db: AsyncSession, after: str = None, limit: int = 10, sort: str = 'id',
+    attached: Optional[bool] = None, device_id: Optional[int] = None,
+    as_dicts: bool = False
+):
+    """
+    Получает страницу батарей с keyset-пагинацией по курсору.
+
+    :param db: Асинхронная сессия базы данных.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param sort: Поле сортировки: 'id' или 'name'.
+    :param attached: Фильтр по привязке батареи к устройству.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param as_dicts: Вернуть батареи в виде словарей вместо ORM-объектов.
+    :return: Словарь со списком батарей и курсором следующей страницы.
+    :raises ValueError: Если курсор или поле сортировки некорректны.
+    """
+    if as_dicts:
+        query = keyset(
+            select(Battery.id, Battery.name).where(*battery_filters(attached, device_id)),
+            Battery, after=after, limit=limit, sort=sort
+        )
+        result = await db.execute(query)
+        page = build_page(result.all(), limit=limit, sort=sort)
+        page['items'] = [row._asdict() for row in page['items']]
+        return page
+    query = keyset(
+        select(Battery).filter(*battery_filters(attached, device_id)), Battery,
+        after=after, limit=limit, sort=sort
+    )
+    result = await db.execute(query)
+    return build_page(result.scalars().all(), limit=limit, sort=sort)
+
+
+async def update_battery(
+    db: AsyncSession, battery_id: int, name: str, versions: Optional[List[int]] = None
+):
+    """
+    Обновляет имя батареи по ее идентификатору.
+
+    Изменение выполняется одним условным UPDATE ... RETURNING, который
+    проверяет версию и увеличивает ее.
+
+    :param db: Асинхронная сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :param name: Новое имя батареи.
+    :param versions: Допустимые текущие версии (из If-Match) или None без проверки.
+    :return: Словарь обновленной батареи с версией или None, если батарея не найдена.
+    :raises VersionMismatch: Если версия батареи не входит в versions.
+    """
+    row = (await db.execute(
+        update_battery_statement(battery_id, name, versions),
+        execution_options={'synchronize_session': False}
+    )).first()
+    if row is None:
+        await db.rollback()
+        current = (await db.execute(battery_row_statement(battery_id))).first()
+        if current is None:
+            return None
+        raise VersionMismatch(current._asdict())
+    await db.commit()
+    result = row._asdict()
+    evict_battery(battery_id, row.device_id)
+    name_index(Battery.__tablename__).add([(battery_id, name)])
+    publish_changes('battery', 'updated', [battery_item(row)])
+    return result
+
+
+async def delete_battery(db: AsyncSession, battery_id: int):
+    """
+    Удаляет батарею по ее идентификатору.
+
+    :param db: Асинхронная сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :return: Удаленная батарея или None, если батарея не найдена.
+    """
+    db_battery = await db.get(Battery, battery_id)
+    if db_battery:
+        await db.delete(db_battery)
+        deltas = {FLEET_BATTERIES: -1, FLEET_UNATTACHED: -1}
+        if db_battery.device_id:
+            result = await db.execute(
+                detach_statement(db_battery.device_id),
+                execution_options={'synchronize_session': False}
+            )
+            deltas = detach_deltas(result.scalar())
+        await _adjust_fleet(db, deltas)
+        await db.commit()
+        evict_battery(db_battery.id, db_battery.device_id)
+        name_index(Battery.__tablename__).remove([battery_id])
+        publish_changes('battery', 'deleted', [battery_item(db_battery)])
+        return db_battery
+    return None
+
+
+async def _get_device(db: AsyncSession, device_id: int, for_update: bool = False):
+    """
+    Загружает устройство вместе с батареями одним запросом.
+
+    В асинхронной сессии ленивая загрузка связей недоступна,
+    поэтому батареи подгружаются заранее через joinedload.
+
+    :param db: Асинхронная сессия базы данных.
+    :param device_id: Идентификатор устройства.
+    :param for_update: Заблокировать строку устройства до конца транзакции.
+    :return: Устройство или None, если устройство не найдено.
+    """
+    stmt = (
+        select(Device).options(joinedload(Device.batteries))
+        .filter(Device.id == device_id)
+    )
+    if for_update:
+        stmt = stmt.with_for_update(of=Device)
+    result = await db.execute(stmt)
+    return result.unique().scalars().first()
+
+
+async def _adjust_fleet(db: AsyncSession, *deltas):
+    """
+    Прибавляет изменения к счетчикам статистики парка в текущей транзакции.
+
+    :param db: Асинхронная сессия базы данных.
+    :param deltas: Словари изменений {имя счетчика: приращение}.
+    """
+    stmt = fleet_counters_statement(db.get_bind().dialect.name, merge_deltas(*deltas))
+    if stmt is not None:
+        await db.execute(stmt)
@@ -1,13 +1,75 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+from app.metrics import TimedAsyncQueuePool, TimedQueuePool, instrument_engine
+from app.replicas import ReplicaSet, RoutingSession, connect_args
+from app.sqllog import log_statements
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+from config import (
+    ASYNC_DATABASE_REPLICA_URLS, ASYNC_DATABASE_URL, DATABASE_REPLICA_URLS,
+    DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_SIZE, REPLICA_CHECK_INTERVAL,
+    REPLICA_MAX_LAG, SQL_ECHO
+)
 
-engine = create_engine(DATABASE_URL, echo=True, pool_size=6, max_overflow=10)
+engine = create_engine(
+    DATABASE_URL, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+    poolclass=TimedQueuePool
+)
+instrument_engine(engine)
+log_statements(engine)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+replica_engines = [
+    create_engine(
+        url, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+        poolclass=TimedQueuePool, connect_args=connect_args(url)
+    )
+    for url in DATABASE_REPLICA_URLS
+]
+for number, replica_engine in enumerate(replica_engines):
+    instrument_engine(replica_engine, name=f'sync-replica{number}')
+    log_statements(replica_engine)
+
+replicas = ReplicaSet(
+    replica_engines, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL
+)
+
+SessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, bind=engine,
+    replicas=replicas
+)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+    poolclass=TimedAsyncQueuePool
+)
+instrument_engine(async_engine.sync_engine)
+log_statements(async_engine.sync_engine)
+
+async_replica_engines = [
+    create_async_engine(
+        url, echo=SQL_ECHO, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+        poolclass=TimedAsyncQueuePool, connect_args=connect_args(url)
+    )
+    for url in ASYNC_DATABASE_REPLICA_URLS
+]
+for number, replica_engine in enumerate(async_replica_engines):
+    instrument_engine(replica_engine.sync_engine, name=f'async-replica{number}')
+    log_statements(replica_engine.sync_engine)
+
+# Сессия асинхронного стека выбирает движок в синхронной части (sync_session),
+# поэтому набор реплик составляется из их sync_engine. Проверка из фонового
+# потока выполняется через синхронные движки тех же реплик.
+async_replicas = ReplicaSet(
+    [replica_engine.sync_engine for replica_engine in async_replica_engines],
+    max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL,
+    probes=replica_engines
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False,
+    sync_session_class=RoutingSession, replicas=async_replicas
+)
 
 
 def get_db():
@@ -22,3 +84,14 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    Создает и возвращает объект асинхронной сессии базы данных.
+    Используется как зависимость в асинхронных маршрутах FastAPI.
+
+    :yield: Объект асинхронной сессии базы данных (AsyncSession).
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,152 @@
+import hashlib
+import json
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def make_etag(state, version: int = None):
+    """
+    Вычисляет сильный ETag по состоянию представления.
+
+    ETag объекта с версией начинается с номера версии ("3-<хеш>"): по нему
+    изменяющий запрос с If-Match проверяет версию без чтения объекта.
+
+    :param state: Простые данные (кортежи, списки, строки, числа),
+                  однозначно описывающие тело ответа, или готовый JSON.
+    :param version: Версия объекта или None для списков и выборочных полей.
+    :return: ETag в кавычках.
+    """
+    if isinstance(state, (str, bytes)):
+        raw = state.encode() if isinstance(state, str) else state
+    else:
+        raw = json.dumps(state, separators=(',', ':'), default=str).encode()
+    digest = hashlib.sha1(raw).hexdigest()
+    return f'"{digest}"' if version is None else f'"{version}-{digest}"'
+
+
+def if_match_versions(if_match: str):
+    """
+    Извлекает версии объекта из заголовка If-Match.
+
+    Слабые ETag (W/) принимаются: их выдает сжатие ответов, а версия
+    от кодировки тела не зависит.
+
+    :param if_match: Значение заголовка If-Match или None.
+    :return: None, если заголовка нет или он равен *, иначе список версий
+        (пустой, если ни один ETag не содержит версию).
+    """
+    if not if_match:
+        return None
+    versions = []
+    for tag in if_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return None
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        version, separator, _ = tag.strip('"').partition('-')
+        if separator and version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def etag_matches(if_none_match: str, etag: str):
+    """
+    Проверяет заголовок If-None-Match на совпадение с ETag.
+
+    :param if_none_match: Значение заголовка If-None-Match или None.
+    :param etag: Текущий ETag ресурса.
+    :return: True, если клиент уже имеет актуальное представление.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(
+        (tag[2:] if tag.startswith('W/') else tag) == etag for tag in candidates
+    )
+
+
+def conditional(request: Request, response: Response, content, state, version: int = None):
+    """
+    Отвечает 304 Not Modified, если представление у клиента актуально.
+
+    Проверка выполняется до валидации и сериализации тела ответа.
+
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param content: Данные для тела ответа.
+    :param state: Простые данные, по которым вычисляется ETag.
+    :param version: Версия объекта для ETag или None.
+    :return: Ответ 304 или исходные данные для тела ответа.
+    """
+    etag = make_etag(state, version)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return content
+
+
+def precondition_failed(content, etag: str):
+    """
+    Отвечает 412 Precondition Failed с текущим представлением объекта.
+
+    Клиент может повторить изменение с новым ETag без дополнительного GET.
+
+    :param content: Текущее представление (модель схемы чтения).
+    :param etag: ETag текущего представления.
+    :return: Ответ 412.
+    """
+    return JSONResponse(jsonable_encoder(content), status_code=412, headers={'ETag': etag})
+
+
+def _field(obj, name: str):
+    if isinstance(obj, dict):
+        return obj[name]
+    return getattr(obj, name)
+
+
+def battery_state(battery):
+    """
+    Описывает представление батареи для вычисления ETag.
+
+    :param battery: Батарея (ORM-объект или словарь).
+    :return: Кортеж из идентификатора и имени.
+    """
+    return _field(battery, 'id'), _field(battery, 'name')
+
+
+def device_state(device):
+    """
+    Описывает представление устройства с батареями для вычисления ETag.
+
+    :param device: Устройство (ORM-объект или словарь).
+    :return: Кортеж из идентификатора, имени и состояний батарей.
+    """
+    return (
+        _field(device, 'id'), _field(device, 'name'),
+        [battery_state(battery) for battery in _field(device, 'batteries')]
+    )
+
+
+def collection_state(items, item_state, next_cursor: str = None):
+    """
+    Описывает представление списка или страницы для вычисления ETag.
+
+    :param items: Элементы списка.
+    :param item_state: Функция, описывающая один элемент.
+    :param next_cursor: Курсор следующей страницы, если он есть.
+    :return: Список состояний элементов и курсор.
+    """
+    return [item_state(item) for item in items], next_cursor
+
+
+def fields_state(item):
+    """
+    Описывает представление с выборочными полями (?fields=, ?include=) для вычисления ETag.
+
+    :param item: Словарь только с запрошенными полями.
+    :return: Пары (поле, значение) в порядке полей словаря.
+    """
+    return list(item.items())
@@ -0,0 +1,42 @@
+class NotFoundError(ValueError):
+    """
+    Объект, к которому обращается операция, не найден.
+    """
+
+
+class ConflictError(ValueError):
+    """
+    Операция противоречит текущему состоянию объектов.
+    """
+
+
+class BatteryNotFound(NotFoundError):
+    def __init__(self):
+        super().__init__("Battery not found")
+
+
+class DeviceNotFound(NotFoundError):
+    def __init__(self):
+        super().__init__("Device not found")
+
+
+class BatteryAlreadyAttached(ConflictError):
+    def __init__(self):
+        super().__init__("Battery is already assigned to another device")
+
+
+class DeviceFull(ConflictError):
+    def __init__(self, limit: int):
+        super().__init__(f"Cannot add more than {limit} batteries to a device")
+
+
+class VersionMismatch(ConflictError):
+    """
+    Версия объекта из If-Match не совпадает с текущей.
+
+    :param current: Текущее представление объекта.
+    """
+
+    def __init__(self, current):
+        super().__init__("Object was modified by another request")
+        self.current = current
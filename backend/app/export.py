@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from app.crud import iter_batteries, iter_devices
+from app.database import SessionLocal
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Количество строк, отправляемых клиенту одним фрагментом ответа.
+CHUNK_ROWS = 1000
+
+
+def stream_devices(fmt: str = 'ndjson'):
+    """
+    Формирует потоковую выгрузку всех устройств.
+
+    :param fmt: Формат выгрузки: 'ndjson' или 'csv'.
+    :return: Генератор фрагментов ответа в байтах.
+    """
+    return _stream(iter_devices, fmt, ['id', 'name', 'battery_ids'])
+
+
+def stream_batteries(fmt: str = 'ndjson'):
+    """
+    Формирует потоковую выгрузку всех батарей.
+
+    :param fmt: Формат выгрузки: 'ndjson' или 'csv'.
+    :return: Генератор фрагментов ответа в байтах.
+    """
+    return _stream(iter_batteries, fmt, ['id', 'name', 'device_id'])
+
+
+def _stream(iter_rows, fmt: str, fields):
+    """
+    Кодирует строки выгрузки порциями.
+
+    Сессия открывается внутри генератора и живет до конца передачи ответа,
+    а не до завершения обработчика маршрута.
+
+    :param iter_rows: Функция crud, перебирающая строки таблицы.
+    :param fmt: Формат выгрузки: 'ndjson' или 'csv'.
+    :param fields: Порядок колонок для CSV.
+    :yield: Фрагменты ответа в байтах.
+    """
+    with SessionLocal() as db:
+        rows = iter_rows(db, batch_size=CHUNK_ROWS)
+        if fmt == 'csv':
+            yield _csv_chunk([fields])
+        while True:
+            chunk = list(islice(rows, CHUNK_ROWS))
+            if not chunk:
+                break
+            if fmt == 'csv':
+                yield _csv_chunk(
+                    [_csv_value(row[field]) for field in fields] for row in chunk
+                )
+            else:
+                yield ''.join(
+                    json.dumps(row, separators=(',', ':')) + '\n' for row in chunk
+                ).encode()
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ';'.join(str(item) for item in value)
+    return value
@@ -0,0 +1,21 @@
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+
+
+def fast_json(content, response: Response):
+    """
+    Кодирует тело ответа через orjson, минуя валидацию по response_model.
+
+    Данные уже получены функциями crud в виде словарей той же структуры,
+    что и схемы чтения, поэтому повторная валидация не нужна. Схема
+    OpenAPI по-прежнему строится по response_model маршрута.
+
+    :param content: Словари или страница со словарями либо готовый ответ (304).
+    :param response: Ответ маршрута, заголовки которого (ETag) переносятся.
+    :return: Ответ с телом в JSON.
+    """
+    if isinstance(content, Response):
+        return content
+    result = ORJSONResponse(content)
+    result.headers.raw.extend(response.headers.raw)
+    return result
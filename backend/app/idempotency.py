@@ -0,0 +1,320 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.routing import Match
+
+from config import IDEMPOTENCY_MAX_SIZE, IDEMPOTENCY_PENDING_TTL, IDEMPOTENCY_TTL
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Максимальная длина ключа идемпотентности.
+MAX_KEY_LENGTH = 255
+
+# Заголовки запроса, входящие в отпечаток вместе с методом, путем и телом.
+FINGERPRINT_HEADERS = (b'if-match',)
+
+# Описание заголовка в OpenAPI. Маршрут с openapi_extra=IDEMPOTENT принимает
+# Idempotency-Key: повтор запроса с тем же ключом получает сохраненный ответ.
+IDEMPOTENT = {
+    'parameters': [{
+        'name': HEADER,
+        'in': 'header',
+        'required': False,
+        'schema': {'type': 'string', 'maxLength': MAX_KEY_LENGTH},
+        'description': 'Ключ, по которому повтор запроса получает сохраненный ответ '
+                       'без повторного выполнения.',
+    }],
+}
+
+
+class IdempotencyStore:
+    """
+    Интерфейс хранилища ответов по ключам идемпотентности.
+
+    Хранилище в памяти процесса может быть заменено общим хранилищем
+    (например, Redis с SET NX и временем жизни) через функцию set_store.
+    """
+
+    def get(self, key: str):
+        """
+        Получает запись по ключу.
+
+        :param key: Ключ идемпотентности.
+        :return: Запись или None, если ключ отсутствует или устарел.
+        """
+        raise NotImplementedError
+
+    def add(self, key: str, record, ttl: float):
+        """
+        Сохраняет запись, только если ключа еще нет.
+
+        :param key: Ключ идемпотентности.
+        :param record: Запись.
+        :param ttl: Время жизни записи в секундах.
+        :return: True, если запись сохранена; False, если ключ уже занят.
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, record, ttl: float):
+        """
+        Сохраняет запись, заменяя существующую.
+
+        :param key: Ключ идемпотентности.
+        :param record: Запись.
+        :param ttl: Время жизни записи в секундах.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """
+        Удаляет запись.
+
+        :param key: Ключ идемпотентности.
+        """
+        raise NotImplementedError
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Хранилище ответов в памяти процесса, ограниченное по размеру.
+
+    Устаревшие записи удаляются при обращении, а при превышении размера
+    вытесняются самые старые записи.
+
+    :param max_size: Максимальное количество записей.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get(key)
+
+    def add(self, key: str, record, ttl: float):
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, record, ttl)
+            return True
+
+    def set(self, key: str, record, ttl: float):
+        with self._lock:
+            self._set(key, record, ttl)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return record
+
+    def _set(self, key: str, record, ttl: float):
+        if self.max_size <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, record)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+_store: IdempotencyStore = MemoryIdempotencyStore(max_size=IDEMPOTENCY_MAX_SIZE)
+
+
+def get_store():
+    """
+    Возвращает текущее хранилище ответов.
+
+    :return: Экземпляр IdempotencyStore.
+    """
+    return _store
+
+
+def set_store(store: IdempotencyStore):
+    """
+    Заменяет хранилище ответов.
+
+    :param store: Новое хранилище.
+    """
+    global _store
+    _store = store
+
+
+def fingerprint(scope, body: bytes):
+    """
+    Вычисляет отпечаток запроса, с которым связывается ключ идемпотентности.
+
+    В отпечаток входят и заголовки, от которых зависит результат запроса
+    (FINGERPRINT_HEADERS): повтор с другим If-Match - другой запрос, и он
+    не должен получить сохраненный ответ 412 или 200.
+
+    :param scope: ASGI scope HTTP-запроса.
+    :param body: Тело запроса.
+    :return: Шестнадцатеричный SHA-256 метода, пути, строки запроса,
+        заголовков из FINGERPRINT_HEADERS и тела.
+    """
+    headers = dict(scope['headers'])
+    digest = hashlib.sha256()
+    for part in (
+        scope['method'].encode(), scope['path'].encode(), scope['query_string'],
+        *(headers.get(name, b'') for name in FINGERPRINT_HEADERS)
+    ):
+        digest.update(part)
+        digest.update(b'\0')
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI-middleware, сохраняющее ответы изменяющих запросов по ключу Idempotency-Key.
+
+    Действует только для маршрутов с openapi_extra=IDEMPOTENT. Первый запрос
+    с ключом выполняется, и его ответ (кроме ответов 5xx) сохраняется на ttl
+    секунд. Повтор с тем же ключом и тем же запросом получает сохраненный ответ
+    с заголовком Idempotent-Replayed без обращения к базе данных. Повтор во время
+    выполнения первого запроса получает 409, ключ с другим запросом - 422.
+
+    :param app: Оборачиваемое ASGI-приложение.
+    :param router: Роутер приложения, по маршрутам которого определяется,
+        принимает ли запрос ключ идемпотентности.
+    :param ttl: Время хранения ответа в секундах.
+    :param pending_ttl: Время (сек), в течение которого ключ выполняемого запроса
+        занят; ограничивает блокировку ключа, если ответ так и не был сохранен.
+    """
+
+    def __init__(self, app, router, ttl: float = IDEMPOTENCY_TTL,
+                 pending_ttl: float = IDEMPOTENCY_PENDING_TTL):
+        self.app = app
+        self.router = router
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+
+    async def __call__(self, scope, receive, send):
+        key = None
+        if scope['type'] == 'http' and scope['method'] in ('POST', 'PUT', 'PATCH'):
+            key = self._key(scope)
+        if key is None or not self._idempotent(scope):
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _error(send, 400, f"{HEADER} is longer than {MAX_KEY_LENGTH} characters")
+            return
+
+        body, receive = await _read_body(receive)
+        request_fingerprint = fingerprint(scope, body)
+        store = get_store()
+        pending = {'fingerprint': request_fingerprint, 'response': None}
+        if not store.add(key, pending, self.pending_ttl):
+            record = store.get(key)
+            if record is not None:
+                await self._replay(record, request_fingerprint, send)
+                return
+            # Запись устарела между add и get: ключ снова свободен.
+            store.set(key, pending, self.pending_ttl)
+
+        response = {'status': 500, 'headers': [], 'body': []}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = list(message.get('headers', []))
+            elif message['type'] == 'http.response.body':
+                response['body'].append(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            store.delete(key)
+            raise
+        if response['status'] >= 500:
+            # Ошибку сервера клиент может повторить с тем же ключом.
+            store.delete(key)
+            return
+        response['body'] = b''.join(response['body'])
+        store.set(key, {'fingerprint': request_fingerprint, 'response': response}, self.ttl)
+
+    def _key(self, scope):
+        for name, value in scope['headers']:
+            if name == b'idempotency-key':
+                return value.decode('latin-1')
+        return None
+
+    def _idempotent(self, scope):
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                extra = getattr(route, 'openapi_extra', None) or {}
+                return any(
+                    parameter.get('in') == 'header' and parameter.get('name') == HEADER
+                    for parameter in extra.get('parameters', ())
+                )
+        return False
+
+    async def _replay(self, record, request_fingerprint: str, send):
+        if record['fingerprint'] != request_fingerprint:
+            await _error(send, 422, f"{HEADER} was already used with a different request")
+            return
+        response = record['response']
+        if response is None:
+            await _error(
+                send, 409, f"A request with this {HEADER} is still in progress",
+                headers=[(b'retry-after', b'1')]
+            )
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': response['status'],
+            'headers': response['headers'] + [(REPLAYED_HEADER.lower().encode(), b'true')],
+        })
+        await send({'type': 'http.response.body', 'body': response['body']})
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    body = b''.join(chunks)
+    sent = False
+
+    async def replay_receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+
+    return body, replay_receive
+
+
+async def _error(send, status: int, detail: str, headers=()):
+    body = json.dumps({'detail': detail}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,279 @@
+import time
+from contextvars import ContextVar
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки HTTP-запроса.',
+    ['method', 'route', 'status'],
+)
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_seconds',
+    'Суммарное время SQL-запросов за один HTTP-запрос.',
+    ['method', 'route'],
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Количество SQL-запросов за один HTTP-запрос.',
+    ['method', 'route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200),
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Время ожидания свободного соединения в пуле.',
+    ['engine'],
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 30),
+)
+POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out',
+    'Количество соединений, выданных пулом.',
+    ['engine'],
+)
+REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds',
+    'Отставание реплики от основного сервера при последней проверке.',
+    ['replica'],
+)
+REPLICA_HEALTHY = Gauge(
+    'db_replica_healthy',
+    'Входит ли реплика в ротацию чтения (1) или исключена (0).',
+    ['replica'],
+)
+SQL_LOG_DROPPED = Counter(
+    'sql_log_dropped_total',
+    'Записи журнала SQL-запросов, отброшенные из-за переполнения очереди.',
+)
+ADMISSION_ACTIVE = Gauge(
+    'admission_active_requests',
+    'Количество запросов, допущенных к выполнению, по классам маршрутов.',
+    ['route_class'],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'admission_queue_depth',
+    'Количество запросов, ожидающих допуска, по классам маршрутов.',
+    ['route_class'],
+)
+ADMISSION_WAIT = Histogram(
+    'admission_wait_seconds',
+    'Время ожидания допуска запроса в очереди.',
+    ['route_class'],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+ADMISSION_SHED = Counter(
+    'admission_shed_total',
+    'Запросы, отклоненные с ответом 503: очередь заполнена (queue_full) '
+    'или истекло время ожидания (timeout).',
+    ['route_class', 'reason'],
+)
+TELEMETRY_READINGS = Counter(
+    'telemetry_readings_total',
+    'Показания телеметрии по результату записи: stored, duplicate, unknown_battery '
+    '(батарея не найдена), failed (показание нельзя записать, оно отброшено) '
+    'и retried (ошибка записи, пачка будет повторена).',
+    ['result'],
+)
+TELEMETRY_BUFFERED = Gauge(
+    'telemetry_buffered_readings',
+    'Количество принятых показаний телеметрии, ожидающих записи в базу данных.',
+)
+TELEMETRY_FLUSH = Histogram(
+    'telemetry_flush_seconds',
+    'Время записи одной пачки показаний телеметрии вместе с агрегатами.',
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+FLEET_COUNTER_DRIFT = Counter(
+    'fleet_counter_drift_total',
+    'Абсолютная величина расхождений счетчиков парка с таблицами, '
+    'исправленных при пересчете.',
+    ['counter'],
+)
+FLEET_RECONCILE = Histogram(
+    'fleet_reconcile_seconds',
+    'Время пересчета счетчиков парка по таблицам.',
+)
+FLEET_RECONCILE_FAILURES = Counter(
+    'fleet_reconcile_failures_total',
+    'Количество неудачных пересчетов счетчиков парка.',
+)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class RequestStats:
+    """
+    Счетчики SQL-запросов одного HTTP-запроса.
+
+    :param scope: ASGI scope запроса; маршрут появляется в нем после маршрутизации.
+    """
+
+    __slots__ = ('queries', 'db_time', 'scope')
+
+    def __init__(self, scope=None):
+        self.queries = 0
+        self.db_time = 0.0
+        self.scope = scope
+
+
+# Контекст наследуется потоками threadpool и гринлетами асинхронного движка,
+# поэтому запросы из синхронных и асинхронных маршрутов попадают в один объект.
+_request_stats: ContextVar = ContextVar('request_stats', default=None)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Пул соединений, измеряющий время ожидания свободного соединения.
+
+    Атрибут metrics_name задает значение метки engine в метриках пула.
+    """
+
+    metrics_name = 'sync'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(
+                time.perf_counter() - started
+            )
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """
+    Пул соединений асинхронного движка с измерением времени ожидания.
+    """
+
+    metrics_name = 'async'
+
+
+def instrument_engine(engine, name: str = None):
+    """
+    Подключает подсчет SQL-запросов и их времени к движку.
+
+    :param engine: Синхронный движок (для AsyncEngine - его sync_engine).
+    :param name: Значение метки engine в метриках пула; по умолчанию
+        берется из класса пула.
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    pool = engine.pool
+    if name is not None:
+        pool.metrics_name = name
+    POOL_CHECKED_OUT.labels(
+        getattr(pool, 'metrics_name', 'sync')
+    ).set_function(pool.checkedout)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record(time.perf_counter() - conn.info['query_started'].pop())
+
+
+def _handle_error(context):
+    if context.connection is None:
+        return
+    started = context.connection.info.get('query_started')
+    if started:
+        _record(time.perf_counter() - started.pop())
+
+
+def _record(elapsed: float):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware, измеряющее время обработки запроса и работу с базой данных.
+
+    В ответ добавляется заголовок Server-Timing с количеством и временем
+    SQL-запросов, выполненных до отправки заголовков ответа. Метрики
+    Prometheus учитывают запрос целиком, включая потоковую передачу тела.
+
+    :param app: Оборачиваемое ASGI-приложение.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(
+                    stats, time.perf_counter() - started
+                ).encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get('route')
+            path = getattr(route, 'path', UNMATCHED_ROUTE)
+            method = scope['method']
+            REQUEST_LATENCY.labels(method, path, status).observe(
+                time.perf_counter() - started
+            )
+            REQUEST_DB_TIME.labels(method, path).observe(stats.db_time)
+            REQUEST_QUERIES.labels(method, path).observe(stats.queries)
+
+
+def current_route():
+    """
+    Возвращает метод и шаблон пути текущего HTTP-запроса.
+
+    :return: Кортеж (метод, маршрут) или (None, None) вне HTTP-запроса.
+    """
+    stats = _request_stats.get()
+    if stats is None or stats.scope is None:
+        return None, None
+    route = stats.scope.get('route')
+    return stats.scope['method'], getattr(route, 'path', UNMATCHED_ROUTE)
+
+
+def server_timing(stats: RequestStats, total: float):
+    """
+    Формирует значение заголовка Server-Timing.
+
+    :param stats: Счетчики SQL-запросов запроса.
+    :param total: Время обработки запроса в секундах.
+    :return: Значение заголовка с длительностями в миллисекундах.
+    """
+    return (
+        f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+        f'app;dur={total * 1000:.2f}'
+    )
+
+
+def metrics_response():
+    """
+    Формирует ответ с метриками в текстовом формате Prometheus.
+
+    :return: Ответ для маршрута /metrics.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
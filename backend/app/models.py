@@ -1,4 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import (
+    REAL, BigInteger, Column, Float, ForeignKey, Index, Integer, String
+)
 from sqlalchemy.orm import relationship, declarative_base
 
 
@@ -11,12 +13,16 @@ class Device(Base):
 
     :param id: Уникальный идентификатор устройства.
     :param name: Имя устройства, должно быть уникальным.
+    :param battery_count: Количество привязанных батарей (денормализованный счетчик).
+    :param version: Версия полей устройства, увеличивается при каждом изменении имени.
     :param batteries: Связь один-ко-многим с батареями, привязанными к устройству.
     """
 
     __tablename__ = "devices"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
+    battery_count = Column(Integer, nullable=False, default=0, server_default='0')
+    version = Column(Integer, nullable=False, default=1, server_default='1')
     batteries = relationship(
         "Battery", back_populates="device",
         cascade="all, delete", passive_deletes=True
@@ -30,6 +36,7 @@ class Battery(Base):
     :param id: Уникальный идентификатор батареи.
     :param name: Имя батареи, должно быть уникальным.
     :param device_id: Идентификатор устройства, к которому привязана батарея.
+    :param version: Версия полей батареи, увеличивается при каждом изменении имени.
     :param device: Связь многие-к-одному с устройством, к которому привязана батарея.
     """
 
@@ -37,6 +44,110 @@ class Battery(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     device_id = Column(
-        Integer, ForeignKey("devices.id", ondelete="CASCADE")
+        Integer, ForeignKey("devices.id", ondelete="CASCADE"), index=True
     )
+    version = Column(Integer, nullable=False, default=1, server_default='1')
     device = relationship("Device", back_populates="batteries")
+
+    # Частичный индекс по свободным батареям: список для привязки к устройству
+    # читается по нему, не затрагивая привязанные батареи.
+    __table_args__ = (
+        Index(
+            'ix_batteries_unattached', id,
+            postgresql_where=device_id.is_(None), sqlite_where=device_id.is_(None)
+        ),
+    )
+
+
+class BatteryReading(Base):
+    """
+    Модель для таблицы показаний батарей (телеметрии).
+
+    Время хранится в миллисекундах Unix, значения - в 4-байтовых REAL.
+    В PostgreSQL таблица секционирована по времени (секция на сутки),
+    в SQLite хранится без rowid, упорядоченной по первичному ключу.
+    Внешнего ключа на батареи нет, чтобы не проверять его на каждую строку:
+    показания неизвестных батарей отбрасываются при записи пачки.
+
+    :param battery_id: Идентификатор батареи.
+    :param ts: Время показания в миллисекундах Unix.
+    :param voltage: Напряжение, В.
+    :param soc: Уровень заряда, %.
+    :param temperature: Температура, °C.
+    """
+
+    __tablename__ = "battery_readings"
+    battery_id = Column(Integer, primary_key=True)
+    ts = Column(BigInteger, primary_key=True)
+    voltage = Column(REAL, nullable=False)
+    soc = Column(REAL, nullable=False)
+    temperature = Column(REAL, nullable=False)
+
+    __table_args__ = {
+        'postgresql_partition_by': 'RANGE (ts)',
+        'sqlite_with_rowid': False,
+    }
+
+
+class ReadingRollupMixin:
+    """
+    Колонки агрегата показаний батареи за интервал.
+
+    Агрегаты обновляются при каждой записи пачки показаний: количество
+    и суммы складываются, минимумы и максимумы сравниваются, поэтому
+    среднее за интервал равно сумме, деленной на количество.
+
+    :param battery_id: Идентификатор батареи.
+    :param bucket: Начало интервала в миллисекундах Unix.
+    :param count: Количество показаний за интервал.
+    """
+
+    battery_id = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    count = Column(Integer, nullable=False)
+    voltage_sum = Column(Float, nullable=False)
+    voltage_min = Column(REAL, nullable=False)
+    voltage_max = Column(REAL, nullable=False)
+    soc_sum = Column(Float, nullable=False)
+    soc_min = Column(REAL, nullable=False)
+    soc_max = Column(REAL, nullable=False)
+    temperature_sum = Column(Float, nullable=False)
+    temperature_min = Column(REAL, nullable=False)
+    temperature_max = Column(REAL, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+class BatteryReadingMinute(ReadingRollupMixin, Base):
+    """
+    Модель для таблицы поминутных агрегатов показаний батарей.
+    """
+
+    __tablename__ = "battery_readings_1m"
+
+
+class BatteryReadingHour(ReadingRollupMixin, Base):
+    """
+    Модель для таблицы почасовых агрегатов показаний батарей.
+    """
+
+    __tablename__ = "battery_readings_1h"
+
+
+class FleetCounter(Base):
+    """
+    Модель для таблицы счетчиков парка устройств и батарей.
+
+    Каждый счетчик разбит на несколько строк (шардов): транзакция изменяет
+    строку случайного шарда, поэтому параллельные записи редко ждут
+    блокировку одной и той же строки. Значение счетчика - сумма его шардов.
+
+    :param name: Имя счетчика.
+    :param shard: Номер шарда.
+    :param value: Значение шарда.
+    """
+
+    __tablename__ = "fleet_counters"
+    name = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default='0')
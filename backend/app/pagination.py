@@ -0,0 +1,79 @@
+import base64
+import binascii
+import json
+
+SORT_FIELDS = ('id', 'name')
+
+
+def encode_cursor(sort: str, value):
+    """
+    Кодирует позицию последней записи страницы в непрозрачный курсор.
+
+    :param sort: Поле сортировки.
+    :param value: Значение поля сортировки у последней записи.
+    :return: Курсор в виде строки base64.
+    """
+    raw = json.dumps([sort, value], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str):
+    """
+    Декодирует курсор, полученный от клиента.
+
+    :param cursor: Курсор в виде строки base64.
+    :param sort: Поле сортировки текущего запроса.
+    :return: Значение поля сортировки, после которого начинается страница.
+    :raises ValueError: Если курсор поврежден или выдан для другой сортировки.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match sort order")
+    return value
+
+
+def keyset(query, model, after: str = None, limit: int = 10, sort: str = 'id'):
+    """
+    Применяет keyset-пагинацию к запросу.
+
+    Вместо OFFSET используется условие по индексированному полю
+    (первичный ключ или уникальный индекс по имени), поэтому стоимость
+    запроса не зависит от глубины страницы. Запрашивается на одну запись
+    больше, чтобы определить наличие следующей страницы.
+
+    :param query: Запрос (Query или Select) по модели.
+    :param model: Модель, по которой выполняется запрос.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param limit: Максимальное количество записей на странице.
+    :param sort: Поле сортировки: 'id' или 'name'.
+    :return: Запрос с условием, сортировкой и ограничением.
+    :raises ValueError: Если поле сортировки или курсор некорректны.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Unsupported sort field: {sort}")
+    column = getattr(model, sort)
+    if after is not None:
+        query = query.filter(column > decode_cursor(after, sort))
+    return query.order_by(column).limit(limit + 1)
+
+
+def build_page(items, limit: int = 10, sort: str = 'id'):
+    """
+    Формирует страницу из результата запроса, построенного функцией keyset.
+
+    :param items: Записи, полученные запросом (не более limit + 1).
+    :param limit: Максимальное количество записей на странице.
+    :param sort: Поле сортировки.
+    :return: Словарь со списком записей и курсором следующей страницы.
+    """
+    items = list(items)
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = None
+    if has_more and items:
+        next_cursor = encode_cursor(sort, getattr(items[-1], sort))
+    return {'items': items, 'next_cursor': next_cursor}
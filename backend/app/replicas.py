@@ -0,0 +1,289 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import Select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.requests import cookie_parser
+
+from app.metrics import REPLICA_HEALTHY, REPLICA_LAG
+from config import REPLICA_CHECK_TIMEOUT, REPLICA_STICKY_SECONDS
+
+logger = logging.getLogger('app.replicas')
+
+# Запросы отставания реплики по диалектам. Для баз без репликации
+# (например, SQLite в роли реплики) проверяется только доступность.
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE"
+        " WHEN NOT pg_is_in_recovery() THEN 0"
+        " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+        " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+        " END"
+    ),
+}
+DEFAULT_LAG_QUERY = "SELECT 0"
+
+# Ограничение времени запроса отставания, если диалект его поддерживает.
+LAG_TIMEOUTS = {
+    'postgresql': "SET LOCAL statement_timeout = {ms}",
+}
+
+# Cookie, до истечения которой запросы клиента читают с основного сервера.
+STICKY_COOKIE = 'db_primary_until'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+# Сервер для чтения в текущем HTTP-запросе: REPLICA, PRIMARY
+# или None вне ReadRoutingMiddleware (все запросы на основной сервер).
+_routing: ContextVar = ContextVar('db_routing', default=None)
+
+
+def replica_name(engine):
+    """
+    Возвращает имя реплики для меток метрик.
+
+    :param engine: Движок реплики.
+    :return: Строка подключения без пароля.
+    """
+    return engine.url.render_as_string(hide_password=True)
+
+
+def replica_lag(engine, timeout: float = REPLICA_CHECK_TIMEOUT):
+    """
+    Измеряет отставание реплики от основного сервера.
+
+    :param engine: Движок реплики (синхронный).
+    :param timeout: Ограничение времени запроса отставания в секундах.
+    :return: Отставание в секундах или None, если реплика недоступна.
+    """
+    query = LAG_QUERIES.get(engine.dialect.name, DEFAULT_LAG_QUERY)
+    limit = LAG_TIMEOUTS.get(engine.dialect.name)
+    try:
+        with engine.begin() as conn:
+            if limit is not None:
+                conn.execute(text(limit.format(ms=int(timeout * 1000))))
+            return float(conn.execute(text(query)).scalar() or 0)
+    except SQLAlchemyError:
+        return None
+
+
+def connect_args(url: str, timeout: float = REPLICA_CHECK_TIMEOUT):
+    """
+    Возвращает параметры подключения к реплике с ограничением времени соединения.
+
+    Без ограничения подключение к недоступному серверу ждет системного
+    таймаута TCP.
+
+    :param url: Строка подключения.
+    :param timeout: Время ожидания соединения в секундах.
+    :return: Словарь connect_args для create_engine.
+    """
+    if url.startswith('postgresql+asyncpg'):
+        return {'timeout': timeout}
+    if url.startswith('postgresql'):
+        return {'connect_timeout': max(1, math.ceil(timeout))}
+    return {}
+
+
+class ReplicaSet:
+    """
+    Набор реплик для чтения с проверкой их состояния.
+
+    Реплики выбираются по кругу среди исправных. Состояние проверяется
+    фоновым потоком раз в check_interval секунд, который запускается при
+    первом выборе реплики; выбор только читает результат последней проверки
+    и не ждет недоступных серверов. Реплика исключается из ротации, если она
+    недоступна или ее отставание превышает max_lag секунд, и возвращается
+    после успешной проверки. До первой проверки все чтение идет на основной
+    сервер.
+
+    :param engines: Движки реплик (для асинхронного стека - их sync_engine).
+    :param max_lag: Допустимое отставание реплики в секундах.
+    :param check_interval: Интервал между проверками в секундах.
+    :param probes: Синхронные движки тех же реплик для проверки или None,
+        чтобы проверять через engines. Движки асинхронного стека нельзя
+        использовать из фонового потока без цикла событий.
+    """
+
+    def __init__(self, engines, max_lag: float, check_interval: float, probes=None):
+        self.engines = list(engines)
+        self.probes = list(probes) if probes is not None else self.engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._healthy = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def healthy(self):
+        return list(self._healthy)
+
+    def choose(self):
+        """
+        Выбирает реплику для чтения.
+
+        :return: Движок исправной реплики или None, если таких нет.
+        """
+        if not self.engines:
+            return None
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+        healthy = self._healthy
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def check(self):
+        """
+        Проверяет доступность и отставание всех реплик и обновляет ротацию.
+        """
+        healthy = []
+        for engine, probe in zip(self.engines, self.probes):
+            lag = replica_lag(probe)
+            ok = lag is not None and lag <= self.max_lag
+            name = replica_name(engine)
+            REPLICA_LAG.labels(name).set(lag if lag is not None else math.nan)
+            REPLICA_HEALTHY.labels(name).set(1 if ok else 0)
+            if ok:
+                healthy.append(engine)
+        self._healthy = healthy
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                # Ротация остается прежней до следующей проверки; ошибка
+                # в журнале отличает сбой проверки от недоступной реплики.
+                logger.exception("Replica health check failed")
+            time.sleep(self.check_interval)
+
+
+class RoutingSession(Session):
+    """
+    Сессия, направляющая чтение запросов только на чтение на реплику.
+
+    На реплику уходят только SELECT в запросах, помеченных
+    ReadRoutingMiddleware как REPLICA. Запись, сброс изменений
+    и чтение в остальных запросах выполняются на основном сервере (bind
+    сессии). Реплика выбирается один раз на сессию, чтобы все чтения
+    одного запроса видели один и тот же сервер; read_from_replica
+    показывает, читала ли сессия с реплики.
+
+    :param replicas: Набор реплик или None.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self._replica = None
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if (
+            self.replicas is not None and _routing.get() == REPLICA
+            and not self._flushing and isinstance(clause, Select)
+        ):
+            if self._replica is None:
+                self._replica = self.replicas.choose() or False
+            if self._replica:
+                return self._replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    @property
+    def read_from_replica(self):
+        return bool(self._replica)
+
+
+def read_from_primary(db):
+    """
+    Проверяет, что сессия читала только с основного сервера.
+
+    Общий кеш чтения заполняется только такими результатами: данные
+    с отстающей реплики остались бы в кеше на весь CACHE_TTL для всех
+    клиентов, а не только на время допустимого отставания.
+
+    :param db: Сессия базы данных (синхронная или асинхронная).
+    :return: False, если хотя бы один запрос сессии выполнен на реплике.
+    """
+    session = getattr(db, 'sync_session', db)
+    return not getattr(session, 'read_from_replica', False)
+
+
+def requires_fresh_reads():
+    """
+    Проверяет, должен ли текущий запрос видеть собственные изменения клиента.
+
+    Такие запросы читают с основного сервера и не используют кеш чтения,
+    который мог быть заполнен с отстающей реплики.
+
+    :return: True для изменяющих запросов и запросов в окне после записи.
+    """
+    return _routing.get() == PRIMARY
+
+
+class ReadRoutingMiddleware:
+    """
+    ASGI-middleware, выбирающее сервер базы данных для запроса.
+
+    Безопасные запросы (GET, HEAD) читают с реплик. Изменяющие запросы
+    выполняются на основном сервере, а ответ на них устанавливает cookie,
+    по которой следующие запросы клиента в течение sticky_seconds тоже
+    идут на основной сервер и видят собственные изменения.
+
+    :param app: Оборачиваемое ASGI-приложение.
+    :param sticky_seconds: Длительность окна чтения с основного сервера после записи.
+    """
+
+    def __init__(self, app, sticky_seconds: float = REPLICA_STICKY_SECONDS):
+        self.app = app
+        self.sticky_seconds = sticky_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        write = scope['method'] not in SAFE_METHODS
+        routing = PRIMARY if write or self._sticky(scope) else REPLICA
+        token = _routing.set(routing)
+
+        async def send_wrapper(message):
+            if write and message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'set-cookie', self._cookie().encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _routing.reset(token)
+
+    def _sticky(self, scope):
+        for name, value in scope['headers']:
+            if name == b'cookie':
+                until = cookie_parser(value.decode('latin-1')).get(STICKY_COOKIE)
+                try:
+                    return until is not None and float(until) > time.time()
+                except ValueError:
+                    return False
+        return False
+
+    def _cookie(self):
+        until = time.time() + self.sticky_seconds
+        return (
+            f"{STICKY_COOKIE}={until:.3f}; Max-Age={math.ceil(self.sticky_seconds)}; "
+            f"Path=/; HttpOnly; SameSite=Lax"
+        )
@@ -1,18 +1,51 @@
-from fastapi import APIRouter, HTTPException, Depends
+import time
+from datetime import datetime
+
+from fastapi import (
+    APIRouter, Body, Depends, File, Header, HTTPException, Query, Request, Response,
+    UploadFile
+)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional, Union
 
 from app.crud import (
-    get_battery, get_batteries, create_battery,
+    get_battery, get_batteries, get_batteries_page, create_battery,
     update_battery, delete_battery,
-    get_devices, create_device, attach_battery_to_device,
-    update_device, delete_device, get_device_with_batteries
+    get_devices, get_devices_page, create_device, attach_battery_to_device,
+    update_device, delete_device, get_device_with_batteries,
+    get_devices_tree, search_devices, search_batteries,
+    bulk_create_batteries, bulk_update_batteries, bulk_delete_batteries,
+    bulk_create_devices, bulk_update_devices, bulk_delete_devices,
+    get_batteries_by_ids, get_devices_by_ids, parse_fieldset, parse_ids,
+    select_fields
 )
+from app.bulk_import import import_file
+from app.cache import get_cache
+from app.changes import stream_changes
 from app.database import get_db
+from app.etag import (
+    battery_state, collection_state, conditional, device_state,
+    etag_matches, fields_state, if_match_versions, make_etag, precondition_failed
+)
+from app.exceptions import ConflictError, NotFoundError, VersionMismatch
+from app.export import MEDIA_TYPES, stream_batteries, stream_devices
+from app.fastjson import fast_json
+from app.idempotency import IDEMPOTENT
 from app.schemas import (
-    BatteryCreate, BatteryUpdate, BatteryRead,
-    DeviceCreate, DeviceUpdate, DeviceRead
+    BatteryCreate, BatteryUpdate, BatteryRead, BatteryPage,
+    DeviceCreate, DeviceUpdate, DeviceRead, DevicePage,
+    BulkItem, BulkResult, CacheStats, FleetStats, ImportResult, TelemetryAccepted,
+    TelemetryPoint, TelemetryRollupPoint
+)
+from app.stats import get_fleet_stats
+from app.telemetry import (
+    DEFAULT_WINDOWS, READINGS, READINGS_BODY, get_buffer, get_readings, get_rollups,
+    prepare_readings, to_ms
 )
+from config import FAST_JSON, TELEMETRY_MAX_BATCH
 
 router = APIRouter()
 
@@ -24,12 +57,19 @@ router = APIRouter()
 )
 def read_battery(
     battery_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db)
 ):
     """
     Получает информацию о батарее по ее идентификатору.
 
+    Поддерживает условный запрос If-None-Match: при совпадении ETag
+    возвращается 304 без тела ответа.
+
     :param battery_id: Идентификатор батареи.
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag.
     :param db: Сессия базы данных.
     :return: Информация о батарее.
     :raises HTTPException: Если батарея не найдена.
@@ -37,33 +77,113 @@ def read_battery(
     db_battery = get_battery(db=db, battery_id=battery_id)
     if db_battery is None:
         raise HTTPException(status_code=404, detail="Battery not found")
-    return db_battery
+    return conditional(
+        request, response, db_battery, battery_state(db_battery), db_battery.get('version')
+    )
 
 
 @router.get(
     "/batteries/",
-    response_model=List[BatteryRead],
+    response_model=Union[List[BatteryRead], BatteryPage],
     tags=['batteries']
 )
 def read_batteries(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    pagination: Literal['offset', 'cursor'] = 'offset',
+    after: Optional[str] = None,
+    sort: Literal['id', 'name'] = 'id',
+    attached: Optional[bool] = None,
+    device_id: Optional[int] = None,
+    ids: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получает список батарей с возможностью пагинации.
 
+    По умолчанию используется пагинация через skip/limit и возвращается список.
+    При pagination=cursor или переданном курсоре after используется
+    keyset-пагинация: возвращается страница с полем next_cursor.
+    С параметром ids возвращаются найденные объекты в порядке ids,
+    отсутствующие идентификаторы перечисляются в заголовке X-Missing-Ids.
+
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag коллекции.
     :param skip: Количество пропущенных записей.
     :param limit: Максимальное количество возвращаемых записей.
+    :param pagination: Режим пагинации: 'offset' или 'cursor'.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param sort: Поле сортировки в режиме курсора: 'id' или 'name'.
+    :param attached: True - только привязанные батареи, False - только свободные.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param ids: Идентификаторы батарей через запятую: все найденные объекты
+        одним запросом, без пагинации и фильтров.
+    :param db: Сессия базы данных.
+    :return: Список батарей или страница батарей с курсором следующей страницы.
+    :raises HTTPException: Если курсор или список ids некорректен.
+    """
+    if ids is not None:
+        try:
+            items, missing = get_batteries_by_ids(db=db, ids=parse_ids(ids))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if missing:
+            response.headers['X-Missing-Ids'] = ','.join(map(str, missing))
+        result = conditional(
+            request, response, items, collection_state(items, battery_state)
+        )
+        return fast_json(result, response) if FAST_JSON else result
+    if pagination == 'cursor' or after is not None:
+        try:
+            page = get_batteries_page(
+                db=db, after=after, limit=limit, sort=sort,
+                attached=attached, device_id=device_id, as_dicts=FAST_JSON
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        state = collection_state(page['items'], battery_state, page['next_cursor'])
+        result = conditional(request, response, page, state)
+        return fast_json(result, response) if FAST_JSON else result
+    items = get_batteries(
+        db=db, skip=skip, limit=limit, attached=attached, device_id=device_id,
+        as_dicts=FAST_JSON
+    )
+    result = conditional(
+        request, response, items, collection_state(items, battery_state)
+    )
+    return fast_json(result, response) if FAST_JSON else result
+
+
+@router.get(
+    "/batteries/search",
+    response_model=List[BatteryRead],
+    tags=['batteries']
+)
+def search_batteries_endpoint(
+    q: str = Query(..., min_length=1, max_length=100),
+    skip: int = 0,
+    limit: int = 10,
+    db: Session = Depends(get_db)
+):
+    """
+    Ищет батареи по фрагменту имени.
+
+    :param q: Префикс или подстрока имени.
+    :param skip: Количество пропущенных результатов.
+    :param limit: Максимальное количество возвращаемых результатов.
     :param db: Сессия базы данных.
-    :return: Список батарей.
+    :return: Список батарей: сначала точные совпадения, затем по префиксу,
+             затем по подстроке.
     """
-    return get_batteries(db=db, skip=skip, limit=limit)
+    return search_batteries(db=db, query=q, skip=skip, limit=limit)
 
 
 @router.post(
     "/batteries/",
     response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
     tags=['batteries']
 )
 def create_battery_endpoint(
@@ -80,28 +200,108 @@ def create_battery_endpoint(
     return create_battery(db=db, name=battery.name)
 
 
+@router.post(
+    "/batteries/bulk",
+    response_model=BulkResult,
+    tags=['batteries']
+)
+def bulk_create_batteries_endpoint(
+    batteries: List[BatteryCreate],
+    db: Session = Depends(get_db)
+):
+    """
+    Создает батареи пачкой в одной транзакции.
+
+    :param batteries: Данные для создания батарей.
+    :param db: Сессия базы данных.
+    :return: Созданные батареи и ошибки по элементам (например, занятое имя).
+    """
+    return bulk_create_batteries(db=db, names=[item.name for item in batteries])
+
+
+@router.put(
+    "/batteries/bulk",
+    response_model=BulkResult,
+    tags=['batteries']
+)
+def bulk_update_batteries_endpoint(
+    batteries: List[BulkItem],
+    db: Session = Depends(get_db)
+):
+    """
+    Обновляет батареи пачкой в одной транзакции.
+
+    :param batteries: Идентификаторы и новые имена батарей.
+    :param db: Сессия базы данных.
+    :return: Обновленные батареи и ошибки по элементам.
+    :raises HTTPException: Если пачка конфликтует с параллельным изменением.
+    """
+    try:
+        return bulk_update_batteries(db=db, items=[item.model_dump() for item in batteries])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.delete(
+    "/batteries/bulk",
+    response_model=BulkResult,
+    tags=['batteries']
+)
+def bulk_delete_batteries_endpoint(
+    ids: List[int] = Body(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Удаляет батареи пачкой в одной транзакции.
+
+    :param ids: Идентификаторы удаляемых батарей.
+    :param db: Сессия базы данных.
+    :return: Удаленные батареи и ошибки по элементам.
+    """
+    return bulk_delete_batteries(db=db, ids=ids)
+
+
 @router.put(
     "/batteries/{battery_id}/",
     response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
     tags=['batteries']
 )
 def update_battery_endpoint(
     battery_id: int,
     battery: BatteryUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
     Обновляет информацию о батарее по ее идентификатору.
 
+    Поддерживает условное изменение If-Match: если ETag из заголовка
+    не соответствует текущей версии батареи, изменение не выполняется,
+    и возвращается 412 с текущим представлением и его ETag.
+
     :param battery_id: Идентификатор батареи.
     :param battery: Новые данные для батареи.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param if_match: ETag, полученный клиентом при чтении батареи.
     :param db: Сессия базы данных.
-    :return: Обновленная батарея.
+    :return: Обновленная батарея или ответ 412.
     :raises HTTPException: Если батарея не найдена.
     """
-    db_battery = update_battery(db=db, battery_id=battery_id, name=battery.name)
+    try:
+        db_battery = update_battery(
+            db=db, battery_id=battery_id, name=battery.name,
+            versions=if_match_versions(if_match)
+        )
+    except VersionMismatch as e:
+        return precondition_failed(
+            BatteryRead.model_validate(e.current),
+            make_etag(battery_state(e.current), e.current['version'])
+        )
     if db_battery is None:
         raise HTTPException(status_code=404, detail="Battery not found")
+    response.headers['ETag'] = make_etag(battery_state(db_battery), db_battery['version'])
     return db_battery
 
 
@@ -128,6 +328,156 @@ def delete_battery_endpoint(
     return db_battery
 
 
+@router.post(
+    "/batteries/telemetry",
+    response_model=TelemetryAccepted,
+    status_code=202,
+    openapi_extra=READINGS_BODY,
+    tags=['telemetry']
+)
+async def ingest_telemetry_endpoint(
+    request: Request
+):
+    """
+    Принимает пачку показаний телеметрии батарей.
+
+    Тело запроса - список показаний в JSON. Показания ставятся в очередь
+    и записываются в базу данных пачками в фоне, поэтому ответ 202 не означает,
+    что они уже доступны для чтения. Значения, которые нельзя записать
+    (NaN, бесконечность, числа вне диапазона столбцов), отклоняются с 422.
+    Показания неизвестных батарей и повторы (та же батарея и то же время)
+    при записи отбрасываются.
+
+    :param request: Входящий запрос.
+    :return: Количество принятых показаний и ошибки по отклоненным.
+    :raises HTTPException: Если пачка пуста или слишком велика,
+        либо очередь записи переполнена.
+    :raises RequestValidationError: Если тело запроса некорректно.
+    """
+    try:
+        readings = READINGS.validate_json(await request.body())
+    except ValidationError as e:
+        # NaN и бесконечность из тела не сериализуются в JSON ответа 422.
+        raise RequestValidationError([
+            {
+                **{key: value for key, value in error.items()
+                   if key != 'input' or error['type'] != 'finite_number'},
+                'loc': ('body', *error['loc'])
+            }
+            for error in e.errors(include_url=False)
+        ])
+    if not readings:
+        raise HTTPException(status_code=400, detail="No readings")
+    if len(readings) > TELEMETRY_MAX_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {TELEMETRY_MAX_BATCH} readings per request"
+        )
+    rows, errors = prepare_readings(readings)
+    if rows and not get_buffer().add(rows):
+        raise HTTPException(
+            status_code=503, detail="Telemetry queue is full, retry later",
+            headers={'Retry-After': '1'}
+        )
+    return {'accepted': len(rows), 'errors': errors}
+
+
+@router.get(
+    "/batteries/{battery_id}/telemetry",
+    response_model=Union[List[TelemetryPoint], List[TelemetryRollupPoint]],
+    tags=['telemetry']
+)
+def read_telemetry_endpoint(
+    battery_id: int,
+    response: Response,
+    resolution: Literal['raw', '1m', '1h'] = 'raw',
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """
+    Получает показания батареи за период.
+
+    Без start и end возвращается последний час исходных показаний,
+    последние сутки минутных или последние 30 суток часовых агрегатов.
+
+    :param battery_id: Идентификатор батареи.
+    :param response: Ответ, в который записывается JSON при FAST_JSON.
+    :param resolution: 'raw' - исходные показания, '1m' и '1h' - агрегаты
+        (среднее, минимум и максимум) за минуту или час.
+    :param start: Начало периода (включительно).
+    :param end: Конец периода (не включительно); по умолчанию текущее время.
+    :param limit: Максимальное количество точек.
+    :param db: Сессия базы данных.
+    :return: Список точек по возрастанию времени.
+    :raises HTTPException: Если батарея не найдена или период некорректен.
+    """
+    if get_battery(db=db, battery_id=battery_id) is None:
+        raise HTTPException(status_code=404, detail="Battery not found")
+    end_ms = to_ms(end) if end is not None else int(time.time() * 1000)
+    start_ms = to_ms(start) if start is not None else end_ms - DEFAULT_WINDOWS[resolution]
+    if start_ms >= end_ms:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+    if resolution == 'raw':
+        result = get_readings(db, battery_id, start_ms, end_ms, limit)
+    else:
+        result = get_rollups(db, battery_id, resolution, start_ms, end_ms, limit)
+    return fast_json(result, response) if FAST_JSON else result
+
+
+@router.get(
+    "/devices/tree",
+    response_model=List[DeviceRead],
+    tags=['devices']
+)
+def read_devices_tree(
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Получает все устройства с вложенными списками батарей.
+
+    JSON собирается базой данных одним запросом и отдается клиенту как есть.
+    ETag вычисляется по готовому JSON.
+
+    :param request: Входящий запрос.
+    :param db: Сессия базы данных.
+    :return: Список устройств с привязанными батареями.
+    """
+    content = get_devices_tree(db=db)
+    etag = make_etag(content)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(
+        content=content, media_type="application/json", headers={'ETag': etag}
+    )
+
+
+@router.get(
+    "/devices/search",
+    response_model=List[DeviceRead],
+    tags=['devices']
+)
+def search_devices_endpoint(
+    q: str = Query(..., min_length=1, max_length=100),
+    skip: int = 0,
+    limit: int = 10,
+    db: Session = Depends(get_db)
+):
+    """
+    Ищет устройства по фрагменту имени.
+
+    :param q: Префикс или подстрока имени.
+    :param skip: Количество пропущенных результатов.
+    :param limit: Максимальное количество возвращаемых результатов.
+    :param db: Сессия базы данных.
+    :return: Список устройств с батареями: сначала точные совпадения,
+             затем по префиксу, затем по подстроке.
+    """
+    return search_devices(db=db, query=q, skip=skip, limit=limit)
+
+
 @router.get(
     "/devices/{device_id}/",
     response_model=DeviceRead,
@@ -135,46 +485,138 @@ def delete_battery_endpoint(
 )
 def read_device(
     device_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получает информацию об устройстве по его идентификатору вместе с привязанными батареями.
 
+    Поддерживает условный запрос If-None-Match: при совпадении ETag
+    возвращается 304 без тела ответа. Параметры fields и include ограничивают
+    ответ запрошенными полями: без include=batteries батареи не загружаются.
+
     :param device_id: Идентификатор устройства.
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param fields: Поля устройства через запятую (id возвращается всегда).
+    :param include: Связи через запятую: 'batteries'.
     :param db: Сессия базы данных.
     :return: Информация об устройстве и его батареях.
-    :raises HTTPException: Если устройство не найдено.
+    :raises HTTPException: Если устройство не найдено или поля некорректны.
     """
-    db_device = get_device_with_batteries(db=db, device_id=device_id)
+    try:
+        fieldset = parse_fieldset(fields, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_device = get_device_with_batteries(
+        db=db, device_id=device_id, fieldset=fieldset
+    )
     if db_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
-    return db_device
+    if fieldset is not None:
+        result = conditional(request, response, db_device, fields_state(db_device))
+        return fast_json(result, response)
+    return conditional(
+        request, response, db_device, device_state(db_device), db_device.get('version')
+    )
 
 
 @router.get(
     "/devices/",
-    response_model=List[DeviceRead],
+    response_model=Union[List[DeviceRead], DevicePage],
     tags=['devices']
 )
 def read_devices(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    pagination: Literal['offset', 'cursor'] = 'offset',
+    after: Optional[str] = None,
+    sort: Literal['id', 'name'] = 'id',
+    device_has_free_slots: Optional[bool] = None,
+    ids: Optional[str] = None,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получает список устройств с возможностью пагинации.
 
+    По умолчанию используется пагинация через skip/limit и возвращается список.
+    При pagination=cursor или переданном курсоре after используется
+    keyset-пагинация: возвращается страница с полем next_cursor.
+    С параметром ids возвращаются найденные объекты в порядке ids,
+    отсутствующие идентификаторы перечисляются в заголовке X-Missing-Ids.
+    Параметры fields и include ограничивают устройства запрошенными полями:
+    выбираются только нужные колонки, батареи загружаются только
+    при include=batteries.
+
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag коллекции.
     :param skip: Количество пропущенных записей.
     :param limit: Максимальное количество возвращаемых записей.
+    :param pagination: Режим пагинации: 'offset' или 'cursor'.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param sort: Поле сортировки в режиме курсора: 'id' или 'name'.
+    :param device_has_free_slots: True - только устройства со свободными местами
+        для батарей, False - только заполненные.
+    :param ids: Идентификаторы устройств через запятую: все найденные объекты
+        одним запросом, без пагинации и фильтров.
+    :param fields: Поля устройства через запятую (id возвращается всегда).
+    :param include: Связи через запятую: 'batteries'.
     :param db: Сессия базы данных.
-    :return: Список устройств.
+    :return: Список устройств или страница устройств с курсором следующей страницы.
+    :raises HTTPException: Если курсор, список ids или поля некорректны.
     """
-    return get_devices(db=db, skip=skip, limit=limit)
+    try:
+        fieldset = parse_fieldset(fields, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    item_state = device_state if fieldset is None else fields_state
+    as_dicts = FAST_JSON or fieldset is not None
+    if ids is not None:
+        try:
+            items, missing = get_devices_by_ids(db=db, ids=parse_ids(ids))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if fieldset is not None:
+            items = [select_fields(item, fieldset) for item in items]
+        if missing:
+            response.headers['X-Missing-Ids'] = ','.join(map(str, missing))
+        result = conditional(
+            request, response, items, collection_state(items, item_state)
+        )
+        return fast_json(result, response) if as_dicts else result
+    if pagination == 'cursor' or after is not None:
+        try:
+            page = get_devices_page(
+                db=db, after=after, limit=limit, sort=sort,
+                has_free_slots=device_has_free_slots, as_dicts=FAST_JSON,
+                fieldset=fieldset
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        state = collection_state(page['items'], item_state, page['next_cursor'])
+        result = conditional(request, response, page, state)
+        return fast_json(result, response) if as_dicts else result
+    items = get_devices(
+        db=db, skip=skip, limit=limit, has_free_slots=device_has_free_slots,
+        as_dicts=FAST_JSON, fieldset=fieldset
+    )
+    result = conditional(
+        request, response, items, collection_state(items, item_state)
+    )
+    return fast_json(result, response) if as_dicts else result
 
 
 @router.post(
     "/devices/",
     response_model=DeviceRead,
+    openapi_extra=IDEMPOTENT,
     tags=['devices']
 )
 def create_device_endpoint(
@@ -194,6 +636,7 @@ def create_device_endpoint(
 @router.post(
     "/devices/{device_id}/batteries/{battery_id}/attach",
     response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
     tags=['devices']
 )
 def attach_battery_to_device_endpoint(
@@ -208,40 +651,122 @@ def attach_battery_to_device_endpoint(
     :param battery_id: Идентификатор батареи.
     :param db: Сессия базы данных.
     :return: Обновленная батарея.
-    :raises HTTPException: Если батарея или устройство не найдены,
-    или если батарея уже привязана к другому устройству.
+    :raises HTTPException: 404, если батарея или устройство не найдены;
+    409, если батарея уже привязана или на устройстве нет свободных мест.
     """
     try:
         battery = attach_battery_to_device(
             db=db, battery_id=battery_id, device_id=device_id
         )
         return battery
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post(
+    "/devices/bulk",
+    response_model=BulkResult,
+    tags=['devices']
+)
+def bulk_create_devices_endpoint(
+    devices: List[DeviceCreate],
+    db: Session = Depends(get_db)
+):
+    """
+    Создает устройства пачкой в одной транзакции.
+
+    :param devices: Данные для создания устройств.
+    :param db: Сессия базы данных.
+    :return: Созданные устройства и ошибки по элементам (например, занятое имя).
+    """
+    return bulk_create_devices(db=db, names=[item.name for item in devices])
+
+
+@router.put(
+    "/devices/bulk",
+    response_model=BulkResult,
+    tags=['devices']
+)
+def bulk_update_devices_endpoint(
+    devices: List[BulkItem],
+    db: Session = Depends(get_db)
+):
+    """
+    Обновляет устройства пачкой в одной транзакции.
+
+    :param devices: Идентификаторы и новые имена устройств.
+    :param db: Сессия базы данных.
+    :return: Обновленные устройства и ошибки по элементам.
+    :raises HTTPException: Если пачка конфликтует с параллельным изменением.
+    """
+    try:
+        return bulk_update_devices(db=db, items=[item.model_dump() for item in devices])
     except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.delete(
+    "/devices/bulk",
+    response_model=BulkResult,
+    tags=['devices']
+)
+def bulk_delete_devices_endpoint(
+    ids: List[int] = Body(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Удаляет устройства пачкой в одной транзакции.
+
+    :param ids: Идентификаторы удаляемых устройств.
+    :param db: Сессия базы данных.
+    :return: Удаленные устройства и ошибки по элементам.
+    """
+    return bulk_delete_devices(db=db, ids=ids)
 
 
 @router.put(
     "/devices/{device_id}/",
     response_model=DeviceRead,
+    openapi_extra=IDEMPOTENT,
     tags=['devices']
 )
 def update_device_endpoint(
     device_id: int,
     device: DeviceUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
     Обновляет информацию об устройстве по его идентификатору.
 
+    Поддерживает условное изменение If-Match: если ETag из заголовка
+    не соответствует текущей версии устройства, изменение не выполняется,
+    и возвращается 412 с текущим представлением и его ETag.
+
     :param device_id: Идентификатор устройства.
     :param device: Новые данные для устройства.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param if_match: ETag, полученный клиентом при чтении устройства.
     :param db: Сессия базы данных.
-    :return: Обновленное устройство.
+    :return: Обновленное устройство или ответ 412.
     :raises HTTPException: Если устройство не найдено.
     """
-    db_device = update_device(db=db, device_id=device_id, name=device.name)
+    try:
+        db_device = update_device(
+            db=db, device_id=device_id, name=device.name,
+            versions=if_match_versions(if_match)
+        )
+    except VersionMismatch as e:
+        return precondition_failed(
+            DeviceRead.model_validate(e.current),
+            make_etag(device_state(e.current), e.current['version'])
+        )
     if db_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
+    response.headers['ETag'] = make_etag(device_state(db_device), db_device['version'])
     return db_device
 
 
@@ -266,3 +791,145 @@ def delete_device_endpoint(
     if db_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     return db_device
+
+
+@router.get(
+    "/export/devices",
+    response_class=StreamingResponse,
+    tags=['export']
+)
+def export_devices_endpoint(
+    format: Literal['ndjson', 'csv'] = 'ndjson'
+):
+    """
+    Потоково выгружает все устройства с идентификаторами их батарей.
+
+    :param format: Формат выгрузки: 'ndjson' или 'csv'.
+    :return: Потоковый ответ с выгрузкой.
+    """
+    return StreamingResponse(
+        stream_devices(format), media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="devices.{format}"'}
+    )
+
+
+@router.get(
+    "/export/batteries",
+    response_class=StreamingResponse,
+    tags=['export']
+)
+def export_batteries_endpoint(
+    format: Literal['ndjson', 'csv'] = 'ndjson'
+):
+    """
+    Потоково выгружает все батареи.
+
+    :param format: Формат выгрузки: 'ndjson' или 'csv'.
+    :return: Потоковый ответ с выгрузкой.
+    """
+    return StreamingResponse(
+        stream_batteries(format), media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="batteries.{format}"'}
+    )
+
+
+@router.post(
+    "/import",
+    response_model=ImportResult,
+    tags=['import']
+)
+def import_endpoint(
+    file: UploadFile = File(...),
+    format: Literal['ndjson', 'csv'] = 'ndjson',
+    db: Session = Depends(get_db)
+):
+    """
+    Импортирует устройства и привязанные к ним батареи из файла.
+
+    Каждая строка файла - имя устройства и, необязательно, имя новой батареи,
+    привязываемой к нему: колонки device и battery в CSV или объект
+    {"device": ..., "battery": ...} в NDJSON. Строки с занятыми или
+    повторяющимися именами батарей и сверх лимита батарей на устройство
+    отклоняются, остальные импортируются в одной транзакции.
+
+    :param file: Загружаемый файл в UTF-8.
+    :param format: Формат файла: 'ndjson' или 'csv'.
+    :param db: Сессия базы данных.
+    :return: Количество созданных устройств и батарей и ошибки по строкам файла.
+    :raises HTTPException: Если файл не удается прочитать или импорт
+        конфликтует с параллельным изменением.
+    """
+    try:
+        return import_file(db, file.file, format)
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get(
+    "/changes",
+    response_class=StreamingResponse,
+    tags=['changes']
+)
+async def changes_endpoint(
+    entity: Optional[Literal['device', 'battery']] = None,
+    device_id: Optional[int] = None,
+    after: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Поток событий изменения устройств и батарей (Server-Sent Events).
+
+    Каждое событие change содержит идентификатор, сущность, действие
+    (created, updated, deleted, attached) и данные объекта. Клиент,
+    переподключившийся с заголовком Last-Event-ID или параметром after,
+    получает только пропущенные события; если они уже вытеснены из буфера,
+    приходит событие reset, и данные нужно загрузить заново.
+
+    :param entity: Только события устройств ('device') или батарей ('battery').
+    :param device_id: Только события устройства и привязанных к нему батарей.
+    :param after: Идентификатор последнего полученного события.
+    :param last_event_id: Заголовок Last-Event-ID, отправляемый EventSource при переподключении.
+    :return: Потоковый ответ text/event-stream.
+    """
+    return StreamingResponse(
+        stream_changes(entity, device_id, after or last_event_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@router.get(
+    "/stats/fleet",
+    response_model=FleetStats,
+    tags=['stats']
+)
+def fleet_stats_endpoint(
+    db: Session = Depends(get_db)
+):
+    """
+    Получает статистику парка: количество устройств, батарей, свободных
+    батарей и устройств по количеству привязанных батарей.
+
+    Значения читаются из счетчиков, которые функции записи обновляют
+    в своих транзакциях, поэтому время ответа не зависит от размера парка.
+
+    :param db: Сессия базы данных.
+    :return: Статистика парка.
+    """
+    return get_fleet_stats(db)
+
+
+@router.get(
+    "/cache/stats",
+    response_model=CacheStats,
+    tags=['cache']
+)
+def read_cache_stats():
+    """
+    Получает счетчики кеша чтения устройств и батарей.
+
+    :return: Счетчики попаданий, промахов и вытеснений.
+    """
+    return get_cache().stats()
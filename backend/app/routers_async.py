@@ -0,0 +1,502 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional, Union
+
+from app.crud_async import (
+    get_battery, get_batteries, get_batteries_page, create_battery,
+    update_battery, delete_battery,
+    get_devices, get_devices_page, create_device, attach_battery_to_device,
+    update_device, delete_device, get_device_with_batteries,
+    get_devices_tree, get_batteries_by_ids, get_devices_by_ids
+)
+from app.crud import parse_fieldset, parse_ids, select_fields
+from app.database import get_async_db
+from app.etag import (
+    battery_state, collection_state, conditional, device_state,
+    etag_matches, fields_state, if_match_versions, make_etag, precondition_failed
+)
+from app.exceptions import ConflictError, NotFoundError, VersionMismatch
+from app.fastjson import fast_json
+from app.idempotency import IDEMPOTENT
+from app.schemas import (
+    BatteryCreate, BatteryUpdate, BatteryRead, BatteryPage,
+    DeviceCreate, DeviceUpdate, DeviceRead, DevicePage
+)
+from config import FAST_JSON
+
+router = APIRouter()
+
+
+@router.get(
+    "/batteries/{battery_id}/",
+    response_model=BatteryRead,
+    tags=['batteries']
+)
+async def read_battery(
+    battery_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получает информацию о батарее по ее идентификатору.
+
+    Поддерживает условный запрос If-None-Match: при совпадении ETag
+    возвращается 304 без тела ответа.
+
+    :param battery_id: Идентификатор батареи.
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param db: Асинхронная сессия базы данных.
+    :return: Информация о батарее.
+    :raises HTTPException: Если батарея не найдена.
+    """
+    db_battery = await get_battery(db=db, battery_id=battery_id)
+    if db_battery is None:
+        raise HTTPException(status_code=404, detail="Battery not found")
+    return conditional(
+        request, response, db_battery, battery_state(db_battery), db_battery.get('version')
+    )
+
+
+@router.get(
+    "/batteries/",
+    response_model=Union[List[BatteryRead], BatteryPage],
+    tags=['batteries']
+)
+async def read_batteries(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    pagination: Literal['offset', 'cursor'] = 'offset',
+    after: Optional[str] = None,
+    sort: Literal['id', 'name'] = 'id',
+    attached: Optional[bool] = None,
+    device_id: Optional[int] = None,
+    ids: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получает список батарей с возможностью пагинации.
+
+    По умолчанию используется пагинация через skip/limit и возвращается список.
+    При pagination=cursor или переданном курсоре after используется
+    keyset-пагинация: возвращается страница с полем next_cursor.
+    С параметром ids возвращаются найденные объекты в порядке ids,
+    отсутствующие идентификаторы перечисляются в заголовке X-Missing-Ids.
+
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag коллекции.
+    :param skip: Количество пропущенных записей.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param pagination: Режим пагинации: 'offset' или 'cursor'.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param sort: Поле сортировки в режиме курсора: 'id' или 'name'.
+    :param attached: True - только привязанные батареи, False - только свободные.
+    :param device_id: Идентификатор устройства, к которому привязаны батареи.
+    :param ids: Идентификаторы батарей через запятую: все найденные объекты
+        одним запросом, без пагинации и фильтров.
+    :param db: Асинхронная сессия базы данных.
+    :return: Список батарей или страница батарей с курсором следующей страницы.
+    :raises HTTPException: Если курсор или список ids некорректен.
+    """
+    if ids is not None:
+        try:
+            items, missing = await get_batteries_by_ids(db=db, ids=parse_ids(ids))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if missing:
+            response.headers['X-Missing-Ids'] = ','.join(map(str, missing))
+        result = conditional(
+            request, response, items, collection_state(items, battery_state)
+        )
+        return fast_json(result, response) if FAST_JSON else result
+    if pagination == 'cursor' or after is not None:
+        try:
+            page = await get_batteries_page(
+                db=db, after=after, limit=limit, sort=sort,
+                attached=attached, device_id=device_id, as_dicts=FAST_JSON
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        state = collection_state(page['items'], battery_state, page['next_cursor'])
+        result = conditional(request, response, page, state)
+        return fast_json(result, response) if FAST_JSON else result
+    items = await get_batteries(
+        db=db, skip=skip, limit=limit, attached=attached, device_id=device_id,
+        as_dicts=FAST_JSON
+    )
+    result = conditional(
+        request, response, items, collection_state(items, battery_state)
+    )
+    return fast_json(result, response) if FAST_JSON else result
+
+
+@router.post(
+    "/batteries/",
+    response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
+    tags=['batteries']
+)
+async def create_battery_endpoint(
+    battery: BatteryCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Создает новую батарею.
+
+    :param battery: Данные для создания батареи.
+    :param db: Асинхронная сессия базы данных.
+    :return: Созданная батарея.
+    """
+    return await create_battery(db=db, name=battery.name)
+
+
+@router.put(
+    "/batteries/{battery_id}/",
+    response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
+    tags=['batteries']
+)
+async def update_battery_endpoint(
+    battery_id: int,
+    battery: BatteryUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Обновляет информацию о батарее по ее идентификатору.
+
+    Поддерживает условное изменение If-Match: если ETag из заголовка
+    не соответствует текущей версии батареи, изменение не выполняется,
+    и возвращается 412 с текущим представлением и его ETag.
+
+    :param battery_id: Идентификатор батареи.
+    :param battery: Новые данные для батареи.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param if_match: ETag, полученный клиентом при чтении батареи.
+    :param db: Асинхронная сессия базы данных.
+    :return: Обновленная батарея или ответ 412.
+    :raises HTTPException: Если батарея не найдена.
+    """
+    try:
+        db_battery = await update_battery(
+            db=db, battery_id=battery_id, name=battery.name,
+            versions=if_match_versions(if_match)
+        )
+    except VersionMismatch as e:
+        return precondition_failed(
+            BatteryRead.model_validate(e.current),
+            make_etag(battery_state(e.current), e.current['version'])
+        )
+    if db_battery is None:
+        raise HTTPException(status_code=404, detail="Battery not found")
+    response.headers['ETag'] = make_etag(battery_state(db_battery), db_battery['version'])
+    return db_battery
+
+
+@router.delete(
+    "/batteries/{battery_id}/",
+    response_model=BatteryRead,
+    tags=['batteries']
+)
+async def delete_battery_endpoint(
+    battery_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Удаляет батарею по ее идентификатору.
+
+    :param battery_id: Идентификатор батареи.
+    :param db: Асинхронная сессия базы данных.
+    :return: Удаленная батарея.
+    :raises HTTPException: Если батарея не найдена.
+    """
+    db_battery = await delete_battery(db=db, battery_id=battery_id)
+    if db_battery is None:
+        raise HTTPException(status_code=404, detail="Battery not found")
+    return db_battery
+
+
+@router.get(
+    "/devices/tree",
+    response_model=List[DeviceRead],
+    tags=['devices']
+)
+async def read_devices_tree(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получает все устройства с вложенными списками батарей.
+
+    JSON собирается базой данных одним запросом и отдается клиенту как есть.
+    ETag вычисляется по готовому JSON.
+
+    :param request: Входящий запрос.
+    :param db: Асинхронная сессия базы данных.
+    :return: Список устройств с привязанными батареями.
+    """
+    content = await get_devices_tree(db=db)
+    etag = make_etag(content)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(
+        content=content, media_type="application/json", headers={'ETag': etag}
+    )
+
+
+@router.get(
+    "/devices/{device_id}/",
+    response_model=DeviceRead,
+    tags=['devices']
+)
+async def read_device(
+    device_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получает информацию об устройстве по его идентификатору вместе с привязанными батареями.
+
+    Поддерживает условный запрос If-None-Match: при совпадении ETag
+    возвращается 304 без тела ответа. Параметры fields и include ограничивают
+    ответ запрошенными полями: без include=batteries батареи не загружаются.
+
+    :param device_id: Идентификатор устройства.
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param fields: Поля устройства через запятую (id возвращается всегда).
+    :param include: Связи через запятую: 'batteries'.
+    :param db: Асинхронная сессия базы данных.
+    :return: Информация об устройстве и его батареях.
+    :raises HTTPException: Если устройство не найдено или поля некорректны.
+    """
+    try:
+        fieldset = parse_fieldset(fields, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_device = await get_device_with_batteries(
+        db=db, device_id=device_id, fieldset=fieldset
+    )
+    if db_device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    if fieldset is not None:
+        result = conditional(request, response, db_device, fields_state(db_device))
+        return fast_json(result, response)
+    return conditional(
+        request, response, db_device, device_state(db_device), db_device.get('version')
+    )
+
+
+@router.get(
+    "/devices/",
+    response_model=Union[List[DeviceRead], DevicePage],
+    tags=['devices']
+)
+async def read_devices(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    pagination: Literal['offset', 'cursor'] = 'offset',
+    after: Optional[str] = None,
+    sort: Literal['id', 'name'] = 'id',
+    device_has_free_slots: Optional[bool] = None,
+    ids: Optional[str] = None,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получает список устройств с возможностью пагинации.
+
+    По умолчанию используется пагинация через skip/limit и возвращается список.
+    При pagination=cursor или переданном курсоре after используется
+    keyset-пагинация: возвращается страница с полем next_cursor.
+    С параметром ids возвращаются найденные объекты в порядке ids,
+    отсутствующие идентификаторы перечисляются в заголовке X-Missing-Ids.
+    Параметры fields и include ограничивают устройства запрошенными полями:
+    выбираются только нужные колонки, батареи загружаются только
+    при include=batteries.
+
+    :param request: Входящий запрос.
+    :param response: Ответ, в который добавляется заголовок ETag коллекции.
+    :param skip: Количество пропущенных записей.
+    :param limit: Максимальное количество возвращаемых записей.
+    :param pagination: Режим пагинации: 'offset' или 'cursor'.
+    :param after: Курсор последней записи предыдущей страницы.
+    :param sort: Поле сортировки в режиме курсора: 'id' или 'name'.
+    :param device_has_free_slots: True - только устройства со свободными местами
+        для батарей, False - только заполненные.
+    :param ids: Идентификаторы устройств через запятую: все найденные объекты
+        одним запросом, без пагинации и фильтров.
+    :param fields: Поля устройства через запятую (id возвращается всегда).
+    :param include: Связи через запятую: 'batteries'.
+    :param db: Асинхронная сессия базы данных.
+    :return: Список устройств или страница устройств с курсором следующей страницы.
+    :raises HTTPException: Если курсор, список ids или поля некорректны.
+    """
+    try:
+        fieldset = parse_fieldset(fields, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    item_state = device_state if fieldset is None else fields_state
+    as_dicts = FAST_JSON or fieldset is not None
+    if ids is not None:
+        try:
+            items, missing = await get_devices_by_ids(db=db, ids=parse_ids(ids))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if fieldset is not None:
+            items = [select_fields(item, fieldset) for item in items]
+        if missing:
+            response.headers['X-Missing-Ids'] = ','.join(map(str, missing))
+        result = conditional(
+            request, response, items, collection_state(items, item_state)
+        )
+        return fast_json(result, response) if as_dicts else result
+    if pagination == 'cursor' or after is not None:
+        try:
+            page = await get_devices_page(
+                db=db, after=after, limit=limit, sort=sort,
+                has_free_slots=device_has_free_slots, as_dicts=FAST_JSON,
+                fieldset=fieldset
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        state = collection_state(page['items'], item_state, page['next_cursor'])
+        result = conditional(request, response, page, state)
+        return fast_json(result, response) if as_dicts else result
+    items = await get_devices(
+        db=db, skip=skip, limit=limit, has_free_slots=device_has_free_slots,
+        as_dicts=FAST_JSON, fieldset=fieldset
+    )
+    result = conditional(
+        request, response, items, collection_state(items, item_state)
+    )
+    return fast_json(result, response) if as_dicts else result
+
+
+@router.post(
+    "/devices/",
+    response_model=DeviceRead,
+    openapi_extra=IDEMPOTENT,
+    tags=['devices']
+)
+async def create_device_endpoint(
+    device: DeviceCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Создает новое устройство.
+
+    :param device: Данные для создания устройства.
+    :param db: Асинхронная сессия базы данных.
+    :return: Созданное устройство.
+    """
+    return await create_device(db=db, name=device.name)
+
+
+@router.post(
+    "/devices/{device_id}/batteries/{battery_id}/attach",
+    response_model=BatteryRead,
+    openapi_extra=IDEMPOTENT,
+    tags=['devices']
+)
+async def attach_battery_to_device_endpoint(
+    device_id: int,
+    battery_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Присоединяет батарею к устройству.
+
+    :param device_id: Идентификатор устройства.
+    :param battery_id: Идентификатор батареи.
+    :param db: Асинхронная сессия базы данных.
+    :return: Обновленная батарея.
+    :raises HTTPException: 404, если батарея или устройство не найдены;
+    409, если батарея уже привязана или на устройстве нет свободных мест.
+    """
+    try:
+        battery = await attach_battery_to_device(
+            db=db, battery_id=battery_id, device_id=device_id
+        )
+        return battery
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.put(
+    "/devices/{device_id}/",
+    response_model=DeviceRead,
+    openapi_extra=IDEMPOTENT,
+    tags=['devices']
+)
+async def update_device_endpoint(
+    device_id: int,
+    device: DeviceUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Обновляет информацию об устройстве по его идентификатору.
+
+    Поддерживает условное изменение If-Match: если ETag из заголовка
+    не соответствует текущей версии устройства, изменение не выполняется,
+    и возвращается 412 с текущим представлением и его ETag.
+
+    :param device_id: Идентификатор устройства.
+    :param device: Новые данные для устройства.
+    :param response: Ответ, в который добавляется заголовок ETag.
+    :param if_match: ETag, полученный клиентом при чтении устройства.
+    :param db: Асинхронная сессия базы данных.
+    :return: Обновленное устройство или ответ 412.
+    :raises HTTPException: Если устройство не найдено.
+    """
+    try:
+        db_device = await update_device(
+            db=db, device_id=device_id, name=device.name,
+            versions=if_match_versions(if_match)
+        )
+    except VersionMismatch as e:
+        return precondition_failed(
+            DeviceRead.model_validate(e.current),
+            make_etag(device_state(e.current), e.current['version'])
+        )
+    if db_device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    response.headers['ETag'] = make_etag(device_state(db_device), db_device['version'])
+    return db_device
+
+
+@router.delete(
+    "/devices/{device_id}/",
+    response_model=DeviceRead,
+    tags=['devices']
+)
+async def delete_device_endpoint(
+    device_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Удаляет устройство по его идентификатору.
+
+    :param device_id: Идентификатор устройства.
+    :param db: Асинхронная сессия базы данных.
+    :return: Удаленное устройство.
+    :raises HTTPException: Если устройство не найдено.
+    """
+    db_device = await delete_device(db=db, device_id=device_id)
+    if db_device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return db_device
@@ -1,6 +1,11 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+# Границы столбцов показаний телеметрии: integer и real в PostgreSQL.
+INT32_MAX = 2 ** 31 - 1
+REAL_MAX = 3.4e38
 
 
 class BatteryAttach(BaseModel):
@@ -51,6 +56,17 @@ class BatteryRead(BatteryBase):
         orm_mode = True
 
 
+class BatteryPage(BaseModel):
+    """
+    Схема страницы батарей при пагинации по курсору.
+
+    :param items: Список батарей на странице.
+    :param next_cursor: Курсор следующей страницы или None, если страница последняя.
+    """
+    items: List[BatteryRead]
+    next_cursor: Optional[str] = None
+
+
 class DeviceBase(BaseModel):
     """
     Базовая схема для устройств.
@@ -90,3 +106,198 @@ class DeviceRead(DeviceBase):
 
     class Config:
         orm_mode = True
+
+
+class DevicePage(BaseModel):
+    """
+    Схема страницы устройств при пагинации по курсору.
+
+    :param items: Список устройств на странице.
+    :param next_cursor: Курсор следующей страницы или None, если страница последняя.
+    """
+    items: List[DeviceRead]
+    next_cursor: Optional[str] = None
+
+
+class BulkItem(BaseModel):
+    """
+    Схема элемента пакетной операции над устройствами или батареями.
+
+    :param id: Идентификатор объекта.
+    :param name: Имя объекта.
+    """
+    id: int
+    name: str
+
+
+class BulkError(BaseModel):
+    """
+    Схема ошибки отдельного элемента пакетной операции.
+
+    :param index: Позиция элемента в теле запроса.
+    :param detail: Описание ошибки.
+    """
+    index: int
+    detail: str
+
+
+class BulkResult(BaseModel):
+    """
+    Схема результата пакетной операции.
+
+    :param items: Успешно обработанные объекты.
+    :param errors: Ошибки по элементам, которые не удалось обработать.
+    """
+    items: List[BulkItem]
+    errors: List[BulkError] = []
+
+
+class CacheStats(BaseModel):
+    """
+    Схема счетчиков кеша чтения.
+
+    :param backend: Имя класса бэкенда кеша.
+    :param size: Текущее количество записей.
+    :param max_size: Максимальное количество записей.
+    :param hits: Количество попаданий.
+    :param misses: Количество промахов.
+    :param evictions: Количество вытесненных и устаревших записей.
+    """
+    backend: str
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class FleetBucket(BaseModel):
+    """
+    Схема количества устройств с заданным количеством батарей.
+
+    :param battery_count: Количество привязанных батарей.
+    :param devices: Количество устройств.
+    """
+    battery_count: int
+    devices: int
+
+
+class FleetStats(BaseModel):
+    """
+    Схема статистики парка устройств и батарей.
+
+    :param devices: Количество устройств.
+    :param batteries: Количество батарей.
+    :param attached_batteries: Количество батарей, привязанных к устройствам.
+    :param unattached_batteries: Количество свободных батарей.
+    :param devices_by_battery_count: Количество устройств по количеству батарей.
+    """
+    devices: int
+    batteries: int
+    attached_batteries: int
+    unattached_batteries: int
+    devices_by_battery_count: List[FleetBucket]
+
+
+class ImportRowError(BaseModel):
+    """
+    Схема ошибки строки импортируемого файла.
+
+    :param line: Номер строки файла (у CSV заголовок - строка 1).
+    :param detail: Описание ошибки.
+    """
+    line: int
+    detail: str
+
+
+class ImportResult(BaseModel):
+    """
+    Схема результата импорта устройств и батарей.
+
+    :param rows: Количество прочитанных строк файла.
+    :param devices_created: Количество созданных устройств.
+    :param batteries_created: Количество созданных и привязанных батарей.
+    :param error_count: Количество отклоненных строк.
+    :param errors: Ошибки по строкам (не больше IMPORT_MAX_ERRORS первых).
+    """
+    rows: int
+    devices_created: int
+    batteries_created: int
+    error_count: int
+    errors: List[ImportRowError] = []
+
+
+class TelemetryReading(BaseModel):
+    """
+    Схема показания телеметрии батареи.
+
+    Значения, которые нельзя записать в базу данных (NaN, бесконечность,
+    числа вне диапазона столбцов), отклоняются при приеме: иначе пачка
+    с ними не записалась бы уже после ответа 202.
+
+    :param battery_id: Идентификатор батареи.
+    :param ts: Время показания (без часового пояса считается UTC).
+    :param voltage: Напряжение, В.
+    :param soc: Уровень заряда, % от 0 до 100.
+    :param temperature: Температура, °C.
+    """
+    battery_id: int = Field(gt=0, le=INT32_MAX)
+    ts: datetime
+    voltage: float = Field(allow_inf_nan=False, ge=-REAL_MAX, le=REAL_MAX)
+    soc: float = Field(allow_inf_nan=False, ge=0, le=100)
+    temperature: float = Field(allow_inf_nan=False, ge=-REAL_MAX, le=REAL_MAX)
+
+
+class TelemetryAccepted(BaseModel):
+    """
+    Схема результата приема пачки показаний.
+
+    :param accepted: Количество показаний, поставленных в очередь записи.
+    :param errors: Отклоненные показания (например, со временем вне допустимого окна).
+    """
+    accepted: int
+    errors: List[BulkError] = []
+
+
+class TelemetryPoint(BaseModel):
+    """
+    Схема исходного показания батареи в ответе.
+
+    :param ts: Время показания.
+    :param voltage: Напряжение, В.
+    :param soc: Уровень заряда, %.
+    :param temperature: Температура, °C.
+    """
+    ts: datetime
+    voltage: float
+    soc: float
+    temperature: float
+
+
+class TelemetryRollupPoint(BaseModel):
+    """
+    Схема агрегата показаний батареи за интервал.
+
+    :param ts: Начало интервала.
+    :param count: Количество показаний за интервал.
+    :param voltage_avg: Среднее напряжение, В.
+    :param voltage_min: Минимальное напряжение, В.
+    :param voltage_max: Максимальное напряжение, В.
+    :param soc_avg: Средний уровень заряда, %.
+    :param soc_min: Минимальный уровень заряда, %.
+    :param soc_max: Максимальный уровень заряда, %.
+    :param temperature_avg: Средняя температура, °C.
+    :param temperature_min: Минимальная температура, °C.
+    :param temperature_max: Максимальная температура, °C.
+    """
+    ts: datetime
+    count: int
+    voltage_avg: float
+    voltage_min: float
+    voltage_max: float
+    soc_avg: float
+    soc_min: float
+    soc_max: float
+    temperature_avg: float
+    temperature_min: float
+    temperature_max: float
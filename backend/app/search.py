@@ -0,0 +1,185 @@
+import heapq
+import threading
+from array import array
+
+# Длина n-граммы индекса; совпадает с триграммами pg_trgm.
+NGRAM = 3
+
+# Сколько самых коротких списков n-грамм пересекается при поиске;
+# остальные условия проверяются сравнением с именем.
+INTERSECT_POSTINGS = 3
+
+
+def rank_key(name: str, query: str):
+    """
+    Вычисляет ключ ранжирования результата поиска по имени.
+
+    Сначала идут точные совпадения, затем совпадения по префиксу, затем
+    по подстроке; внутри группы - более короткие (более похожие) имена.
+
+    :param name: Имя найденного объекта.
+    :param query: Строка поиска в нижнем регистре.
+    :return: Кортеж для сортировки по возрастанию.
+    """
+    lowered = name.lower()
+    if lowered == query:
+        group = 0
+    elif lowered.startswith(query):
+        group = 1
+    else:
+        group = 2
+    return group, len(name), name
+
+
+def ngrams(text: str):
+    """
+    Разбивает строку на n-граммы без учета регистра.
+
+    :param text: Исходная строка.
+    :return: Множество n-грамм.
+    """
+    lowered = text.lower()
+    return {lowered[i:i + NGRAM] for i in range(len(lowered) - NGRAM + 1)}
+
+
+class NameIndex:
+    """
+    N-граммный индекс имен одной таблицы в памяти процесса.
+
+    Используется вместо триграммного индекса PostgreSQL на SQLite. Индекс
+    загружается из базы данных при первом поиске и затем поддерживается
+    функциями crud, изменяющими имена. Списки идентификаторов по n-граммам
+    только дополняются; удаленные и переименованные записи отсеиваются
+    проверкой имени и вычищаются, когда устаревших записей становится
+    больше, чем живых.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._postings = {}
+        self._stale = 0
+
+    @property
+    def loaded(self):
+        return self._names is not None
+
+    def ensure_loaded(self, load_rows):
+        """
+        Загружает индекс, если он еще не загружен.
+
+        Загрузка выполняется под блокировкой, поэтому изменения,
+        зафиксированные параллельно, не теряются.
+
+        :param load_rows: Функция, возвращающая пары (id, name) из базы данных.
+        """
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            self._names = {}
+            self._postings = {}
+            self._stale = 0
+            self._add(load_rows())
+
+    def add(self, rows):
+        """
+        Добавляет или переименовывает записи в индексе.
+
+        :param rows: Пары (id, name).
+        """
+        with self._lock:
+            if self.loaded:
+                self._add(rows)
+
+    def remove(self, ids):
+        """
+        Удаляет записи из индекса.
+
+        :param ids: Идентификаторы удаленных записей.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            for object_id in ids:
+                if self._names.pop(object_id, None) is not None:
+                    self._stale += 1
+            self._compact()
+
+    def reset(self):
+        """
+        Сбрасывает индекс; он будет заново загружен при следующем поиске.
+
+        Используется, когда набор измененных записей неизвестен
+        (например, при каскадном удалении).
+        """
+        with self._lock:
+            self._names = None
+            self._postings = {}
+            self._stale = 0
+
+    def search(self, query: str, skip: int = 0, limit: int = 10):
+        """
+        Ищет записи, имя которых содержит строку, и ранжирует их.
+
+        Кандидаты получаются пересечением самых коротких списков среди
+        n-грамм строки поиска; строки короче n-граммы проверяются полным
+        перебором имен.
+
+        :param query: Строка поиска.
+        :param skip: Количество пропущенных результатов.
+        :param limit: Максимальное количество результатов.
+        :return: Идентификаторы найденных записей в порядке ранжирования.
+        """
+        query = query.lower()
+        with self._lock:
+            names = self._names
+            if len(query) < NGRAM:
+                candidates = names.keys()
+            else:
+                postings = [self._postings.get(gram) for gram in ngrams(query)]
+                if not all(postings):
+                    return []
+                postings.sort(key=len)
+                candidates = set(postings[0])
+                for posting in postings[1:INTERSECT_POSTINGS]:
+                    candidates.intersection_update(posting)
+            matches = [
+                (rank_key(names[object_id], query), object_id)
+                for object_id in candidates
+                if object_id in names and query in names[object_id].lower()
+            ]
+        best = heapq.nsmallest(skip + limit, matches)
+        return [object_id for _, object_id in best[skip:]]
+
+    def _add(self, rows):
+        for object_id, name in rows:
+            if object_id in self._names:
+                self._stale += 1
+            self._names[object_id] = name
+            for gram in ngrams(name):
+                self._postings.setdefault(gram, array('i')).append(object_id)
+        self._compact()
+
+    def _compact(self):
+        if self._stale <= len(self._names):
+            return
+        self._postings = {}
+        self._stale = 0
+        for object_id, name in self._names.items():
+            for gram in ngrams(name):
+                self._postings.setdefault(gram, array('i')).append(object_id)
+
+
+_indexes = {'devices': NameIndex(), 'batteries': NameIndex()}
+
+
+def name_index(table: str):
+    """
+    Возвращает индекс имен таблицы.
+
+    :param table: Имя таблицы: 'devices' или 'batteries'.
+    :return: Экземпляр NameIndex.
+    """
+    return _indexes[table]
@@ -0,0 +1,154 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from sqlalchemy import event
+
+from app.metrics import SQL_LOG_DROPPED, current_route
+from config import SQL_LOG_QUEUE_SIZE, SQL_LOG_SAMPLE_RATE, SQL_LOG_SLOW_MS
+
+# Максимальная длина параметров запроса в записи журнала.
+MAX_PARAMETERS_LENGTH = 4096
+
+logger = logging.getLogger('app.sql')
+
+_listener: QueueListener = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Обработчик, передающий записи журнала в очередь без блокировки.
+
+    Записи не форматируются в вызывающем потоке: это делает фоновый поток
+    QueueListener. При переполнении очереди запись отбрасывается
+    и учитывается в метрике sql_log_dropped_total.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            SQL_LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись журнала SQL-запроса в одну строку JSON.
+
+    Поля запроса берутся из атрибута sql записи. Параметры запроса
+    преобразуются в строку здесь, в фоновом потоке.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **getattr(record, 'sql', {}),
+        }
+        if 'parameters' in entry:
+            entry['parameters'] = repr(entry['parameters'])[:MAX_PARAMETERS_LENGTH]
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_sql_logging(stream=None, queue_size: int = SQL_LOG_QUEUE_SIZE):
+    """
+    Подключает к логгеру app.sql очередь и фоновый поток вывода.
+
+    Повторные вызовы ничего не делают. Остаток очереди выводится
+    при завершении процесса.
+
+    :param stream: Поток вывода; по умолчанию stderr.
+    :param queue_size: Максимальное количество записей в очереди.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class StatementLog:
+    """
+    Выборочная запись SQL-запросов движка в журнал app.sql.
+
+    Медленные запросы (не быстрее slow_ms) записываются всегда и с параметрами,
+    остальные - с вероятностью sample_rate и без параметров. Для запросов,
+    не попавших в журнал, выполняются только замер времени и сравнение.
+    Запись содержит длительность, текст запроса, движок и маршрут HTTP-запроса.
+
+    :param sample_rate: Доля случайно записываемых запросов от 0 до 1.
+    :param slow_ms: Порог медленного запроса в миллисекундах; 0 - не выделять.
+    """
+
+    def __init__(self, sample_rate: float = SQL_LOG_SAMPLE_RATE,
+                 slow_ms: float = SQL_LOG_SLOW_MS):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_log_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = (time.perf_counter() - conn.info['sql_log_started'].pop()) * 1000
+        slow = 0 < self.slow_ms <= elapsed
+        if not slow and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return
+        method, route = current_route()
+        entry = {
+            'duration_ms': round(elapsed, 3),
+            'engine': getattr(conn.engine.pool, 'metrics_name', None),
+            'method': method,
+            'route': route,
+            'statement': statement,
+            'executemany': executemany,
+        }
+        if slow:
+            entry['parameters'] = parameters
+        logger.info('slow query' if slow else 'sampled query', extra={'sql': entry})
+
+    def handle_error(self, context):
+        if context.connection is not None:
+            started = context.connection.info.get('sql_log_started')
+            if started:
+                started.pop()
+
+
+def log_statements(engine, statement_log: StatementLog = None):
+    """
+    Подключает выборочную запись SQL-запросов к движку.
+
+    Если выборка и порог медленных запросов отключены, обработчики
+    не подключаются вовсе.
+
+    :param engine: Синхронный движок (для AsyncEngine - его sync_engine).
+    :param statement_log: Настройки выборки; по умолчанию из config.
+    """
+    statement_log = statement_log or StatementLog()
+    if not statement_log.enabled:
+        return
+    setup_sql_logging()
+    event.listen(engine, 'before_cursor_execute', statement_log.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', statement_log.after_cursor_execute)
+    event.listen(engine, 'handle_error', statement_log.handle_error)
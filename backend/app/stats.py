@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.crud import (
+    FLEET_BATTERIES, FLEET_COUNTERS, FLEET_DEVICES, FLEET_UNATTACHED,
+    MAX_BATTERIES_PER_DEVICE, bucket_counter, merge_deltas
+)
+from app.metrics import FLEET_COUNTER_DRIFT, FLEET_RECONCILE, FLEET_RECONCILE_FAILURES
+from app.models import Battery, Device, FleetCounter
+from config import FLEET_STATS_RECONCILE_INTERVAL, FLEET_STATS_SHARDS
+
+logger = logging.getLogger('app.stats')
+
+
+def get_fleet_stats(db):
+    """
+    Получает статистику парка из счетчиков.
+
+    Запрос читает по FLEET_STATS_SHARDS строк на счетчик, поэтому время
+    ответа не зависит от количества устройств и батарей.
+
+    :param db: Сессия базы данных.
+    :return: Словарь с количеством устройств, батарей, свободных батарей
+        и устройств по количеству привязанных батарей.
+    """
+    values = dict(db.execute(
+        select(FleetCounter.name, func.sum(FleetCounter.value))
+        .group_by(FleetCounter.name)
+    ).all())
+
+    def count(name):
+        return int(values.get(name) or 0)
+
+    return {
+        'devices': count(FLEET_DEVICES),
+        'batteries': count(FLEET_BATTERIES),
+        'attached_batteries': count(FLEET_BATTERIES) - count(FLEET_UNATTACHED),
+        'unattached_batteries': count(FLEET_UNATTACHED),
+        'devices_by_battery_count': [
+            {'battery_count': n, 'devices': count(bucket_counter(n))}
+            for n in range(MAX_BATTERIES_PER_DEVICE + 1)
+        ],
+    }
+
+
+def count_fleet(conn):
+    """
+    Считает значения счетчиков по таблицам устройств и батарей.
+
+    :param conn: Соединение или сессия базы данных.
+    :return: Словарь {имя счетчика: значение}.
+    """
+    result = dict.fromkeys(FLEET_COUNTERS, 0)
+    for battery_count, devices in conn.execute(
+        select(Device.battery_count, func.count()).group_by(Device.battery_count)
+    ):
+        result[FLEET_DEVICES] += devices
+        name = bucket_counter(battery_count)
+        if name in result:
+            result[name] = devices
+    batteries, attached = conn.execute(
+        select(func.count(Battery.id), func.count(Battery.device_id))
+    ).one()
+    result[FLEET_BATTERIES] = batteries
+    result[FLEET_UNATTACHED] = batteries - attached
+    return result
+
+
+def reconcile(bind, shards: int = FLEET_STATS_SHARDS):
+    """
+    Пересчитывает счетчики по таблицам и исправляет расхождения.
+
+    Сначала блокируются все строки счетчиков, затем выполняется подсчет.
+    Транзакции, уже изменившие счетчики, к этому моменту зафиксированы
+    и видны подсчету; транзакции, еще не дошедшие до счетчиков, ждут
+    блокировку и прибавят свои изменения к исправленным значениям.
+    Расхождение прибавляется к шарду 0.
+
+    :param bind: Синхронный движок базы данных.
+    :param shards: Количество шардов счетчика.
+    :return: Словарь исправленных расхождений {имя счетчика: разница}.
+    """
+    insert = sqlite_insert if bind.dialect.name == 'sqlite' else pg_insert
+    with bind.begin() as conn:
+        conn.execute(
+            insert(FleetCounter).values([
+                {'name': name, 'shard': shard, 'value': 0}
+                for name in sorted(FLEET_COUNTERS) for shard in range(shards)
+            ]).on_conflict_do_nothing(index_elements=['name', 'shard'])
+        )
+        current = dict.fromkeys(FLEET_COUNTERS, 0)
+        for name, value in conn.execute(
+            select(FleetCounter.name, FleetCounter.value)
+            .order_by(FleetCounter.name, FleetCounter.shard)
+            .with_for_update()
+        ):
+            current[name] = current.get(name, 0) + value
+        actual = count_fleet(conn)
+        drift = merge_deltas(actual, {name: -value for name, value in current.items()})
+        if drift:
+            stmt = insert(FleetCounter).values([
+                {'name': name, 'shard': 0, 'value': drift[name]} for name in sorted(drift)
+            ])
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['name', 'shard'],
+                set_={'value': FleetCounter.value + stmt.excluded.value}
+            ))
+    for name, value in drift.items():
+        FLEET_COUNTER_DRIFT.labels(name).inc(abs(value))
+    return drift
+
+
+class FleetReconciler:
+    """
+    Фоновый поток, периодически пересчитывающий счетчики парка.
+
+    Первый пересчет выполняется сразу после запуска: он заполняет
+    счетчики в базе, созданной без миграций.
+
+    :param bind: Синхронный движок базы данных.
+    :param interval: Интервал между пересчетами в секундах.
+    """
+
+    def __init__(self, bind, interval: float = FLEET_STATS_RECONCILE_INTERVAL):
+        self.bind = bind
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Запускает фоновый поток.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливает фоновый поток, не дожидаясь текущего пересчета.
+        """
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = time.perf_counter()
+            try:
+                reconcile(self.bind)
+            except Exception:
+                # Например, конфликт с параллельной записью в SQLite:
+                # пересчет повторится через interval. Постоянная ошибка
+                # (нет таблицы, нет прав) видна в журнале и в метрике.
+                FLEET_RECONCILE_FAILURES.inc()
+                logger.exception("Fleet counters reconcile failed")
+            else:
+                FLEET_RECONCILE.observe(time.perf_counter() - started)
+            self._stopped.wait(self.interval)
@@ -0,0 +1,522 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import select, text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.database import engine
+from app.metrics import TELEMETRY_BUFFERED, TELEMETRY_FLUSH, TELEMETRY_READINGS
+from app.models import BatteryReading, BatteryReadingHour, BatteryReadingMinute
+from app.schemas import TelemetryReading
+from config import (
+    TELEMETRY_BUFFER_SIZE, TELEMETRY_FLUSH_INTERVAL, TELEMETRY_FLUSH_ROWS,
+    TELEMETRY_MAX_BATCH, TELEMETRY_MAX_CLOCK_SKEW, TELEMETRY_RETENTION_DAYS
+)
+
+logger = logging.getLogger('app.telemetry')
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Ошибки записи, которые вызваны самими данными и не исчезнут при повторе.
+PERMANENT_ERRORS = (DataError, IntegrityError)
+
+# Агрегаты показаний: модель и длина интервала в миллисекундах.
+ROLLUPS = {
+    '1m': (BatteryReadingMinute, 60 * 1000),
+    '1h': (BatteryReadingHour, 60 * 60 * 1000),
+}
+
+# Окно запроса по умолчанию (мс) для каждого разрешения.
+DEFAULT_WINDOWS = {
+    'raw': 60 * 60 * 1000,
+    '1m': DAY_MS,
+    '1h': 30 * DAY_MS,
+}
+
+METRICS = ('voltage', 'soc', 'temperature')
+
+# Тело запроса приема разбирается и проверяется pydantic-core прямо из JSON:
+# это вдвое быстрее json.loads с последующей проверкой списка словарей.
+READINGS = TypeAdapter(List[TelemetryReading])
+
+# Описание тела запроса приема в OpenAPI для маршрута, читающего тело сам.
+READINGS_BODY = {
+    'requestBody': {
+        'required': True,
+        'content': {'application/json': {'schema': {
+            'type': 'array',
+            'items': TelemetryReading.model_json_schema(),
+            'maxItems': TELEMETRY_MAX_BATCH,
+        }}},
+    },
+}
+
+
+def to_ms(value: datetime):
+    """
+    Переводит время в миллисекунды Unix.
+
+    :param value: Время; без часового пояса считается UTC.
+    :return: Количество миллисекунд с начала эпохи.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def from_ms(value: int):
+    """
+    Переводит миллисекунды Unix во время UTC.
+
+    :param value: Количество миллисекунд с начала эпохи.
+    :return: Время с часовым поясом UTC.
+    """
+    return datetime.fromtimestamp(value / 1000, timezone.utc)
+
+
+def prepare_readings(readings, now_ms: int = None,
+                     retention_days: int = TELEMETRY_RETENTION_DAYS,
+                     max_skew: float = TELEMETRY_MAX_CLOCK_SKEW):
+    """
+    Проверяет время показаний и переводит их в строки для записи.
+
+    Показания старше срока хранения или из будущего (с учетом допустимого
+    опережения часов устройства) не принимаются: они создали бы лишние
+    секции таблицы или сразу были бы удалены.
+
+    :param readings: Показания (объекты со свойствами схемы TelemetryReading).
+    :param now_ms: Текущее время в миллисекундах; по умолчанию системное.
+    :param retention_days: Срок хранения показаний в сутках; 0 - без ограничения.
+    :param max_skew: Допустимое опережение часов устройства в секундах.
+    :return: Кортеж (строки (battery_id, ts, voltage, soc, temperature), ошибки).
+    """
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    latest = now_ms + int(max_skew * 1000)
+    earliest = now_ms - retention_days * DAY_MS if retention_days else None
+    rows, errors = [], []
+    for index, reading in enumerate(readings):
+        ts = reading.ts
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        ts = int(ts.timestamp() * 1000)
+        if ts > latest or (earliest is not None and ts < earliest):
+            errors.append({'index': index, 'detail': "ts is outside the accepted window"})
+            continue
+        rows.append((
+            reading.battery_id, ts, reading.voltage, reading.soc, reading.temperature
+        ))
+    return rows, errors
+
+
+def _rollup_sql(table: str, source: str, bucket_ms: int, least: str, greatest: str):
+    """
+    Формирует запрос, добавляющий показания из source к агрегатам table.
+
+    :param table: Таблица агрегатов.
+    :param source: Таблица или CTE с новыми показаниями.
+    :param bucket_ms: Длина интервала агрегата в миллисекундах.
+    :param least: Функция минимума из двух значений в диалекте базы данных.
+    :param greatest: Функция максимума из двух значений в диалекте базы данных.
+    :return: Текст INSERT ... ON CONFLICT DO UPDATE.
+    """
+    columns = ['battery_id', 'bucket', 'count']
+    values = ['battery_id', f'ts - ts % {bucket_ms}', 'count(*)']
+    updates = ['count = t.count + excluded.count']
+    for metric in METRICS:
+        columns += [f'{metric}_sum', f'{metric}_min', f'{metric}_max']
+        values += [
+            f'sum(CAST({metric} AS DOUBLE PRECISION))', f'min({metric})', f'max({metric})'
+        ]
+        updates += [
+            f'{metric}_sum = t.{metric}_sum + excluded.{metric}_sum',
+            f'{metric}_min = {least}(t.{metric}_min, excluded.{metric}_min)',
+            f'{metric}_max = {greatest}(t.{metric}_max, excluded.{metric}_max)',
+        ]
+    # WHERE true нужен SQLite, чтобы ON CONFLICT не разбирался как условие соединения.
+    return (
+        f"INSERT INTO {table} AS t ({', '.join(columns)}) "
+        f"SELECT {', '.join(values)} FROM {source} WHERE true GROUP BY 1, 2 "
+        f"ON CONFLICT (battery_id, bucket) DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+def partition_name(day: int):
+    """
+    Формирует имя суточной секции таблицы показаний.
+
+    :param day: Номер суток с начала эпохи.
+    :return: Имя таблицы-секции, например battery_readings_p20261018.
+    """
+    return f"{BatteryReading.__tablename__}_p{from_ms(day * DAY_MS):%Y%m%d}"
+
+
+class TelemetryWriter:
+    """
+    Запись пачек показаний вместе с агрегатами в одной транзакции.
+
+    В PostgreSQL пачка передается массивами и записывается одним запросом:
+    показания неизвестных батарей отбрасываются, повторы (та же батарея и то же
+    время) пропускаются, а агрегаты пополняются только вставленными строками.
+    Секции на сутки создаются перед первой записью в них, секции старше срока
+    хранения удаляются. В SQLite пачка проходит те же шаги через временную таблицу.
+
+    :param bind: Синхронный движок базы данных.
+    :param retention_days: Срок хранения показаний в сутках; 0 - без ограничения.
+    """
+
+    PARTITIONS = text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:parent AS regclass)"
+    )
+
+    def __init__(self, bind, retention_days: int = TELEMETRY_RETENTION_DAYS):
+        self.bind = bind
+        self.retention_days = retention_days
+        # Сутки, секции (или обслуживание) которых уже выполнены этим процессом.
+        self._days = set()
+        dialect = bind.dialect.name
+        least, greatest = ('LEAST', 'GREATEST') if dialect == 'postgresql' else ('min', 'max')
+        source = 'inserted' if dialect == 'postgresql' else 'telemetry_batch'
+        self._rollups = [
+            _rollup_sql(model.__tablename__, source, bucket_ms, least, greatest)
+            for model, bucket_ms in ROLLUPS.values()
+        ]
+
+    def write(self, rows):
+        """
+        Записывает пачку показаний.
+
+        :param rows: Кортежи (battery_id, ts, voltage, soc, temperature).
+        :return: Словарь с количеством записанных показаний, повторов
+            и показаний неизвестных батарей.
+        """
+        days = {ts // DAY_MS for _, ts, *_ in rows}
+        if self.bind.dialect.name == 'postgresql':
+            self._prepare_partitions(days)
+            known, stored = self._write_postgresql(rows)
+        else:
+            self._maintain_sqlite(days)
+            known, stored = self._write_sqlite(rows)
+        return {
+            'stored': stored,
+            'duplicate': known - stored,
+            'unknown_battery': len(rows) - known,
+        }
+
+    def _write_postgresql(self, rows):
+        # Массивы передаются текстом '{1,2,3}': список psycopg2 подставил бы
+        # ARRAY[1, 2, 3], разбор которого на пачке в десятки тысяч значений
+        # занимает больше времени, чем сама запись.
+        battery_ids, ts, voltage, soc, temperature = (
+            '{' + ','.join(map(str, column)) + '}' for column in zip(*rows)
+        )
+        rollups = ', '.join(
+            f"{name} AS ({sql})" for name, sql in zip(('minute', 'hour'), self._rollups)
+        )
+        statement = text(
+            "WITH batch AS ("
+            " SELECT r.* FROM unnest("
+            "  CAST(:battery_id AS integer[]), CAST(:ts AS bigint[]),"
+            "  CAST(:voltage AS real[]), CAST(:soc AS real[]), CAST(:temperature AS real[])"
+            " ) AS r(battery_id, ts, voltage, soc, temperature)"
+            " WHERE EXISTS (SELECT 1 FROM batteries b WHERE b.id = r.battery_id)"
+            "), inserted AS ("
+            " INSERT INTO battery_readings (battery_id, ts, voltage, soc, temperature)"
+            " SELECT battery_id, ts, voltage, soc, temperature FROM batch"
+            " ON CONFLICT DO NOTHING"
+            " RETURNING battery_id, ts, voltage, soc, temperature"
+            f"), {rollups} "
+            "SELECT (SELECT count(*) FROM batch), (SELECT count(*) FROM inserted)"
+        )
+        with self.bind.begin() as conn:
+            return tuple(conn.execute(statement, {
+                'battery_id': battery_ids, 'ts': ts, 'voltage': voltage,
+                'soc': soc, 'temperature': temperature,
+            }).one())
+
+    def _write_sqlite(self, rows):
+        with self.bind.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TEMP TABLE IF NOT EXISTS telemetry_batch ("
+                "battery_id INTEGER, ts INTEGER, voltage REAL, soc REAL, temperature REAL)"
+            )
+            conn.exec_driver_sql("DELETE FROM telemetry_batch")
+            conn.exec_driver_sql("INSERT INTO telemetry_batch VALUES (?, ?, ?, ?, ?)", rows)
+            unknown = conn.exec_driver_sql(
+                "DELETE FROM telemetry_batch WHERE battery_id NOT IN (SELECT id FROM batteries)"
+            ).rowcount
+            conn.exec_driver_sql(
+                "DELETE FROM telemetry_batch"
+                " WHERE rowid NOT IN ("
+                "  SELECT min(rowid) FROM telemetry_batch GROUP BY battery_id, ts"
+                " ) OR EXISTS ("
+                "  SELECT 1 FROM battery_readings r"
+                "  WHERE r.battery_id = telemetry_batch.battery_id"
+                "  AND r.ts = telemetry_batch.ts"
+                " )"
+            )
+            stored = conn.exec_driver_sql(
+                "INSERT INTO battery_readings (battery_id, ts, voltage, soc, temperature)"
+                " SELECT battery_id, ts, voltage, soc, temperature FROM telemetry_batch"
+            ).rowcount
+            for sql in self._rollups:
+                conn.exec_driver_sql(sql)
+            return len(rows) - unknown, stored
+
+    def _prepare_partitions(self, days):
+        missing = days - self._days
+        if not missing:
+            return
+        parent = BatteryReading.__tablename__
+        with self.bind.begin() as conn:
+            existing = set(conn.execute(self.PARTITIONS, {'parent': parent}).scalars())
+            for day in sorted(missing):
+                name = partition_name(day)
+                if name not in existing:
+                    conn.exec_driver_sql(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+                        f"FOR VALUES FROM ({day * DAY_MS}) TO ({(day + 1) * DAY_MS})"
+                    )
+            if self.retention_days:
+                cutoff = partition_name(max(days) - self.retention_days)
+                # Имена секций с датой в формате ГГГГММДД упорядочены по времени.
+                for name in existing:
+                    if name < cutoff:
+                        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+                self._expire_minutes(conn, days)
+        self._days |= missing
+
+    def _maintain_sqlite(self, days):
+        missing = days - self._days
+        if not missing:
+            return
+        if self.retention_days:
+            cutoff = (max(days) - self.retention_days) * DAY_MS
+            with self.bind.begin() as conn:
+                conn.execute(
+                    BatteryReading.__table__.delete().where(BatteryReading.ts < cutoff)
+                )
+                self._expire_minutes(conn, days)
+        self._days |= missing
+
+    def _expire_minutes(self, conn, days):
+        # Минутные агрегаты хранятся столько же, сколько исходные показания,
+        # часовые - без ограничения.
+        cutoff = (max(days) - self.retention_days) * DAY_MS
+        conn.execute(
+            BatteryReadingMinute.__table__.delete()
+            .where(BatteryReadingMinute.bucket < cutoff)
+        )
+
+
+class TelemetryBuffer:
+    """
+    Буфер принятых показаний с фоновой записью пачками.
+
+    Запросы приема только добавляют показания в буфер. Фоновый поток
+    записывает их пачками по flush_rows, когда буфер накопил пачку или
+    прошло flush_interval секунд, поэтому показания многих запросов
+    объединяются в несколько больших вставок. Если пачку не удается
+    записать из-за самих данных (DataError, IntegrityError), она делится
+    пополам, пока не останутся отдельные показания, которые нельзя записать:
+    они отбрасываются с результатом failed, а остальные записываются.
+    При других ошибках (например, база данных недоступна) пачка
+    возвращается в буфер и повторяется; если буфер заполнен, новые
+    показания не принимаются, и клиенты получают 503.
+
+    :param writer: Объект, записывающий пачки (TelemetryWriter).
+    :param max_size: Емкость буфера в показаниях.
+    :param flush_rows: Максимальный размер одной пачки.
+    :param flush_interval: Максимальное время (сек) между записями.
+    """
+
+    def __init__(self, writer, max_size: int = TELEMETRY_BUFFER_SIZE,
+                 flush_rows: int = TELEMETRY_FLUSH_ROWS,
+                 flush_interval: float = TELEMETRY_FLUSH_INTERVAL):
+        self.writer = writer
+        self.max_size = max_size
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        TELEMETRY_BUFFERED.set_function(lambda: len(self._rows))
+
+    def add(self, rows):
+        """
+        Добавляет показания в буфер.
+
+        :param rows: Кортежи (battery_id, ts, voltage, soc, temperature).
+        :return: False, если буфер заполнен и показания не приняты.
+        """
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_size:
+                return False
+            self._rows.extend(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._rows) >= self.flush_rows:
+                self._wakeup.set()
+        return True
+
+    def flush(self):
+        """
+        Записывает все показания из буфера.
+
+        :raises Exception: Ошибка записи; незаписанные показания остаются в буфере.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    rows = self._rows[:self.flush_rows]
+                    del self._rows[:self.flush_rows]
+                if not rows:
+                    return
+                started = time.perf_counter()
+                try:
+                    result = self._write(rows)
+                except Exception:
+                    # Повтор безопасен: уже записанные показания пропускаются
+                    # как повторы и не попадают в агрегаты второй раз.
+                    TELEMETRY_READINGS.labels('retried').inc(len(rows))
+                    with self._lock:
+                        self._rows[:0] = rows
+                    raise
+                TELEMETRY_FLUSH.observe(time.perf_counter() - started)
+                for name, value in result.items():
+                    TELEMETRY_READINGS.labels(name).inc(value)
+
+    def _write(self, rows):
+        """
+        Записывает пачку, отделяя показания, которые нельзя записать.
+
+        :param rows: Кортежи (battery_id, ts, voltage, soc, temperature).
+        :return: Словарь с количеством показаний по результату записи.
+        :raises Exception: Ошибка записи, не связанная с данными.
+        """
+        try:
+            return self.writer.write(rows)
+        except PERMANENT_ERRORS as e:
+            if len(rows) == 1:
+                logger.warning("Dropped telemetry reading %s: %s", rows[0], e.orig)
+                return {'failed': 1}
+        middle = len(rows) // 2
+        result = self._write(rows[:middle])
+        for name, value in self._write(rows[middle:]).items():
+            result[name] = result.get(name, 0) + value
+        return result
+
+    def pending(self):
+        """
+        Возвращает количество показаний, ожидающих записи.
+
+        :return: Количество показаний в буфере.
+        """
+        return len(self._rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Пачка вернулась в буфер и будет повторена через flush_interval.
+                time.sleep(self.flush_interval)
+
+
+_buffer: TelemetryBuffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Возвращает буфер показаний, создавая его при первом обращении.
+
+    :return: Экземпляр TelemetryBuffer.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = TelemetryBuffer(TelemetryWriter(engine))
+    return _buffer
+
+
+def set_buffer(buffer: TelemetryBuffer):
+    """
+    Заменяет буфер показаний.
+
+    :param buffer: Новый буфер.
+    """
+    global _buffer
+    _buffer = buffer
+
+
+def get_readings(db, battery_id: int, start: int, end: int, limit: int):
+    """
+    Получает исходные показания батареи за период.
+
+    :param db: Сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :param start: Начало периода в миллисекундах Unix (включительно).
+    :param end: Конец периода в миллисекундах Unix (не включительно).
+    :param limit: Максимальное количество показаний.
+    :return: Список словарей с временем и значениями показаний по возрастанию времени.
+    """
+    rows = db.execute(
+        select(
+            BatteryReading.ts, BatteryReading.voltage, BatteryReading.soc,
+            BatteryReading.temperature
+        )
+        .where(
+            BatteryReading.battery_id == battery_id,
+            BatteryReading.ts >= start, BatteryReading.ts < end
+        )
+        .order_by(BatteryReading.ts)
+        .limit(limit)
+    )
+    return [
+        {'ts': from_ms(ts), 'voltage': voltage, 'soc': soc, 'temperature': temperature}
+        for ts, voltage, soc, temperature in rows
+    ]
+
+
+def get_rollups(db, battery_id: int, resolution: str, start: int, end: int, limit: int):
+    """
+    Получает агрегаты показаний батареи за период.
+
+    :param db: Сессия базы данных.
+    :param battery_id: Идентификатор батареи.
+    :param resolution: Длина интервала: '1m' или '1h'.
+    :param start: Начало периода в миллисекундах Unix (по началу интервала, включительно).
+    :param end: Конец периода в миллисекундах Unix (не включительно).
+    :param limit: Максимальное количество интервалов.
+    :return: Список словарей со средними, минимумами и максимумами по возрастанию времени.
+    """
+    model, _ = ROLLUPS[resolution]
+    rows = db.execute(
+        select(model)
+        .where(model.battery_id == battery_id, model.bucket >= start, model.bucket < end)
+        .order_by(model.bucket)
+        .limit(limit)
+    ).scalars()
+    result = []
+    for row in rows:
+        item = {'ts': from_ms(row.bucket), 'count': row.count}
+        for metric in METRICS:
+            item[f'{metric}_avg'] = getattr(row, f'{metric}_sum') / row.count
+            item[f'{metric}_min'] = getattr(row, f'{metric}_min')
+            item[f'{metric}_max'] = getattr(row, f'{metric}_max')
+        result.append(item)
+    return result
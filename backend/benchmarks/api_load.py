@@ -0,0 +1,421 @@
+"""
+Нагрузочный бенчмарк маршрутов /api на заполненной базе данных.
+
+Для каждого маршрута (списки, получение, создание, обновление, удаление,
+привязка, пакетные операции, выгрузки) и для смешанной нагрузки чтения
+и записи измеряются p50/p95/p99 задержки и пропускная способность.
+Результаты сохраняются в JSON и могут сравниваться с предыдущим запуском.
+
+Внешние сервисы не нужны: база задается через DATABASE_URL (SQLite-файл
+или локально запущенный PostgreSQL), запросы выполняются в процессе через
+ASGI-транспорт или к запущенному серверу через --base-url. Запуск из
+каталога backend:
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.api_load \\
+        --devices 200000 --batteries 1000000 --output results.json
+    python -m benchmarks.api_load --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from app.crud import MAX_BATTERIES_PER_DEVICE
+from app.database import async_engine, engine
+from app.models import Base
+from benchmarks.common import cleanup, seed_volume
+from config import DB_ASYNC
+
+# Количество элементов в одном пакетном запросе.
+BULK_SIZE = 100
+
+# Количество идентификаторов в одном запросе ?ids=.
+BATCH_IDS = 50
+
+
+class Scenario:
+    """
+    Сценарий нагрузки на один маршрут.
+
+    :param name: Название сценария (метод и шаблон пути).
+    :param build: Функция (state, i) -> (метод, путь, тело) для i-го запроса.
+    :param count: Функция (state, args) -> количество запросов.
+    :param collect: Функция (state, ответ), сохраняющая созданные объекты.
+    """
+
+    def __init__(self, name, build, count, collect=None):
+        self.name = name
+        self.build = build
+        self.count = count
+        self.collect = collect
+
+
+class State:
+    """
+    Данные, разделяемые сценариями: засеянные и созданные в ходе запуска объекты.
+    """
+
+    def __init__(self, prefix, device_ids, battery_ids, rng, write_ratio):
+        self.prefix = prefix
+        self.device_ids = device_ids
+        self.battery_ids = battery_ids
+        self.rng = rng
+        self.write_ratio = write_ratio
+        self.new_devices = []
+        self.new_batteries = []
+        self.bulk_batteries = []
+
+    def device(self):
+        return self.rng.choice(self.device_ids)
+
+    def battery(self):
+        return self.rng.choice(self.battery_ids)
+
+    def ids(self, ids, count: int = BATCH_IDS):
+        """
+        Возвращает случайные засеянные идентификаторы для параметра ids.
+        """
+        return ','.join(map(str, self.rng.sample(ids, min(count, len(ids)))))
+
+    def fragment(self, letter: str, count: int):
+        """
+        Возвращает фрагмент из середины имени засеянного объекта для поиска.
+        """
+        return f"{self.prefix.split('-', 1)[1]}-{letter}{self.rng.randrange(count)}"
+
+
+def _requests(state, args):
+    return args.requests
+
+
+def _heavy(state, args):
+    return args.heavy_requests
+
+
+def _bulk(state, args):
+    return args.bulk_requests
+
+
+def _collect_id(attr):
+    def collect(state, response):
+        getattr(state, attr).append(response.json()['id'])
+    return collect
+
+
+def _collect_bulk(state, response):
+    state.bulk_batteries.extend(item['id'] for item in response.json()['items'])
+
+
+def _mixed(state, i):
+    """
+    Запрос смешанной нагрузки: чтение или (с долей write_ratio) обновление.
+    """
+    if state.rng.random() < state.write_ratio and state.new_batteries:
+        battery_id = state.rng.choice(state.new_batteries)
+        return 'PUT', f"/api/batteries/{battery_id}/", {
+            'name': f"{state.prefix}-mix-{i}-{battery_id}"
+        }
+    return state.rng.choice((
+        lambda: ('GET', f"/api/devices/{state.device()}/", None),
+        lambda: ('GET', f"/api/batteries/{state.battery()}/", None),
+        lambda: ('GET', "/api/devices/?limit=50&pagination=cursor", None),
+        lambda: ('GET', "/api/batteries/?limit=50&pagination=cursor", None),
+    ))()
+
+
+SCENARIOS = [
+    Scenario('GET /api/devices/', lambda s, i: (
+        'GET', f"/api/devices/?skip={s.rng.randrange(1000)}&limit=50", None
+    ), _requests),
+    Scenario('GET /api/devices/?pagination=cursor', lambda s, i: (
+        'GET', "/api/devices/?limit=50&pagination=cursor", None
+    ), _requests),
+    Scenario('GET /api/devices/{device_id}/', lambda s, i: (
+        'GET', f"/api/devices/{s.device()}/", None
+    ), _requests),
+    Scenario('GET /api/batteries/', lambda s, i: (
+        'GET', f"/api/batteries/?skip={s.rng.randrange(1000)}&limit=50", None
+    ), _requests),
+    Scenario('GET /api/batteries/?pagination=cursor', lambda s, i: (
+        'GET', "/api/batteries/?limit=50&pagination=cursor", None
+    ), _requests),
+    Scenario('GET /api/batteries/{battery_id}/', lambda s, i: (
+        'GET', f"/api/batteries/{s.battery()}/", None
+    ), _requests),
+    Scenario('GET /api/batteries/?attached=false', lambda s, i: (
+        'GET', "/api/batteries/?attached=false&limit=50", None
+    ), _requests),
+    Scenario('GET /api/batteries/?device_id=', lambda s, i: (
+        'GET', f"/api/batteries/?device_id={s.device()}", None
+    ), _requests),
+    Scenario('GET /api/devices/?device_has_free_slots=true', lambda s, i: (
+        'GET', "/api/devices/?device_has_free_slots=true&limit=50", None
+    ), _requests),
+    Scenario('GET /api/devices/?ids=', lambda s, i: (
+        'GET', f"/api/devices/?ids={s.ids(s.device_ids)}", None
+    ), _requests),
+    Scenario('GET /api/batteries/?ids=', lambda s, i: (
+        'GET', f"/api/batteries/?ids={s.ids(s.battery_ids)}", None
+    ), _requests),
+    Scenario('GET /api/devices/search', lambda s, i: (
+        'GET', f"/api/devices/search?q={s.fragment('d', len(s.device_ids))}", None
+    ), _requests),
+    Scenario('GET /api/batteries/search', lambda s, i: (
+        'GET', f"/api/batteries/search?q={s.fragment('b', len(s.battery_ids))}", None
+    ), _requests),
+    Scenario('POST /api/devices/', lambda s, i: (
+        'POST', "/api/devices/", {'name': f"{s.prefix}-new-d{i}"}
+    ), _requests, _collect_id('new_devices')),
+    Scenario('POST /api/batteries/', lambda s, i: (
+        'POST', "/api/batteries/", {'name': f"{s.prefix}-new-b{i}"}
+    ), _requests, _collect_id('new_batteries')),
+    Scenario('POST /api/devices/{device_id}/batteries/{battery_id}/attach', lambda s, i: (
+        'POST', f"/api/devices/{s.new_devices[i // MAX_BATTERIES_PER_DEVICE]}"
+                f"/batteries/{s.new_batteries[i]}/attach", None
+    ), lambda s, args: min(
+        len(s.new_batteries), len(s.new_devices) * MAX_BATTERIES_PER_DEVICE
+    )),
+    Scenario('PUT /api/devices/{device_id}/', lambda s, i: (
+        'PUT', f"/api/devices/{s.new_devices[i]}/", {'name': f"{s.prefix}-upd-d{i}"}
+    ), lambda s, args: len(s.new_devices)),
+    Scenario('PUT /api/batteries/{battery_id}/', lambda s, i: (
+        'PUT', f"/api/batteries/{s.new_batteries[i]}/", {'name': f"{s.prefix}-upd-b{i}"}
+    ), lambda s, args: len(s.new_batteries)),
+    Scenario('mixed', _mixed, _requests),
+    Scenario('POST /api/batteries/bulk', lambda s, i: (
+        'POST', "/api/batteries/bulk",
+        [{'name': f"{s.prefix}-bulk-{i}-{j}"} for j in range(BULK_SIZE)]
+    ), _bulk, _collect_bulk),
+    Scenario('PUT /api/batteries/bulk', lambda s, i: (
+        'PUT', "/api/batteries/bulk", [
+            {'id': battery_id, 'name': f"{s.prefix}-bulk-upd-{battery_id}"}
+            for battery_id in s.bulk_batteries[i * BULK_SIZE:(i + 1) * BULK_SIZE]
+        ]
+    ), lambda s, args: len(s.bulk_batteries) // BULK_SIZE),
+    Scenario('DELETE /api/batteries/bulk', lambda s, i: (
+        'DELETE', "/api/batteries/bulk",
+        s.bulk_batteries[i * BULK_SIZE:(i + 1) * BULK_SIZE]
+    ), lambda s, args: len(s.bulk_batteries) // BULK_SIZE),
+    Scenario('DELETE /api/batteries/{battery_id}/', lambda s, i: (
+        'DELETE', f"/api/batteries/{s.new_batteries[i]}/", None
+    ), lambda s, args: len(s.new_batteries)),
+    Scenario('DELETE /api/devices/{device_id}/', lambda s, i: (
+        'DELETE', f"/api/devices/{s.new_devices[i]}/", None
+    ), lambda s, args: len(s.new_devices)),
+    Scenario('GET /api/devices/tree', lambda s, i: (
+        'GET', "/api/devices/tree", None
+    ), _heavy),
+    Scenario('GET /api/export/devices', lambda s, i: (
+        'GET', "/api/export/devices", None
+    ), _heavy),
+    Scenario('GET /api/export/batteries', lambda s, i: (
+        'GET', "/api/export/batteries", None
+    ), _heavy),
+]
+
+
+def percentile(values, p: float):
+    """
+    Вычисляет перцентиль по отсортированному списку (метод ближайшего ранга).
+
+    :param values: Отсортированные значения.
+    :param p: Перцентиль от 0 до 100.
+    :return: Значение перцентиля или None для пустого списка.
+    """
+    if not values:
+        return None
+    rank = max(1, round(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+async def run_scenario(client, scenario, state, total: int, concurrency: int,
+                       write_lock=None):
+    """
+    Выполняет запросы сценария с заданным уровнем параллелизма.
+
+    :param client: HTTP-клиент.
+    :param scenario: Сценарий нагрузки.
+    :param state: Разделяемые данные сценариев.
+    :param total: Количество запросов.
+    :param concurrency: Количество одновременных запросов.
+    :param write_lock: Блокировка, через которую проходят изменяющие запросы.
+    :return: Словарь с задержками (мс), пропускной способностью и ошибками.
+    """
+    counter = iter(range(total))
+    latencies = []
+    errors = {}
+
+    async def worker():
+        for i in counter:
+            method, path, body = scenario.build(state, i)
+            started = time.perf_counter()
+            if write_lock is not None and method != 'GET':
+                async with write_lock:
+                    response = await client.request(method, path, json=body)
+            else:
+                response = await client.request(method, path, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+            elif scenario.collect:
+                scenario.collect(state, response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'throughput': round(total / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': _round(percentile(latencies, 50)),
+        'p95_ms': _round(percentile(latencies, 95)),
+        'p99_ms': _round(percentile(latencies, 99)),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def run(args, state):
+    """
+    Последовательно выполняет выбранные сценарии.
+
+    :param args: Аргументы командной строки.
+    :param state: Разделяемые данные сценариев.
+    :return: Результаты по сценариям.
+    """
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from main import app
+        transport, base_url = httpx.ASGITransport(app=app), "http://bench"
+    # SQLite допускает одного писателя, а параллельное повышение читающей
+    # транзакции до пишущей сразу завершается ошибкой "database is locked".
+    write_lock = asyncio.Lock() if engine.dialect.name == 'sqlite' else None
+    results = {}
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=args.timeout
+    ) as client:
+        for scenario in SCENARIOS:
+            if args.only and not any(part in scenario.name for part in args.only):
+                continue
+            total = scenario.count(state, args)
+            if not total:
+                continue
+            result = await run_scenario(
+                client, scenario, state, total, args.concurrency, write_lock
+            )
+            results[scenario.name] = result
+            print(f"{scenario.name:<62} {result['throughput']:>9} req/s  "
+                  f"p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+                  f"p99 {result['p99_ms']:>8} ms  errors {sum(result['errors'].values())}")
+    if not args.base_url:
+        await async_engine.dispose()
+    return results
+
+
+def compare(results, baseline_path: str):
+    """
+    Печатает изменение p95 и пропускной способности относительно прошлого запуска.
+
+    :param results: Результаты текущего запуска по сценариям.
+    :param baseline_path: Путь к JSON с результатами прошлого запуска.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f"\nCompared with {baseline_path}:")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before['p95_ms'] or not before['throughput']:
+            continue
+        p95 = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        rps = (result['throughput'] - before['throughput']) / before['throughput'] * 100
+        print(f"{name:<62} p95 {p95:+7.1f}%  throughput {rps:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--batteries", type=int, default=50000)
+    parser.add_argument("--attached", type=float, default=0.5,
+                        help="доля батарей, привязанных к устройствам")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="количество запросов в обычном сценарии")
+    parser.add_argument("--bulk-requests", type=int, default=20)
+    parser.add_argument("--heavy-requests", type=int, default=3,
+                        help="количество запросов дерева устройств и выгрузок")
+    parser.add_argument("--write-ratio", type=float, default=0.1,
+                        help="доля записи в смешанной нагрузке")
+    # Синхронные маршруты удерживают соединение во время сериализации ответа,
+    # поэтому без контроля допуска (ADMISSION_CONTROL=false) параллелизм выше
+    # емкости пула соединений (6 + 10) приводит к взаимной блокировке до истечения
+    # таймаута пула; с ним лишние запросы ждут в очереди допуска или получают 503.
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*",
+                        help="выполнить только сценарии, содержащие подстроку")
+    parser.add_argument("--base-url",
+                        help="адрес запущенного сервера вместо ASGI-транспорта; "
+                             "сервер должен использовать ту же базу данных")
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", help="JSON с результатами прошлого запуска")
+    parser.add_argument("--keep", action="store_true",
+                        help="не удалять тестовые данные после запуска")
+    args = parser.parse_args()
+
+    # На чистой базе SQLite схема создается по моделям; для PostgreSQL
+    # ожидается, что миграции уже применены, и вызов ничего не меняет.
+    Base.metadata.create_all(engine)
+
+    started = time.perf_counter()
+    prefix, device_ids, battery_ids = seed_volume(
+        args.devices, args.batteries, attached=args.attached
+    )
+    print(f"Seeded {args.devices} devices and {args.batteries} batteries "
+          f"in {time.perf_counter() - started:.1f} s")
+
+    state = State(
+        prefix, device_ids, battery_ids, random.Random(args.seed), args.write_ratio
+    )
+    try:
+        results = asyncio.run(run(args, state))
+    finally:
+        if not args.keep:
+            cleanup(prefix)
+        engine.dispose()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'dialect': engine.dialect.name,
+            'mode': 'async' if DB_ASYNC else 'sync',
+            'python': platform.python_version(),
+            'devices': args.devices,
+            'batteries': args.batteries,
+            'attached': args.attached,
+            'concurrency': args.concurrency,
+            'base_url': args.base_url,
+        },
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
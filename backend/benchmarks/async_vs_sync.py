@@ -0,0 +1,95 @@
+"""
+Сравнение пропускной способности синхронного и асинхронного стеков.
+
+Оба варианта обращаются к одной и той же базе данных из config.py.
+Запуск из каталога backend:
+
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.database import async_engine, engine
+from app.routers import router
+from app.routers_async import router as async_router
+from benchmarks.common import cleanup, seed
+
+
+def build_app(api_router):
+    """
+    Создает приложение с единственным набором маршрутов.
+
+    :param api_router: Синхронный или асинхронный роутер.
+    :return: Приложение FastAPI.
+    """
+    bench_app = FastAPI()
+    bench_app.include_router(api_router, prefix="/api")
+    return bench_app
+
+
+async def run(bench_app, paths, total: int, concurrency: int):
+    """
+    Выполняет запросы к приложению с заданным уровнем параллелизма.
+
+    :param bench_app: Приложение FastAPI.
+    :param paths: Список путей, которые запрашиваются по кругу.
+    :param total: Общее количество запросов.
+    :param concurrency: Количество одновременных запросов.
+    :return: Количество запросов в секунду.
+    """
+    transport = httpx.ASGITransport(app=bench_app)
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for i in counter:
+                response = await client.get(paths[i % len(paths)])
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+async def compare(paths, total: int, concurrency: int):
+    """
+    Последовательно измеряет синхронный и асинхронный стеки.
+
+    :param paths: Список путей, которые запрашиваются по кругу.
+    :param total: Общее количество запросов для каждого режима.
+    :param concurrency: Количество одновременных запросов.
+    """
+    try:
+        for mode, api_router in (("sync", router), ("async", async_router)):
+            rps = await run(build_app(api_router), paths, total, concurrency)
+            print(f"{mode:>5}: {rps:8.1f} req/s")
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    # Синхронные маршруты сериализуют ответ в пуле потоков, удерживая соединение,
+    # поэтому параллелизм выше емкости пула соединений (6 + 10) приводит
+    # к взаимной блокировке до истечения таймаута пула.
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--devices", type=int, default=100)
+    args = parser.parse_args()
+
+    prefix, device_ids = seed(args.devices, batteries_per_device=3)
+    paths = [f"/api/devices/{device_id}/" for device_id in device_ids]
+    paths.append("/api/batteries/?limit=50")
+    try:
+        asyncio.run(compare(paths, args.requests, args.concurrency))
+    finally:
+        cleanup(prefix)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Нагрузочная проверка привязки батарей при параллельных запросах.
+
+Проверяет, что лимит батарей на устройство не превышается, одна батарея
+не привязывается к двум устройствам, а счетчик battery_count совпадает
+с фактическим количеством батарей. Запуск из каталога backend:
+
+    python -m benchmarks.attach_stress --workers 32 --rounds 20
+"""
+import argparse
+import sys
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+from app.crud import (
+    MAX_BATTERIES_PER_DEVICE, attach_battery_to_device, bulk_create_batteries,
+    bulk_create_devices
+)
+from app.database import SessionLocal
+from app.exceptions import ConflictError
+from app.models import Battery, Device
+from benchmarks.common import cleanup
+
+
+def attach(battery_id: int, device_id: int):
+    """
+    Выполняет одну привязку в отдельной сессии.
+
+    :param battery_id: Идентификатор батареи.
+    :param device_id: Идентификатор устройства.
+    :return: 'ok' или имя класса исключения.
+    """
+    with SessionLocal() as db:
+        try:
+            attach_battery_to_device(db, battery_id=battery_id, device_id=device_id)
+            return 'ok'
+        except ConflictError as e:
+            return type(e).__name__
+
+
+def run_round(pool, prefix: str, index: int, workers: int):
+    """
+    Запускает параллельные привязки к одному устройству и одной батареи
+    к нескольким устройствам.
+
+    :param pool: Пул потоков.
+    :param prefix: Префикс имен тестовых объектов.
+    :param index: Номер раунда.
+    :param workers: Количество параллельных привязок.
+    :return: Список найденных нарушений.
+    """
+    with SessionLocal() as db:
+        devices = bulk_create_devices(
+            db, [f"{prefix}-r{index}-d{i}" for i in range(workers)]
+        )['items']
+        batteries = bulk_create_batteries(
+            db, [f"{prefix}-r{index}-b{i}" for i in range(workers)]
+        )['items']
+    target = devices[0]['id']
+    contested = batteries[-1]['id']
+
+    # Все батареи, кроме последней, к одному устройству.
+    cap_results = Counter(pool.map(
+        lambda battery: attach(battery['id'], target), batteries[:-1]
+    ))
+    # Последнюю батарею ко всем остальным устройствам одновременно.
+    contested_results = Counter(pool.map(
+        lambda device: attach(contested, device['id']), devices[1:]
+    ))
+
+    problems = []
+    if cap_results['ok'] != min(MAX_BATTERIES_PER_DEVICE, workers - 1):
+        problems.append(f"cap: {dict(cap_results)}")
+    if contested_results['ok'] != 1:
+        problems.append(f"contested: {dict(contested_results)}")
+    with SessionLocal() as db:
+        drift = db.execute(
+            select(Device.id, Device.battery_count, func.count(Battery.id))
+            .outerjoin(Battery, Battery.device_id == Device.id)
+            .where(Device.name.startswith(f"{prefix}-r{index}-"))
+            .group_by(Device.id, Device.battery_count)
+            .having(Device.battery_count != func.count(Battery.id))
+        ).all()
+    if drift:
+        problems.append(f"battery_count drift: {drift}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    failed = False
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for index in range(args.rounds):
+                problems = run_round(pool, prefix, index, args.workers)
+                failed = failed or bool(problems)
+                print(f"round {index}: {'FAIL ' + '; '.join(problems) if problems else 'ok'}")
+    finally:
+        cleanup(prefix)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
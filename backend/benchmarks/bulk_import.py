@@ -0,0 +1,137 @@
+"""
+Скорость и память импорта устройств и батарей из файла.
+
+Формирует во временном файле CSV или NDJSON с заданным количеством
+устройств и батарей на устройство (строка на батарею), импортирует его
+функцией import_file и выводит скорость в строках в секунду и прирост
+пикового RSS. Для сравнения те же операции для нескольких сотен строк
+выполняются по одной функциями crud (создание устройства, создание
+и привязка батареи), как при загрузке через API по объекту.
+Запуск из каталога backend:
+
+    python -m benchmarks.bulk_import --devices 20000 --batteries-per-device 5
+"""
+import argparse
+import gc
+import json
+import tempfile
+import threading
+import time
+import uuid
+
+from app.bulk_import import import_file
+from app.crud import attach_battery_to_device, create_battery, create_device
+from app.database import SessionLocal
+from benchmarks.common import cleanup
+from benchmarks.export_memory import rss_mb
+
+
+def write_file(file, prefix: str, fmt: str, devices: int, per_device: int):
+    """
+    Записывает файл импорта, не держа строки в памяти.
+
+    :param file: Двоичный файл для записи.
+    :param prefix: Префикс имен тестовых объектов.
+    :param fmt: Формат файла: 'ndjson' или 'csv'.
+    :param devices: Количество устройств.
+    :param per_device: Количество батарей на устройство.
+    :return: Количество строк с данными.
+    """
+    if fmt == 'csv':
+        file.write(b"device,battery\n")
+    rows = 0
+    for i in range(devices):
+        lines = []
+        for j in range(per_device):
+            device, battery = f"{prefix}-d{i}", f"{prefix}-b{i}-{j}"
+            if fmt == 'csv':
+                lines.append(f"{device},{battery}\n")
+            else:
+                lines.append(json.dumps({'device': device, 'battery': battery}) + "\n")
+        file.write(''.join(lines).encode())
+        rows += per_device
+    file.seek(0)
+    return rows
+
+
+def measure(call):
+    """
+    Выполняет функцию, отслеживая пиковый RSS в отдельном потоке.
+
+    :param call: Функция без аргументов.
+    :return: Результат функции, время в секундах и прирост пикового RSS в МБ.
+    """
+    gc.collect()
+    baseline = rss_mb()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.01):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        result = call()
+    finally:
+        elapsed = time.perf_counter() - started
+        done.set()
+        sampler.join()
+    return result, elapsed, max(peak[0], rss_mb()) - baseline
+
+
+def per_row(prefix: str, devices: int, per_device: int):
+    """
+    Выполняет импорт по одному объекту функциями crud.
+
+    :param prefix: Префикс имен тестовых объектов.
+    :param devices: Количество устройств.
+    :param per_device: Количество батарей на устройство.
+    """
+    with SessionLocal() as db:
+        for i in range(devices):
+            device = create_device(db, f"{prefix}-r{i}")
+            for j in range(per_device):
+                battery = create_battery(db, f"{prefix}-rb{i}-{j}")
+                attach_battery_to_device(db, battery.id, device.id)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--batteries-per-device", type=int, default=5)
+    parser.add_argument("--format", choices=['csv', 'ndjson'], default='csv')
+    parser.add_argument("--per-row-devices", type=int, default=100,
+                        help="устройств для сравнения с импортом по одному объекту")
+    args = parser.parse_args()
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    try:
+        with tempfile.TemporaryFile() as file:
+            rows = write_file(
+                file, prefix, args.format, args.devices, args.batteries_per_device
+            )
+            with SessionLocal() as db:
+                result, elapsed, growth = measure(
+                    lambda: import_file(db, file, args.format)
+                )
+        print(f"import:  {rows} rows, {result['devices_created']} devices, "
+              f"{result['batteries_created']} batteries, {result['error_count']} errors")
+        print(f"         {rows / elapsed:,.0f} rows/s ({elapsed:.2f} s), "
+              f"RSS growth {growth:.1f} MB")
+
+        rows = args.per_row_devices * args.batteries_per_device
+        _, elapsed, _ = measure(
+            lambda: per_row(prefix, args.per_row_devices, args.batteries_per_device)
+        )
+        print(f"per-row: {rows / elapsed:,.0f} rows/s ({elapsed:.2f} s for {rows} rows)")
+    finally:
+        cleanup(prefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Общие вспомогательные функции для бенчмарков.
+"""
+import uuid
+
+from sqlalchemy import insert, select, update
+
+from app.crud import MAX_BATTERIES_PER_DEVICE
+from app.database import SessionLocal
+from app.models import Battery, Device
+
+
+def seed(devices: int, batteries_per_device: int):
+    """
+    Заполняет базу тестовыми устройствами и батареями.
+
+    :param devices: Количество устройств.
+    :param batteries_per_device: Количество батарей на устройство.
+    :return: Префикс имен и список идентификаторов устройств.
+    """
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        db_devices = [
+            Device(name=f"{prefix}-d{i}", battery_count=batteries_per_device)
+            for i in range(devices)
+        ]
+        db.add_all(db_devices)
+        db.flush()
+        db.add_all(
+            Battery(name=f"{prefix}-b{d.id}-{j}", device_id=d.id)
+            for d in db_devices for j in range(batteries_per_device)
+        )
+        db.commit()
+        return prefix, [d.id for d in db_devices]
+
+
+def seed_volume(devices: int, batteries: int, attached: float = 0.5,
+                chunk_size: int = 10000):
+    """
+    Заполняет базу большим объемом тестовых данных пакетными INSERT.
+
+    Привязанные батареи распределяются по устройствам по кругу, не более
+    MAX_BATTERIES_PER_DEVICE на устройство, счетчик battery_count
+    заполняется сразу.
+
+    :param devices: Количество устройств.
+    :param batteries: Количество батарей.
+    :param attached: Доля батарей, привязанных к устройствам.
+    :param chunk_size: Количество строк в одном INSERT.
+    :return: Префикс имен, идентификаторы устройств и батарей.
+    """
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    linked = min(int(batteries * attached), devices * MAX_BATTERIES_PER_DEVICE)
+    with SessionLocal() as db:
+        for start in range(0, devices, chunk_size):
+            db.execute(insert(Device), [
+                {'name': f"{prefix}-d{i}", 'battery_count': 0}
+                for i in range(start, min(start + chunk_size, devices))
+            ])
+        device_ids = db.scalars(
+            select(Device.id).filter(Device.name.startswith(prefix)).order_by(Device.id)
+        ).all()
+        for start in range(0, batteries, chunk_size):
+            db.execute(insert(Battery), [
+                {
+                    'name': f"{prefix}-b{i}",
+                    'device_id': device_ids[i % devices] if i < linked else None
+                }
+                for i in range(start, min(start + chunk_size, batteries))
+            ])
+        if devices and linked:
+            # Первые linked % devices устройств получают на одну батарею больше.
+            per_device, extra = divmod(linked, devices)
+            rest = [Device.name.startswith(prefix)]
+            if extra:
+                db.execute(
+                    update(Device).where(*rest, Device.id <= device_ids[extra - 1])
+                    .values(battery_count=per_device + 1)
+                )
+                rest.append(Device.id > device_ids[extra - 1])
+            db.execute(update(Device).where(*rest).values(battery_count=per_device))
+        db.commit()
+        battery_ids = db.scalars(
+            select(Battery.id).filter(Battery.name.startswith(prefix)).order_by(Battery.id)
+        ).all()
+        return prefix, list(device_ids), list(battery_ids)
+
+
+def cleanup(prefix: str):
+    """
+    Удаляет тестовые данные, созданные функцией seed.
+
+    :param prefix: Префикс имен тестовых объектов.
+    """
+    with SessionLocal() as db:
+        db.query(Battery).filter(Battery.name.startswith(prefix)).delete(
+            synchronize_session=False
+        )
+        db.query(Device).filter(Device.name.startswith(prefix)).delete(
+            synchronize_session=False
+        )
+        db.commit()
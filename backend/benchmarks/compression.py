@@ -0,0 +1,113 @@
+"""
+Цена сжатия ответов в процессорном времени и сэкономленные байты.
+
+Заполняет базу устройствами с батареями, получает несжатые ответы
+GET /api/devices/ (с вложенными батареями) и GET /api/batteries/
+для нескольких значений limit и для каждого уровня gzip и качества brotli
+выводит размер сжатого тела, процессорное время сжатия одного ответа
+и время передачи, сэкономленное на канале --link-mbps. Затем те же
+запросы выполняются через CompressionMiddleware с настройками из config.py,
+и сравнивается процессорное время запроса без сжатия и со сжатием (клиент
+работает в том же процессе, поэтому в него входит и распаковка ответа).
+Запуск из каталога backend:
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.compression --sizes 10,100,1000
+"""
+import argparse
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.compression import ENCODERS, BrotliEncoder, CompressionMiddleware, GzipEncoder
+from app.database import engine
+from app.models import Base
+from app.routers import router
+from benchmarks.common import cleanup, seed_volume
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 4, 6)
+
+
+def encoders():
+    """
+    Возвращает измеряемые настройки сжатия.
+
+    :return: Список пар (название, фабрика кодировщика).
+    """
+    result = [
+        (f"gzip-{level}", lambda level=level: GzipEncoder(level)) for level in GZIP_LEVELS
+    ]
+    if 'br' in ENCODERS:
+        result += [
+            (f"br-{quality}", lambda quality=quality: BrotliEncoder(quality))
+            for quality in BROTLI_QUALITIES
+        ]
+    return result
+
+
+def cpu_per_call(call, repeat: int):
+    """
+    Измеряет среднее процессорное время вызова.
+
+    :param call: Функция без аргументов.
+    :param repeat: Количество повторов.
+    :return: Процессорное время одного вызова в миллисекундах и результат вызова.
+    """
+    result = call()
+    started = time.process_time()
+    for _ in range(repeat):
+        call()
+    return (time.process_time() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="значения limit через запятую")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--link-mbps", type=float, default=2,
+                        help="пропускная способность канала клиента, Мбит/с")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    Base.metadata.create_all(engine)
+    prefix, _, _ = seed_volume(max(sizes), 3 * max(sizes), attached=1.0)
+    bench_app = FastAPI()
+    bench_app.include_router(router, prefix="/api")
+    compressed_app = CompressionMiddleware(bench_app)
+    try:
+        with TestClient(bench_app) as client, TestClient(compressed_app) as compressed:
+            # Строки "request" - запрос целиком через middleware, cpu ms на запрос.
+            print(f"{'response':<28} {'encoding':<16} {'bytes':>10} {'ratio':>6} "
+                  f"{'cpu ms':>8} {'saved ms':>9}")
+            for path in ("/api/devices/", "/api/batteries/"):
+                for size in sizes:
+                    url = f"{path}?limit={size}"
+                    body = client.get(url, headers={'Accept-Encoding': 'identity'}).content
+                    name = f"{path} limit={size}"
+                    print(f"{name:<28} {'identity':<16} {len(body):>10}")
+                    for label, factory in encoders():
+                        cpu, data = cpu_per_call(
+                            lambda: factory().finish(body), args.repeat
+                        )
+                        saved = (len(body) - len(data)) * 8 / (args.link_mbps * 1000)
+                        print(f"{'':<28} {label:<16} {len(data):>10} "
+                              f"{len(body) / len(data):>6.1f} {cpu:>8.2f} {saved:>9.1f}")
+                    for encoding in ('identity',) + tuple(ENCODERS):
+                        headers = {'Accept-Encoding': encoding}
+                        cpu, response = cpu_per_call(
+                            lambda: compressed.get(url, headers=headers), args.repeat
+                        )
+                        length = int(response.headers.get('content-length', 0))
+                        print(f"{'':<28} {'request ' + encoding:<16} {length:>10} "
+                              f"{'':>6} {cpu:>8.2f}")
+    finally:
+        cleanup(prefix)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
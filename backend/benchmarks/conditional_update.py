@@ -0,0 +1,113 @@
+"""
+Проверка условного изменения (If-Match) вместе с Idempotency-Key.
+
+В каждом раунде создается устройство, и через API проверяется:
+- параллельные PUT с одним и тем же ETag в If-Match - ровно один 200,
+  остальные 412 с текущим представлением;
+- повтор PUT с тем же ключом и тем же If-Match получает сохраненный ответ;
+- повтор с тем же ключом, но другим If-Match (клиент получил 412 и взял
+  новый ETag, или наоборот) получает 422, а не сохраненный 412 или 200.
+
+Запуск из каталога backend:
+
+    python -m benchmarks.conditional_update --workers 8 --rounds 10
+"""
+import argparse
+import sys
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+
+from benchmarks.common import cleanup
+from main import app
+
+
+def put(client, device_id: int, name: str, etag: str, key: str = None):
+    """
+    Выполняет PUT устройства с If-Match.
+
+    :param client: Клиент приложения.
+    :param device_id: Идентификатор устройства.
+    :param name: Новое имя устройства.
+    :param etag: Значение If-Match.
+    :param key: Ключ идемпотентности или None.
+    :return: Ответ.
+    """
+    headers = {'If-Match': etag}
+    if key is not None:
+        headers['Idempotency-Key'] = key
+    return client.put(f"/api/devices/{device_id}/", json={'name': name}, headers=headers)
+
+
+def run_round(client, pool, prefix: str, index: int, workers: int):
+    """
+    Выполняет один раунд проверок.
+
+    :param client: Клиент приложения.
+    :param pool: Пул потоков.
+    :param prefix: Префикс имен тестовых объектов.
+    :param index: Номер раунда.
+    :param workers: Количество параллельных PUT.
+    :return: Список найденных нарушений.
+    """
+    name = f"{prefix}-r{index}"
+    device_id = client.post("/api/devices/", json={'name': name}).json()['id']
+    etag = client.get(f"/api/devices/{device_id}/").headers['etag']
+    problems = []
+
+    results = list(pool.map(
+        lambda i: put(client, device_id, f"{name}-w{i}", etag), range(workers)
+    ))
+    statuses = Counter(response.status_code for response in results)
+    if statuses[200] != 1 or statuses[412] != workers - 1:
+        problems.append(f"race: {dict(statuses)}")
+    current = next(r for r in results if r.status_code == 200).headers['etag']
+    if any(r.headers.get('etag') != current for r in results):
+        problems.append("412 without the current ETag")
+
+    # Устаревший ETag: 412, затем повтор с тем же ключом и новым ETag.
+    key = uuid.uuid4().hex
+    first = put(client, device_id, f"{name}-stale", etag, key)
+    retry = put(client, device_id, f"{name}-stale", first.headers['etag'], key)
+    if (first.status_code, retry.status_code) != (412, 422):
+        problems.append(f"stale then current: {first.status_code}, {retry.status_code}")
+
+    # Актуальный ETag: 200, повтор того же запроса - сохраненный ответ,
+    # повтор с другим ETag - 422.
+    key = uuid.uuid4().hex
+    first = put(client, device_id, f"{name}-ok", current, key)
+    replay = put(client, device_id, f"{name}-ok", current, key)
+    other = put(client, device_id, f"{name}-ok", etag, key)
+    if (
+        first.status_code != 200 or replay.status_code != 200
+        or replay.headers.get('idempotent-replayed') != 'true'
+    ):
+        problems.append(f"replay: {first.status_code}, {replay.status_code}")
+    if other.status_code != 422:
+        problems.append(f"current then stale: {other.status_code}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    failed = False
+    try:
+        with TestClient(app) as client, ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for index in range(args.rounds):
+                problems = run_round(client, pool, prefix, index, args.workers)
+                failed = failed or bool(problems)
+                print(f"round {index}: {'FAIL ' + '; '.join(problems) if problems else 'ok'}")
+    finally:
+        cleanup(prefix)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
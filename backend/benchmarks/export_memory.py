@@ -0,0 +1,94 @@
+"""
+Проверка того, что потоковая выгрузка не увеличивает память процесса
+пропорционально размеру таблиц.
+
+Заполняет базу из config.py батареями, выгружает их в NDJSON и CSV
+и сравнивает пиковый RSS во время выгрузки с RSS до нее.
+Запуск из каталога backend:
+
+    python -m benchmarks.export_memory --batteries 1000000 --max-growth-mb 64
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import uuid
+
+from app.crud import bulk_create_batteries
+from app.database import SessionLocal
+from app.export import stream_batteries, stream_devices
+from benchmarks.common import cleanup
+
+
+def rss_mb():
+    """
+    Возвращает текущий резидентный размер процесса (Linux).
+
+    :return: RSS в мегабайтах.
+    """
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def seed_batteries(prefix: str, total: int, chunk: int = 10000):
+    """
+    Заполняет базу батареями пачками, не держа все имена в памяти.
+
+    :param prefix: Префикс имен тестовых батарей.
+    :param total: Количество батарей.
+    :param chunk: Размер одной пачки.
+    """
+    for start in range(0, total, chunk):
+        with SessionLocal() as db:
+            bulk_create_batteries(db, [
+                f"{prefix}-b{i}" for i in range(start, min(start + chunk, total))
+            ])
+
+
+def measure(stream):
+    """
+    Полностью вычитывает выгрузку, отслеживая пиковый RSS.
+
+    :param stream: Генератор фрагментов ответа.
+    :return: Объем выгрузки в байтах, пиковый RSS и время в секундах.
+    """
+    size, peak = 0, rss_mb()
+    started = time.perf_counter()
+    for chunk in stream:
+        size += len(chunk)
+        peak = max(peak, rss_mb())
+    return size, peak, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batteries", type=int, default=200000)
+    parser.add_argument("--max-growth-mb", type=float, default=64)
+    args = parser.parse_args()
+
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    seed_batteries(prefix, args.batteries)
+    failed = False
+    try:
+        for name, stream in (
+            ("batteries.ndjson", lambda: stream_batteries('ndjson')),
+            ("batteries.csv", lambda: stream_batteries('csv')),
+            ("devices.ndjson", lambda: stream_devices('ndjson')),
+        ):
+            gc.collect()
+            baseline = rss_mb()
+            size, peak, elapsed = measure(stream())
+            growth = peak - baseline
+            status = "ok" if growth <= args.max_growth_mb else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"{status:>4} {name:<17} {size / 2 ** 20:8.1f} MB in {elapsed:6.2f}s, "
+                  f"RSS growth {growth:6.1f} MB (limit {args.max_growth_mb} MB)")
+    finally:
+        cleanup(prefix)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Задержки при перегрузке с контролем допуска и без него.
+
+Запросы чтения (и, с --write-ratio, изменения) отправляются с частотой выше
+пропускной способности API. Без контроля допуска запросы ждут соединение
+в пуле, и задержка растет у всех маршрутов; с AdmissionMiddleware
+лишние запросы ждут в ограниченной очереди или сразу получают 503,
+а p99 допущенных запросов остается ограниченной. Клиент работает в одном
+процессе с приложением, поэтому при частоте намного выше пропускной способности
+формирование ответов 503 отнимает у приложения часть процессорного времени.
+Запуск из каталога backend:
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.overload --rate 1500
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.admission import AdmissionMiddleware
+from app.database import async_engine, engine
+from app.models import Base
+from app.routers import router
+from app.routers_async import router as async_router
+from benchmarks.api_load import percentile
+from benchmarks.common import cleanup, seed
+from config import DB_ASYNC
+
+
+def build_app(admission: bool, queue_timeout: float):
+    """
+    Создает приложение с маршрутами /api и, при необходимости, контролем допуска.
+
+    :param admission: Подключить AdmissionMiddleware.
+    :param queue_timeout: Максимальное время ожидания в очереди допуска (сек).
+    :return: Приложение FastAPI.
+    """
+    bench_app = FastAPI()
+    bench_app.include_router(async_router if DB_ASYNC else router, prefix="/api")
+    if admission:
+        bench_app.add_middleware(AdmissionMiddleware, timeout=queue_timeout)
+    return bench_app
+
+
+async def run(bench_app, device_ids, args):
+    """
+    Отправляет запросы с постоянной частотой, не дожидаясь ответов на предыдущие.
+
+    Частота не зависит от скорости ответов (открытая модель нагрузки), поэтому
+    при частоте выше пропускной способности количество одновременных запросов
+    растет, как при реальном всплеске трафика.
+
+    :param bench_app: Приложение FastAPI.
+    :param device_ids: Идентификаторы тестовых устройств.
+    :param args: Аргументы командной строки.
+    :return: Словарь с количеством успешных ответов, перцентилями задержки (мс)
+        неотклоненных запросов, включая ошибки и истекшие по сроку, количеством
+        ответов 503 и ошибок.
+    """
+    transport = httpx.ASGITransport(app=bench_app, raise_app_exceptions=False)
+    rng = random.Random(args.seed)
+    served, shed, errors = [], [], {}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None, limits=limits
+    ) as client:
+        async def request(i: int):
+            device_id = rng.choice(device_ids)
+            if rng.random() < args.write_ratio:
+                call = client.put(
+                    f"/api/devices/{device_id}/", json={'name': f"{args.prefix}-u{i}"}
+                )
+            else:
+                call = client.get(f"/api/devices/{device_id}/")
+            started = time.perf_counter()
+            try:
+                status = (await asyncio.wait_for(call, args.deadline)).status_code
+            except asyncio.TimeoutError:
+                status = 'timeout'
+            elapsed = (time.perf_counter() - started) * 1000
+            if status == 503:
+                shed.append(elapsed)
+                return
+            served.append(elapsed)
+            if status == 'timeout' or status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+
+        tasks = []
+        started = time.perf_counter()
+        for i in range(args.requests):
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(request(i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    served.sort()
+    shed.sort()
+    ok = len(served) - sum(errors.values())
+    return {
+        'ok': ok,
+        'ok_per_second': round(ok / elapsed, 1),
+        'p50_ms': percentile(served, 50),
+        'p99_ms': percentile(served, 99),
+        'max_ms': served[-1] if served else None,
+        'shed': len(shed),
+        'shed_p99_ms': percentile(shed, 99),
+        'errors': errors,
+    }
+
+
+def _ms(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+async def compare(device_ids, args):
+    """
+    Последовательно нагружает приложение с контролем допуска и без него.
+
+    Без контроля допуска синхронные маршруты могут остаться заблокированными
+    до истечения таймаута пула и после завершения нагрузки, поэтому этот
+    вариант выполняется вторым.
+
+    :param device_ids: Идентификаторы тестовых устройств.
+    :param args: Аргументы командной строки.
+    """
+    modes = [('admission', True)]
+    if not args.skip_baseline:
+        modes.append(('no admission', False))
+    try:
+        for mode, admission in modes:
+            result = await run(build_app(admission, args.queue_timeout), device_ids, args)
+            errors = sum(result['errors'].values())
+            print(f"{mode:>12}: ok {result['ok']:>6} ({result['ok_per_second']} /s)  "
+                  f"p50 {_ms(result['p50_ms'])} ms  p99 {_ms(result['p99_ms'])} ms  "
+                  f"max {_ms(result['max_ms'])} ms  503 {result['shed']} "
+                  f"(p99 {_ms(result['shed_p99_ms'])} ms)  errors {errors}")
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=3000)
+    # Без контроля допуска синхронные маршруты при количестве одновременных
+    # запросов выше емкости пула соединений (6 + 10) ждут соединение
+    # до истечения таймаута пула.
+    parser.add_argument("--rate", type=float, default=1500,
+                        help="частота запросов в секунду")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--write-ratio", type=float, default=0.0,
+                        help="доля изменяющих запросов")
+    parser.add_argument("--queue-timeout", type=float, default=0.2,
+                        help="максимальное время ожидания в очереди допуска (сек)")
+    parser.add_argument("--deadline", type=float, default=5,
+                        help="время (сек), после которого клиент перестает ждать ответ")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-baseline", action="store_true",
+                        help="не запускать нагрузку без контроля допуска")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    args.prefix, device_ids = seed(args.devices, batteries_per_device=3)
+    try:
+        asyncio.run(compare(device_ids, args))
+    finally:
+        cleanup(args.prefix)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Проверка количества SQL-запросов на один HTTP-запрос к маршрутам устройств.
+
+Количество запросов не должно зависеть от числа устройств на странице
+(отсутствие N+1). Запуск из каталога backend:
+
+    python -m benchmarks.query_count
+"""
+import sys
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.common import cleanup, seed
+from main import app
+
+# Маршрут -> максимально допустимое количество SQL-запросов.
+EXPECTED = {
+    "/api/devices/?limit={n}": 2,
+    "/api/devices/?limit={n}&pagination=cursor": 2,
+    "/api/devices/{device_id}/": 1,
+    "/api/devices/tree": 1,
+}
+
+
+@contextmanager
+def count_queries():
+    """
+    Считает SQL-запросы, выполненные любым движком внутри блока.
+
+    :yield: Список, в который добавляются тексты выполненных запросов.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main():
+    failed = False
+    # Один цикл событий на все запросы: соединения asyncpg привязаны к нему.
+    with TestClient(app) as client:
+        for devices in (5, 50):
+            failed = check(client, devices) or failed
+    sys.exit(1 if failed else 0)
+
+
+def check(client, devices: int):
+    """
+    Проверяет количество запросов для страницы заданного размера.
+
+    :param client: Тестовый клиент приложения.
+    :param devices: Количество устройств в тестовых данных.
+    :return: True, если хотя бы один маршрут превысил бюджет запросов.
+    """
+    failed = False
+    prefix, device_ids = seed(devices, batteries_per_device=3)
+    try:
+        for template, expected in EXPECTED.items():
+            path = template.format(n=devices, device_id=device_ids[0])
+            with count_queries() as statements:
+                client.get(path).raise_for_status()
+            status = "ok" if len(statements) <= expected else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"{status:>4} {len(statements):3d} queries "
+                  f"(expected <= {expected}) {path}")
+    finally:
+        cleanup(prefix)
+    return failed
+
+
+if __name__ == "__main__":
+    main()
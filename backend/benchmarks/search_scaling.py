@@ -0,0 +1,127 @@
+"""
+Проверка, что время поиска по имени не растет вместе с таблицами.
+
+База последовательно дополняется батареями и устройствами до каждого
+из заданных объемов. На каждом шаге измеряется медианное время поиска
+по префиксу и по подстроке имени. Проверка не проходит, если медиана
+на самом большом объеме превышает медиану на самом малом больше чем
+в --max-ratio раз. На PostgreSQL ожидается примененная миграция
+с триграммными индексами. Запуск из каталога backend:
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.search_scaling \\
+        --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from app.crud import search_batteries, search_devices
+from app.database import SessionLocal, engine
+from app.models import Base
+from app.search import name_index
+from benchmarks.common import cleanup, seed_volume
+
+# Во сколько раз батарей больше, чем устройств.
+BATTERIES_PER_DEVICE = 5
+
+
+def measure(search, queries):
+    """
+    Измеряет медианное время поиска.
+
+    :param search: Функция crud поиска.
+    :param queries: Строки поиска.
+    :return: Медианное время одного поиска в миллисекундах.
+    """
+    timings = []
+    with SessionLocal() as db:
+        for query in queries:
+            started = time.perf_counter()
+            if not search(db, query, limit=20):
+                raise AssertionError(f"Nothing found for {query!r}")
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def queries_for(prefix: str, kind: str, letter: str, count: int, samples: int, rng):
+    """
+    Формирует строки поиска по именам, созданным seed_volume.
+
+    Номера берутся из верхних 90% диапазона, поэтому число совпадений
+    не зависит от объема: подстрока из середины имени находит одну запись,
+    имя без последней цифры - не более одиннадцати.
+
+    :param prefix: Префикс имен шага заполнения.
+    :param kind: 'prefix' - начало имени, 'substring' - фрагмент из середины.
+    :param letter: Буква сущности в имени: 'b' или 'd'.
+    :param count: Количество записей сущности, созданных на шаге.
+    :param samples: Количество строк поиска.
+    :param rng: Генератор случайных чисел.
+    :return: Список строк поиска.
+    """
+    queries = []
+    for _ in range(samples):
+        name = f"{prefix}-{letter}{rng.randrange(count // 10, count)}"
+        queries.append(name[:-1] if kind == 'prefix' else name[len('bench-'):])
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000],
+                        help="объемы таблицы батарей по возрастанию")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--max-ratio", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    rng = random.Random(args.seed)
+    prefixes = []
+    medians = {}
+    seeded = 0
+    try:
+        for size in args.sizes:
+            batteries = size - seeded
+            devices = batteries // BATTERIES_PER_DEVICE
+            prefix, _, _ = seed_volume(devices, batteries, attached=0)
+            prefixes.append(prefix)
+            seeded = size
+            # seed_volume пишет в базу в обход crud: индекс в памяти перестраивается.
+            name_index('devices').reset()
+            name_index('batteries').reset()
+
+            for label, search, letter, count in (
+                ('batteries', search_batteries, 'b', batteries),
+                ('devices', search_devices, 'd', devices),
+            ):
+                for kind in ('prefix', 'substring'):
+                    queries = queries_for(
+                        prefix, kind, letter, count, args.samples, rng
+                    )
+                    measure(search, queries[:1])  # загрузка индекса на SQLite
+                    median = measure(search, queries)
+                    medians.setdefault((label, kind), []).append(median)
+                    print(f"{size:>9} batteries {label:>9} {kind:>9}: "
+                          f"{median:8.3f} ms median")
+    finally:
+        for prefix in prefixes:
+            cleanup(prefix)
+        engine.dispose()
+
+    failed = False
+    for (label, kind), values in medians.items():
+        ratio = values[-1] / values[0] if values[0] else float('inf')
+        status = "ok" if ratio <= args.max_ratio else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"{status:>4} {label} {kind}: x{ratio:.2f} from smallest to largest "
+              f"(allowed x{args.max_ratio})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Микробенчмарк сериализации списков устройств и батарей.
+
+Сравнивается процессорное время на один ответ из --rows строк в обычном
+режиме (ORM-объекты, валидация и сериализация через схемы pydantic)
+и в режиме FAST_JSON (словари из строк запроса, кодирование orjson).
+FAST_JSON читается при импорте приложения, поэтому каждый режим
+измеряется в отдельном процессе. Запросы выполняются в процессе через
+TestClient: учитывается время обработчика, сериализации и драйвера базы
+данных. Тела ответов обоих режимов сравниваются. Запуск из каталога backend:
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.serialization --rows 10000
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from app.database import engine
+from app.models import Base
+from benchmarks.common import cleanup, seed_volume
+
+MODES = ('false', 'true')
+
+
+def paths(rows: int):
+    """
+    Возвращает измеряемые маршруты.
+
+    :param rows: Количество строк в ответе.
+    :return: Список путей запросов.
+    """
+    return [f"/api/devices/?limit={rows}", f"/api/batteries/?limit={rows}"]
+
+
+def digest(body: bytes):
+    """
+    Вычисляет хеш тела ответа без учета форматирования и порядка батарей.
+
+    :param body: Тело ответа.
+    :return: Хеш нормализованного JSON.
+    """
+    items = json.loads(body)
+    for item in items:
+        if 'batteries' in item:
+            item['batteries'].sort(key=lambda battery: battery['id'])
+    return hashlib.sha1(json.dumps(items, sort_keys=True).encode()).hexdigest()
+
+
+def worker(rows: int, repeats: int):
+    """
+    Измеряет ответы в режиме, заданном переменной окружения FAST_JSON.
+
+    Результат печатается одной строкой JSON.
+
+    :param rows: Количество строк в ответе.
+    :param repeats: Количество измеряемых запросов на маршрут.
+    """
+    from fastapi.testclient import TestClient
+    from main import app
+
+    results = {}
+    with TestClient(app) as client:
+        for path in paths(rows):
+            response = client.get(path)  # прогрев
+            response.raise_for_status()
+            cpu, wall = [], []
+            for _ in range(repeats):
+                started_cpu, started = time.process_time(), time.perf_counter()
+                client.get(path).raise_for_status()
+                cpu.append((time.process_time() - started_cpu) * 1000)
+                wall.append((time.perf_counter() - started) * 1000)
+            results[path] = {
+                'rows': len(response.json()),
+                'bytes': len(response.content),
+                'digest': digest(response.content),
+                'cpu_ms': statistics.median(cpu),
+                'wall_ms': statistics.median(wall),
+            }
+    print(json.dumps(results))
+
+
+def run_mode(mode: str, rows: int, repeats: int):
+    """
+    Запускает измерение одного режима в отдельном процессе.
+
+    :param mode: Значение FAST_JSON.
+    :param rows: Количество строк в ответе.
+    :param repeats: Количество измеряемых запросов на маршрут.
+    :return: Результаты измерения по маршрутам.
+    """
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.serialization', '--worker',
+         '--rows', str(rows), '--repeats', str(repeats)],
+        env={**os.environ, 'FAST_JSON': mode},
+        stdout=subprocess.PIPE, check=True
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--keep", action="store_true",
+                        help="не удалять созданные данные")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.rows, args.repeats)
+        return
+
+    Base.metadata.create_all(engine)
+    prefix, _, _ = seed_volume(args.rows, args.rows * 2, attached=0.5)
+    try:
+        results = {mode: run_mode(mode, args.rows, args.repeats) for mode in MODES}
+    finally:
+        if not args.keep:
+            cleanup(prefix)
+        engine.dispose()
+
+    failed = False
+    for path in paths(args.rows):
+        slow, fast = results['false'][path], results['true'][path]
+        same = slow['digest'] == fast['digest']
+        failed = failed or not same
+        print(f"{path:<32} {slow['rows']:>6} rows {slow['bytes'] / 1024:8.0f} KiB")
+        for mode, result in (('pydantic', slow), ('fast_json', fast)):
+            print(f"  {mode:<10} cpu {result['cpu_ms']:9.2f} ms  "
+                  f"wall {result['wall_ms']:9.2f} ms")
+        print(f"  cpu x{slow['cpu_ms'] / fast['cpu_ms']:.2f} faster, "
+              f"bodies {'identical' if same else 'DIFFER'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Пропускная способность приема телеметрии батарей.
+
+Пачки показаний (по умолчанию 5000 в запросе) отправляются параллельно
+в POST /api/batteries/telemetry, затем бенчмарк ждет, пока фоновая запись
+сохранит все принятые показания. Выводится скорость приема запросов
+и скорость сквозной записи в базу данных (цель - не менее 50 000 показаний
+в секунду), после чего проверяется, что агрегаты учли каждое показание.
+Затем столько же показаний записывается напрямую через TelemetryWriter:
+это пропускная способность записи в базу данных без разбора запросов.
+Клиент, приложение и база данных делят процессоры одной машины, поэтому
+на одном ядре сквозная скорость ограничена их суммарной нагрузкой.
+Запуск из каталога backend:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.telemetry_ingest
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import delete, func, select
+
+from app.database import SessionLocal, engine
+from app.models import Base, Battery, BatteryReading, BatteryReadingHour, BatteryReadingMinute
+from app.routers import router
+from app.telemetry import TelemetryBuffer, TelemetryWriter, set_buffer
+from benchmarks.common import cleanup, seed
+from config import TELEMETRY_FLUSH_ROWS
+
+TARGET = 50000
+
+
+def build_rows(battery_ids, readings: int, start_ms: int):
+    """
+    Формирует показания: каждая батарея отправляет показание раз в секунду.
+
+    :param battery_ids: Идентификаторы батарей.
+    :param readings: Общее количество показаний.
+    :param start_ms: Время первого показания в миллисекундах Unix.
+    :return: Кортежи (battery_id, ts, voltage, soc, temperature).
+    """
+    return [
+        (
+            battery_ids[i % len(battery_ids)], start_ms + i // len(battery_ids) * 1000,
+            3.6 + (i % 60) / 100, i % 101, 20 + i % 15
+        )
+        for i in range(readings)
+    ]
+
+
+def build_batches(battery_ids, readings: int, batch_size: int, start_ms: int):
+    """
+    Формирует тела запросов с показаниями.
+
+    Каждая батарея отправляет показание раз в секунду, время показаний
+    уникально для батареи, поэтому повторов нет. Тела кодируются заранее,
+    чтобы клиент не отнимал время у приложения.
+
+    :param battery_ids: Идентификаторы батарей.
+    :param readings: Общее количество показаний.
+    :param batch_size: Количество показаний в одном запросе.
+    :param start_ms: Время первого показания в миллисекундах Unix.
+    :return: Список тел запросов в JSON.
+    """
+    items = [
+        {
+            'battery_id': battery_id,
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts // 1000)),
+            'voltage': voltage, 'soc': soc, 'temperature': temperature,
+        }
+        for battery_id, ts, voltage, soc, temperature
+        in build_rows(battery_ids, readings, start_ms)
+    ]
+    return [
+        json.dumps(items[start:start + batch_size]).encode()
+        for start in range(0, readings, batch_size)
+    ]
+
+
+async def send(batches, concurrency: int):
+    """
+    Отправляет пачки показаний несколькими параллельными клиентами.
+
+    :param batches: Тела запросов в JSON.
+    :param concurrency: Количество одновременных запросов.
+    :return: Словарь с количеством ответов по кодам статуса.
+    """
+    bench_app = FastAPI()
+    bench_app.include_router(router, prefix="/api")
+    transport = httpx.ASGITransport(app=bench_app)
+    statuses = {}
+    queue = list(reversed(batches))
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        async def worker():
+            while queue:
+                body = queue.pop()
+                while True:
+                    response = await client.post(
+                        "/api/batteries/telemetry", content=body,
+                        headers={'Content-Type': 'application/json'}
+                    )
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code != 503:
+                        break
+                    # Очередь записи заполнена: повтор после Retry-After.
+                    await asyncio.sleep(float(response.headers.get('Retry-After', 1)) / 10)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--readings", type=int, default=500000)
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="количество показаний в одном запросе")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--flush-rows", type=int, default=TELEMETRY_FLUSH_ROWS,
+                        help="максимальное количество показаний в одной записи")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(engine)
+    prefix, _ = seed(args.devices, batteries_per_device=3)
+    with SessionLocal() as db:
+        battery_ids = db.scalars(
+            select(Battery.id).filter(Battery.name.startswith(prefix)).order_by(Battery.id)
+        ).all()
+    # Показания начинаются раньше текущего времени настолько, чтобы последние
+    # не опережали его.
+    ticks = -(-args.readings // len(battery_ids))
+    start_ms = (int(time.time()) - ticks - 1) * 1000
+    batches = build_batches(battery_ids, args.readings, args.batch_size, start_ms)
+
+    buffer = TelemetryBuffer(
+        TelemetryWriter(engine), max_size=4 * args.flush_rows,
+        flush_rows=args.flush_rows
+    )
+    set_buffer(buffer)
+    try:
+        started = time.perf_counter()
+        statuses = asyncio.run(send(batches, args.concurrency))
+        accepted = time.perf_counter() - started
+        buffer.flush()
+        stored = time.perf_counter() - started
+
+        with SessionLocal() as db:
+            raw = db.scalar(
+                select(func.count()).select_from(BatteryReading)
+                .where(BatteryReading.battery_id.in_(battery_ids))
+            )
+            rollups = [
+                db.scalar(select(func.sum(model.count)).where(model.battery_id.in_(battery_ids)))
+                for model in (BatteryReadingMinute, BatteryReadingHour)
+            ]
+        rate = args.readings / stored
+        print(f"requests: {statuses}")
+        print(f"accepted: {args.readings / accepted:,.0f} readings/s ({accepted:.2f} s)")
+        print(f"stored:   {rate:,.0f} readings/s ({stored:.2f} s), "
+              f"target {TARGET:,} - {'ok' if rate >= TARGET else 'below target'}")
+        print(f"rows: raw {raw}, 1m count {rollups[0]}, 1h count {rollups[1]}, "
+              f"expected {args.readings}")
+
+        # Показания через полсекунды после отправленных: времена не повторяются.
+        rows = build_rows(battery_ids, args.readings, start_ms + 500)
+        writer = TelemetryWriter(engine)
+        started = time.perf_counter()
+        for start in range(0, len(rows), args.flush_rows):
+            writer.write(rows[start:start + args.flush_rows])
+        written = time.perf_counter() - started
+        print(f"writer:   {args.readings / written:,.0f} readings/s ({written:.2f} s)")
+    finally:
+        with SessionLocal() as db:
+            for model in (BatteryReading, BatteryReadingMinute, BatteryReadingHour):
+                db.execute(delete(model).where(model.battery_id.in_(battery_ids)))
+            db.commit()
+        cleanup(prefix)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,3 +8,127 @@ DB_PORT = os.environ.get("DB_PORT")
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER = os.environ.get("DB_USER")
 DB_PASS = os.environ.get("DB_PASS")
+
+# Строки подключения к базе данных. По умолчанию собираются из DB_* для PostgreSQL,
+# но могут быть заданы явно, например sqlite:///bench.db для бенчмарков.
+# Асинхронная строка по умолчанию получается из синхронной заменой драйвера.
+DATABASE_URL = os.environ.get("DATABASE_URL") or (
+    f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+
+
+def _async_url(url):
+    return (
+        url
+        .replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+        .replace("sqlite://", "sqlite+aiosqlite://", 1)
+    )
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Реплики для чтения: строки подключения через запятую. Без них все запросы
+# выполняются на основном сервере.
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+ASYNC_DATABASE_REPLICA_URLS = [_async_url(url) for url in DATABASE_REPLICA_URLS]
+
+# Окно после записи (сек), в течение которого клиент читает с основного сервера;
+# допустимое отставание реплики (сек) и интервал проверки реплик (сек).
+REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 2))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", 5))
+# Ограничение времени подключения к реплике и запроса ее отставания (сек).
+REPLICA_CHECK_TIMEOUT = float(os.environ.get("REPLICA_CHECK_TIMEOUT", 2))
+
+# Использовать асинхронный стек (AsyncEngine + AsyncSession) вместо синхронного.
+DB_ASYNC = os.environ.get("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# Кеш чтения устройств и батарей: максимальное количество записей и время жизни (сек).
+CACHE_MAX_SIZE = int(os.environ.get("CACHE_MAX_SIZE", 10000))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 30))
+
+# Быстрая сериализация списков устройств и батарей: строки выбираются без ORM-объектов
+# и кодируются orjson без повторной валидации через схемы pydantic.
+FAST_JSON = os.environ.get("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+# Лента изменений /api/changes: рассылка событий ('memory' - в памяти процесса,
+# 'postgres' - между процессами через LISTEN/NOTIFY), количество последних событий
+# для возобновления по Last-Event-ID, очередь событий одного клиента
+# и интервал keep-alive (сек).
+CHANGES_BACKEND = os.environ.get("CHANGES_BACKEND", "memory")
+CHANGES_BUFFER_SIZE = int(os.environ.get("CHANGES_BUFFER_SIZE", 1000))
+CHANGES_QUEUE_SIZE = int(os.environ.get("CHANGES_QUEUE_SIZE", 1000))
+CHANGES_KEEPALIVE = float(os.environ.get("CHANGES_KEEPALIVE", 15))
+
+# Журнал SQL-запросов: доля случайно выбранных запросов (0 - не выбирать), порог
+# медленного запроса в мс (0 - не выделять), который записывается с параметрами,
+# и размер очереди записей. Записи форматируются и выводятся фоновым потоком;
+# при переполнении очереди они отбрасываются. SQL_ECHO включает вывод каждого
+# запроса движком SQLAlchemy (только для отладки: вывод синхронный).
+SQL_LOG_SAMPLE_RATE = float(os.environ.get("SQL_LOG_SAMPLE_RATE", 0.01))
+SQL_LOG_SLOW_MS = float(os.environ.get("SQL_LOG_SLOW_MS", 200))
+SQL_LOG_QUEUE_SIZE = int(os.environ.get("SQL_LOG_QUEUE_SIZE", 10000))
+SQL_ECHO = os.environ.get("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+
+# Пул соединений каждого движка: постоянные соединения и дополнительные сверх них.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 6))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+
+# Контроль допуска запросов к /api: одновременно выполняется не больше запросов
+# каждого класса (чтение и запись), чем соединений отведено ему в пуле; по умолчанию
+# четверть емкости пула отводится записи, остальное - чтению. Лишние запросы ждут
+# в очереди не дольше ADMISSION_QUEUE_TIMEOUT сек (0 - сразу отклоняются), при полной
+# очереди или по истечении ожидания получают 503 с Retry-After (сек).
+_POOL_CAPACITY = DB_POOL_SIZE + DB_MAX_OVERFLOW
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_WRITE_LIMIT = int(
+    os.environ.get("ADMISSION_WRITE_LIMIT", max(1, _POOL_CAPACITY // 4))
+)
+ADMISSION_READ_LIMIT = int(
+    os.environ.get("ADMISSION_READ_LIMIT", max(1, _POOL_CAPACITY - ADMISSION_WRITE_LIMIT))
+)
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 4 * _POOL_CAPACITY))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 1))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+
+# Ключи идемпотентности (Idempotency-Key): максимальное количество сохраненных ответов,
+# время их хранения (сек) и время (сек), на которое ключ занят выполняемым запросом.
+IDEMPOTENCY_MAX_SIZE = int(os.environ.get("IDEMPOTENCY_MAX_SIZE", 10000))
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_PENDING_TTL = float(os.environ.get("IDEMPOTENCY_PENDING_TTL", 60))
+
+# Телеметрия батарей: максимум показаний в одном запросе, емкость буфера записи
+# (показаний; при заполнении прием отвечает 503), размер пачки одной записи в базу,
+# интервал сброса буфера (сек), срок хранения показаний (сут; более старые не
+# принимаются и удаляются, 0 - хранить всегда) и допустимое опережение часов
+# устройства (сек).
+TELEMETRY_MAX_BATCH = int(os.environ.get("TELEMETRY_MAX_BATCH", 10000))
+TELEMETRY_BUFFER_SIZE = int(os.environ.get("TELEMETRY_BUFFER_SIZE", 200000))
+TELEMETRY_FLUSH_ROWS = int(os.environ.get("TELEMETRY_FLUSH_ROWS", 50000))
+TELEMETRY_FLUSH_INTERVAL = float(os.environ.get("TELEMETRY_FLUSH_INTERVAL", 1))
+TELEMETRY_RETENTION_DAYS = int(os.environ.get("TELEMETRY_RETENTION_DAYS", 30))
+TELEMETRY_MAX_CLOCK_SKEW = float(os.environ.get("TELEMETRY_MAX_CLOCK_SKEW", 300))
+
+# Статистика парка (GET /api/stats/fleet): количество строк (шардов) на счетчик
+# и интервал (сек) пересчета счетчиков по таблицам с исправлением расхождений
+# (0 - не пересчитывать).
+FLEET_STATS_SHARDS = int(os.environ.get("FLEET_STATS_SHARDS", 8))
+FLEET_STATS_RECONCILE_INTERVAL = float(os.environ.get("FLEET_STATS_RECONCILE_INTERVAL", 300))
+
+# Импорт устройств и батарей из файла (POST /api/import): количество строк файла,
+# загружаемых в промежуточную таблицу одной пачкой, и максимальное количество
+# ошибок по строкам в ответе (остальные только подсчитываются).
+IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", 10000))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", 1000))
+
+# Сжатие ответов (gzip или brotli по Accept-Encoding): минимальный размер тела (байт),
+# начиная с которого ответ сжимается (потоковые ответы без Content-Length сжимаются
+# всегда), уровень gzip (1-9) и качество brotli (0-11). Brotli используется, если
+# установлен пакет Brotli.
+COMPRESSION = os.environ.get("COMPRESSION", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
@@ -1,20 +1,92 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from app.admission import AdmissionMiddleware
+from app.compression import CompressionMiddleware
+from app.database import engine
+from app.idempotency import IdempotencyMiddleware
+from app.metrics import MetricsMiddleware, metrics_response
+from app.replicas import ReadRoutingMiddleware
 from app.routers import router
+from app.routers_async import router as async_router
+from app.stats import FleetReconciler
+from config import (
+    ADMISSION_CONTROL, COMPRESSION, DATABASE_REPLICA_URLS, DB_ASYNC,
+    FLEET_STATS_RECONCILE_INTERVAL
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Счетчики статистики парка пересчитываются по таблицам в фоне.
+    reconciler = None
+    if FLEET_STATS_RECONCILE_INTERVAL > 0:
+        reconciler = FleetReconciler(engine)
+        reconciler.start()
+    yield
+    if reconciler is not None:
+        reconciler.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
 ]
 
+# Добавляется первым и оказывается внутри остальных middleware: отклоненные
+# запросы получают заголовки CORS и учитываются в метриках.
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
+
+# Повторы с ключом идемпотентности получают сохраненный ответ до контроля
+# допуска, не занимая место в лимите запросов к базе данных.
+app.add_middleware(IdempotencyMiddleware, router=app.router)
+
+# Сжимает ответы, в том числе сохраненные для повторов с ключом идемпотентности,
+# которые хранятся несжатыми.
+if COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "ETag", "Idempotent-Replayed", "Retry-After", "Server-Timing", "X-Missing-Ids"
+    ],
 )
 
-app.include_router(router, prefix="/api")
+app.add_middleware(MetricsMiddleware)
+
+if DATABASE_REPLICA_URLS:
+    app.add_middleware(ReadRoutingMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+
+def _route_key(route):
+    return route.path, frozenset(getattr(route, "methods", None) or ())
+
+
+if DB_ASYNC:
+    # Асинхронные версии маршрутов заменяют синхронные,
+    # маршруты без асинхронной версии обслуживаются синхронным стеком.
+    overridden = {_route_key(route) for route in async_router.routes}
+    app.include_router(async_router, prefix="/api")
+    app.include_router(
+        APIRouter(routes=[
+            route for route in router.routes
+            if _route_key(route) not in overridden
+        ]),
+        prefix="/api"
+    )
+else:
+    app.include_router(router, prefix="/api")
@@ -9,7 +9,10 @@ const AttachBatteryForm = ({ device_id }) => {
   useEffect(() => {
     const fetchBatteries = async () => {
       try {
-        const response = await axios.get('http://localhost:8000/api/batteries/');
+        // Только свободные аккумуляторы: фильтр выполняется на сервере по индексу.
+        const response = await axios.get('http://localhost:8000/api/batteries/', {
+          params: { attached: false, limit: 100 },
+        });
         setBatteries(response.data);
       } catch (error) {
         console.error('Ошибка при загрузке аккумуляторов:', error);
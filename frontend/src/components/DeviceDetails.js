@@ -63,6 +63,56 @@ const DeviceDetails = () => {
     }
   }, [id]);
 
+  useEffect(() => {
+    if (!id) {
+      return undefined;
+    }
+    // Изменения устройства и его аккумуляторов приходят из ленты /api/changes,
+    // поэтому после правок данные не загружаются заново. EventSource сам
+    // переподключается с Last-Event-ID; событие reset означает, что пропущенные
+    // изменения недоступны и данные нужно загрузить целиком.
+    const source = new EventSource(
+      `http://localhost:8000/api/changes?device_id=${id}`,
+      { withCredentials: true }
+    );
+    source.addEventListener('change', (event) => applyChange(JSON.parse(event.data)));
+    source.addEventListener('reset', () => {
+      fetchDevice();
+      fetchBatteries();
+    });
+    return () => source.close();
+  }, [id]);
+
+  const applyChange = ({ entity, action, item }) => {
+    if (entity === 'device') {
+      if (action === 'deleted') {
+        navigate('/devices/');
+      } else {
+        setDevice((current) => current && { ...current, name: item.name });
+      }
+      return;
+    }
+    if (action === 'attached') {
+      setBatteries((current) => current.filter((battery) => battery.id !== item.id));
+    }
+    setDevice((current) => {
+      if (!current) {
+        return current;
+      }
+      const others = current.batteries.filter((battery) => battery.id !== item.id);
+      if (action === 'deleted') {
+        return { ...current, batteries: others };
+      }
+      const known = others.length < current.batteries.length;
+      const batteries = known
+        ? current.batteries.map((battery) => (
+          battery.id === item.id ? { ...battery, name: item.name } : battery
+        ))
+        : [...current.batteries, { id: item.id, name: item.name }];
+      return { ...current, batteries };
+    });
+  };
+
   const fetchDevice = async () => {
     try {
       const response = await axios.get(`http://localhost:8000/api/devices/${id}/`);
@@ -75,7 +125,10 @@ const DeviceDetails = () => {
 
   const fetchBatteries = async () => {
     try {
-      const response = await axios.get('http://localhost:8000/api/batteries/');
+      // Только свободные аккумуляторы: фильтр выполняется на сервере по индексу.
+      const response = await axios.get('http://localhost:8000/api/batteries/', {
+        params: { attached: false, limit: 100 },
+      });
       setBatteries(response.data);
     } catch (error) {
       console.error('Ошибка при загрузке аккумуляторов:', error);
@@ -94,7 +147,6 @@ const DeviceDetails = () => {
   };
 
   const handleSave = () => {
-    fetchDevice();
     setIsEditing(false);
   };
 
@@ -106,7 +158,6 @@ const DeviceDetails = () => {
 
     try {
       await axios.post(`http://localhost:8000/api/devices/${id}/batteries/${selectedBattery}/attach`);
-      fetchDevice();
       setSelectedBattery('');
       setError('');
     } catch (error) {
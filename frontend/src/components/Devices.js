@@ -39,7 +39,10 @@ const Devices = () => {
 
   const fetchDevices = async () => {
     try {
-      const response = await axios.get('http://localhost:8000/api/devices/');
+      // Списку нужны только названия: батареи не загружаются и не передаются.
+      const response = await axios.get('http://localhost:8000/api/devices/', {
+        params: { fields: 'id,name' },
+      });
       setDevices(response.data);
     } catch (error) {
       console.error('Ошибка при загрузке устройств:', error);
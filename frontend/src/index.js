@@ -1,8 +1,13 @@
 import React from 'react';
 import ReactDOM from 'react-dom';
+import axios from 'axios';
 import './index.css';
 import App from './App';
 
+// Cookie окна чтения после записи должна отправляться в API, чтобы клиент
+// видел собственные изменения при чтении с реплик.
+axios.defaults.withCredentials = true;
+
 ReactDOM.render(
   <React.StrictMode>
     <App />